@@ -0,0 +1,16 @@
+"""
+Performance benchmarks for sphinxmixcrypto.
+
+Run them from the top of the source tree::
+
+  python -m benchmarks --output bench.json
+  python -m benchmarks --baseline bench.json
+
+and the mix network simulator with::
+
+  python -m benchmarks.simulator --nodes 10 --hops 5
+
+and the import time of the package against a budget with::
+
+  python -m benchmarks.importtime --budget 25
+"""
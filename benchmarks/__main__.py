@@ -0,0 +1,68 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import sys
+
+from benchmarks.cases import all_cases, MAX_HOPS, PAYLOAD_SIZES
+from benchmarks.harness import run_benchmark, write_results, load_results, compare, format_result
+
+
+def int_list(value):
+    return tuple(int(x) for x in value.split(","))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="sphinxmixcrypto benchmarks")
+    parser.add_argument("--operations", type=int, default=50, help="timed operations per case")
+    parser.add_argument("--max-hops", type=int_list, default=MAX_HOPS, help="comma separated max_hops sweep")
+    parser.add_argument("--payload-sizes", type=int_list, default=PAYLOAD_SIZES, help="comma separated payload_size sweep")
+    parser.add_argument("--filter", default="*", help="only run cases whose key matches this glob")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="ops/s drop counted as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    for case in all_cases(args.max_hops, args.payload_sizes):
+        if not fnmatch.fnmatch(case.key, args.filter):
+            continue
+        result = run_benchmark(case, args.operations)
+        print(format_result(result))
+        sys.stdout.flush()
+        results.append(result)
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.baseline:
+        rows, regressions = compare(results, load_results(args.baseline), args.threshold)
+        print()
+        for key, old, new, change in rows:
+            marker = "REGRESSION" if change < -args.threshold else ""
+            print("%-60s %12.1f -> %12.1f ops/s %+7.1f%% %s" % (key, old, new, change * 100, marker))
+        if regressions:
+            print("\n%d regression(s) beyond %.0f%%" % (len(regressions), args.threshold * 100))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+The benchmark cases: the crypto primitives, packet creation,
+unwrapping and the SURB reply flow, swept over max_hops and
+payload_size.
+"""
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, SphinxHeader, SphinxBody, SphinxClient, Nymserver
+from sphinxmixcrypto import UnwrappedMessage, NodeUnwrapper
+from sphinxmixcrypto import create_header, create_reply_block, sphinx_packet_unwrap
+from sphinxmixcrypto import GroupCurve25519, SphinxDigest, SphinxStreamCipher, SphinxLioness
+from sphinxmixcrypto import SECURITY_PARAMETER
+from sphinxmixcrypto.crypto_primitives import xor
+
+from benchmarks.fixtures import Mixnet, NullReplayCache
+from benchmarks.harness import Benchmark
+
+MAX_HOPS = (1, 5, 10, 20)
+PAYLOAD_SIZES = (512, 1024, 4096, 32768)
+MESSAGE = b"the quick brown fox jumps over the lazy dog"
+DESTINATION = b"client"
+
+
+def repeat(args):
+    return lambda n: [args] * n
+
+
+def primitive_cases(max_hops_sweep, payload_sizes):
+    group = GroupCurve25519()
+    digest = SphinxDigest()
+    stream_cipher = SphinxStreamCipher()
+    block_cipher = SphinxLioness()
+    mixnet = Mixnet(1)
+    secret = group.gensecret(mixnet.rand_reader)
+    alpha = group.expon(group.generator, secret)
+    hmac_key = digest.create_hmac_key(secret)
+    stream_key = digest.create_stream_cipher_key(secret)
+    block_key = block_cipher.create_block_cipher_key(secret)
+
+    yield Benchmark("GroupCurve25519.expon", {}, repeat((alpha, secret)), group.expon)
+    yield Benchmark("GroupCurve25519.makesecret", {}, repeat((secret,)), group.makesecret)
+    yield Benchmark("SphinxDigest.hash_blinding", {}, repeat((alpha, secret)), digest.hash_blinding)
+    yield Benchmark("SphinxDigest.hash_replay", {}, repeat((secret,)), digest.hash_replay)
+    yield Benchmark("SphinxDigest.create_hmac_key", {}, repeat((secret,)), digest.create_hmac_key)
+    yield Benchmark("SphinxDigest.create_stream_cipher_key", {}, repeat((secret,)), digest.create_stream_cipher_key)
+    yield Benchmark("SphinxLioness.create_block_cipher_key", {}, repeat((secret,)), block_cipher.create_block_cipher_key)
+    yield Benchmark("SphinxPacket.construct", {}, repeat((alpha, b"\x00" * 176, b"\x00" * 16, b"\x00" * 1024)), construct_packet)
+    for max_hops in max_hops_sweep:
+        params = SphinxParams(max_hops, 1024)
+        beta = b"\x00" * (2 * max_hops + 1) * SECURITY_PARAMETER
+        size = {"max_hops": max_hops}
+        yield Benchmark("SphinxDigest.hmac", size, repeat((hmac_key, beta)), digest.hmac)
+        yield Benchmark("SphinxStreamCipher.generate_stream", size,
+                        repeat((stream_key, params.beta_cipher_size)), stream_cipher.generate_stream)
+        yield Benchmark("xor", size, repeat((beta, beta)), xor)
+    for payload_size in payload_sizes:
+        block = b"\x00" * payload_size
+        size = {"payload_size": payload_size}
+        yield Benchmark("SphinxLioness.encrypt", size, repeat((block_key, block)), block_cipher.encrypt)
+        yield Benchmark("SphinxLioness.decrypt", size, repeat((block_key, block)), block_cipher.decrypt)
+
+
+def construct_packet(alpha, beta, gamma, delta):
+    """
+    Build the objects sphinx_packet_unwrap returns for a next hop.
+    """
+    packet = SphinxPacket(SphinxHeader(alpha, beta, gamma), SphinxBody(delta))
+    return UnwrappedMessage(next_hop=(b"\x00" * SECURITY_PARAMETER, packet), exit_hop=None, client_hop=None)
+
+
+def packet_cases(max_hops_sweep, payload_sizes):
+    for max_hops in max_hops_sweep:
+        mixnet = Mixnet(max_hops)
+        route = mixnet.route
+        rand_reader = mixnet.rand_reader
+        first_hop = mixnet.key_states[route[0]]
+
+        params = SphinxParams(max_hops, 1024)
+        yield Benchmark(
+            "create_header", {"max_hops": max_hops},
+            repeat((params, route, mixnet.pki, b"\x00", b"\x00" * SECURITY_PARAMETER, rand_reader)),
+            create_header)
+        yield Benchmark(
+            "create_reply_block", {"max_hops": max_hops},
+            repeat((params, route, mixnet.pki, DESTINATION, rand_reader)),
+            create_reply_block)
+
+        for payload_size in payload_sizes:
+            params = SphinxParams(max_hops, payload_size)
+            size = {"max_hops": max_hops, "payload_size": payload_size}
+            yield Benchmark(
+                "SphinxPacket.forward_message", size,
+                repeat((params, route, mixnet.pki, DESTINATION, MESSAGE, rand_reader)),
+                SphinxPacket.forward_message)
+
+            packet = SphinxPacket.forward_message(params, route, mixnet.pki, DESTINATION, MESSAGE, rand_reader)
+            yield Benchmark(
+                "sphinx_packet_unwrap", size,
+                repeat((params, NullReplayCache(), first_hop, packet)),
+                sphinx_packet_unwrap)
+            unwrapper = NodeUnwrapper(params, NullReplayCache(), first_hop)
+            yield Benchmark("NodeUnwrapper.unwrap", size, repeat((packet,)), unwrapper.unwrap)
+            yield Benchmark("NodeUnwrapper.unwrap_raw", size, repeat((packet.get_raw_bytes(),)), unwrapper.unwrap_raw)
+            yield Benchmark("NodeUnwrapper.unwrap_header", size, repeat((packet,)), unwrapper.unwrap_header)
+
+            yield Benchmark("Nymserver.process", size, nymserver_setup(params, mixnet), nymserver_process)
+            yield Benchmark("SphinxClient.decrypt", size, client_decrypt_setup(params, mixnet), client_decrypt)
+
+
+def nymserver_setup(params, mixnet):
+    def setup(n):
+        nymserver = Nymserver(params)
+        for i in range(n):
+            _, _, nymtuple = create_reply_block(params, mixnet.route, mixnet.pki, DESTINATION, mixnet.rand_reader)
+            nymserver.add_surb(b"nym", nymtuple)
+        return [(nymserver, b"nym", MESSAGE)] * n
+    return setup
+
+
+def nymserver_process(nymserver, nym, message):
+    return nymserver.process(nym, message)
+
+
+def client_decrypt_setup(params, mixnet):
+    """
+    Send n replies through the whole route so that the
+    client has n real reply deltas to decrypt.
+    """
+    def setup(n):
+        client = SphinxClient(params, DESTINATION, mixnet.rand_reader)
+        nymserver = Nymserver(params)
+        for i in range(n):
+            nymserver.add_surb(b"nym", client.create_nym(mixnet.route, mixnet.pki))
+        arguments = []
+        for i in range(n):
+            result = nymserver.process(b"nym", MESSAGE).message_result
+            while result.next_hop is not None:
+                node_id, packet = result.next_hop
+                result = sphinx_packet_unwrap(params, NullReplayCache(), mixnet.key_states[node_id], packet)
+            _, message_id, body = result.client_hop
+            arguments.append((client, message_id, body.delta))
+        return arguments
+    return setup
+
+
+def client_decrypt(client, message_id, delta):
+    return client.decrypt(message_id, delta)
+
+
+def all_cases(max_hops_sweep=MAX_HOPS, payload_sizes=PAYLOAD_SIZES):
+    for case in primitive_cases(max_hops_sweep, payload_sizes):
+        yield case
+    for case in packet_cases(max_hops_sweep, payload_sizes):
+        yield case
@@ -0,0 +1,118 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Mix network stand-ins used by the benchmarks: an entropy
+source, a dict based PKI, node key state and a replay cache
+which never reports a replay so a packet can be unwrapped
+over and over.
+"""
+
+import os
+import zope.interface
+
+from sphinxmixcrypto import IReader, IMixPKI, IKeyState, IPacketReplayCache
+from sphinxmixcrypto import GroupCurve25519, SECURITY_PARAMETER
+
+
+@zope.interface.implementer(IReader)
+class RandReader(object):
+
+    def read(self, n):
+        return os.urandom(n)
+
+
+@zope.interface.implementer(IKeyState)
+class NodeKeyState(object):
+
+    def __init__(self, public_key, private_key):
+        self.public_key = public_key
+        self.private_key = private_key
+
+    def get_private_key(self):
+        return self.private_key
+
+    def get_public_key(self):
+        return self.public_key
+
+
+@zope.interface.implementer(IPacketReplayCache)
+class NullReplayCache(object):
+
+    def has_seen(self, tag):
+        return False
+
+    def set_seen(self, tag):
+        pass
+
+    def flush(self):
+        pass
+
+
+@zope.interface.implementer(IMixPKI)
+class DictPKI(object):
+
+    def __init__(self):
+        self.node_map = {}
+        self.addr_map = {}
+
+    def set(self, node_id, pub_key, addr):
+        assert node_id not in self.node_map
+        self.node_map[node_id] = pub_key
+        self.addr_map[node_id] = addr
+
+    def get(self, node_id):
+        return self.node_map[node_id]
+
+    def identities(self):
+        return list(self.node_map.keys())
+
+    def get_mix_addr(self, transport_name, node_id):
+        return self.addr_map[node_id]
+
+    def rotate(self, node_id, new_pub_key, signature):
+        pass
+
+
+def generate_node_id(rand_reader):
+    return b"\xff" + rand_reader.read(SECURITY_PARAMETER - 1)
+
+
+def generate_node_keypair(rand_reader):
+    group = GroupCurve25519()
+    private_key = group.gensecret(rand_reader)
+    public_key = group.expon(group.generator, private_key)
+    return public_key, private_key
+
+
+class Mixnet(object):
+    """
+    I hold num_nodes mix nodes registered in a DictPKI
+    along with the key state of each of them.
+    """
+
+    def __init__(self, num_nodes, rand_reader=None):
+        self.rand_reader = rand_reader or RandReader()
+        self.pki = DictPKI()
+        self.key_states = {}
+        self.route = []
+        for i in range(num_nodes):
+            node_id = generate_node_id(self.rand_reader)
+            public_key, private_key = generate_node_keypair(self.rand_reader)
+            self.pki.set(node_id, public_key, i)
+            self.key_states[node_id] = NodeKeyState(public_key, private_key)
+            self.route.append(node_id)
@@ -0,0 +1,179 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Timing, allocation accounting and baseline comparison
+for the benchmarks.
+"""
+
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+RESULTS_VERSION = 1
+
+
+def percentile(sorted_samples, fraction):
+    """
+    Nearest rank percentile of an already sorted list.
+    """
+    assert sorted_samples
+    rank = int(round(fraction * (len(sorted_samples) - 1)))
+    return sorted_samples[rank]
+
+
+class Benchmark(object):
+    """
+    I am one benchmark case: a name, the parameters it was run with
+    and a setup function which is called with the number of operations
+    and returns a list of argument tuples, one per operation, for the
+    operation under test.
+    """
+
+    def __init__(self, name, params, setup, operation):
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.operation = operation
+
+    @property
+    def key(self):
+        return "%s[%s]" % (self.name, ",".join("%s=%s" % x for x in sorted(self.params.items())))
+
+
+def _allocations_per_op(operation, arguments):
+    """
+    Returns the mean number of memory blocks still allocated for the
+    result of an operation when it returns, and the mean peak of
+    bytes traced by tracemalloc while it runs. Operations may consume
+    their arguments so each measurement gets its own argument tuple.
+    Both are 0.0 when there are no arguments to measure with.
+    """
+    blocks = 0
+    peak = 0
+    count = len(arguments) // 2
+    for args in arguments[:count]:
+        before = sys.getallocatedblocks()
+        result = operation(*args)
+        blocks += max(0, sys.getallocatedblocks() - before)
+        del result
+    for args in arguments[count:]:
+        tracemalloc.start()
+        try:
+            operation(*args)
+            peak += tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    traced = len(arguments) - count
+    return float(blocks) / count if count else 0.0, float(peak) / traced if traced else 0.0
+
+
+def run_benchmark(benchmark, operations, allocation_operations=4, warmup=2):
+    """
+    Run a Benchmark, returns a dict of its measurements.
+    """
+    arguments = benchmark.setup(warmup + operations + 2 * allocation_operations)
+    operation = benchmark.operation
+    for args in arguments[:warmup]:
+        operation(*args)
+    timed = arguments[warmup:warmup + operations]
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        clock = time.perf_counter
+        for args in timed:
+            start = clock()
+            operation(*args)
+            samples.append(clock() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    samples.sort()
+    total = sum(samples)
+    blocks, peak = _allocations_per_op(operation, arguments[warmup + operations:])
+    return {
+        "name": benchmark.name,
+        "params": benchmark.params,
+        "key": benchmark.key,
+        "operations": len(samples),
+        "ops_per_sec": len(samples) / total if total > 0 else float("inf"),
+        "latency_p50": percentile(samples, 0.50),
+        "latency_p90": percentile(samples, 0.90),
+        "latency_p99": percentile(samples, 0.99),
+        "latency_max": samples[-1],
+        "allocations_per_op": blocks,
+        "peak_bytes_per_op": peak,
+    }
+
+
+def environment():
+    return {
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def write_results(path, results):
+    document = {
+        "version": RESULTS_VERSION,
+        "environment": environment(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        document = json.load(f)
+    assert document.get("version") == RESULTS_VERSION
+    return document["results"]
+
+
+def compare(results, baseline, threshold=0.10):
+    """
+    Compare results against baseline results, returns a list of
+    (key, baseline ops/s, current ops/s, relative change) for every
+    case present in both, and the subset of them which regressed by
+    more than threshold.
+    """
+    previous = dict((x["key"], x) for x in baseline)
+    rows = []
+    regressions = []
+    for result in results:
+        old = previous.get(result["key"])
+        if old is None:
+            continue
+        change = (result["ops_per_sec"] - old["ops_per_sec"]) / old["ops_per_sec"]
+        row = (result["key"], old["ops_per_sec"], result["ops_per_sec"], change)
+        rows.append(row)
+        if change < -threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def format_result(result):
+    return "%-60s %12.1f ops/s  p50 %9.1fus  p99 %9.1fus  %8.1f allocs/op  %10.0f B/op" % (
+        result["key"], result["ops_per_sec"],
+        result["latency_p50"] * 1e6, result["latency_p99"] * 1e6,
+        result["allocations_per_op"], result["peak_bytes_per_op"])
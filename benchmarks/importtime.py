@@ -0,0 +1,85 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Measure the startup cost of importing sphinxmixcrypto with
+``python -X importtime`` in a fresh interpreter and check it against
+a time budget, for CLI tools and short lived workers.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+DEFAULT_STATEMENT = "import sphinxmixcrypto; sphinxmixcrypto.SphinxParams(5, 1024)"
+DEFAULT_BUDGET_MS = 25.0
+
+
+def measure_import(statement=DEFAULT_STATEMENT, runs=5, package="sphinxmixcrypto"):
+    """
+    Run statement in runs fresh interpreters, returns the smallest
+    time spent importing package and its modules, in milliseconds,
+    and the rows of the fastest run, (self ms, cumulative ms, module
+    name) tuples sorted by self time. Modules imported by the
+    interpreter itself are left out of the total.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    best = None
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stderr
+        rows = []
+        total = 0.0
+        for line in output.decode("utf-8").splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            own, cumulative, name = line[len("import time:"):].split("|")
+            depth = len(name) - len(name.lstrip())
+            row = (int(own) / 1000.0, int(cumulative) / 1000.0, name.strip())
+            rows.append(row)
+            if depth == 1 and row[2].split(".")[0] == package:
+                total += row[1]
+        if best is None or total < best[0]:
+            best = (total, sorted(rows, reverse=True))
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime", description="sphinxmixcrypto import time")
+    parser.add_argument("--statement", default=DEFAULT_STATEMENT, help="python statement to time")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters started, the fastest is kept")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS, help="import time budget in ms")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules shown")
+    args = parser.parse_args(argv)
+
+    total, rows = measure_import(args.statement, args.runs)
+    for own, cumulative, name in rows[:args.top]:
+        print("%10.2f ms %10.2f ms  %s" % (own, cumulative, name))
+    print("\n%.2f ms total, budget %.2f ms" % (total, args.budget))
+    if total > args.budget:
+        print("over budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
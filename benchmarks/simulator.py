@@ -0,0 +1,330 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+An in-process mix network simulator: N mix nodes registered in a
+DictPKI, a client and a Nymserver exchanging forward messages and
+SURB replies over asyncio queues or local TCP sockets, reporting end
+to end packets/s and latency, per hop latency and CPU time per node.
+
+Run it with::
+
+    python -m benchmarks.simulator --nodes 10 --hops 5 --forward 200 --replies 200
+"""
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import binascii
+import random
+import struct
+import sys
+import time
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, SphinxClient, Nymserver, PacketReplayCacheDict
+from sphinxmixcrypto import sphinx_packet_unwrap
+
+from benchmarks.fixtures import Mixnet, RandReader
+from benchmarks.harness import percentile
+
+TRANSPORTS = ("queue", "socket")
+DESTINATION = b"dest"
+CLIENT_ID = b"client"
+NYM = b"nym"
+
+
+def _latency_stats(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": percentile(samples, 0.50),
+        "p90": percentile(samples, 0.90),
+        "p99": percentile(samples, 0.99),
+        "max": samples[-1],
+    }
+
+
+class SimulatedNode(object):
+    """
+    I am a mix node of the simulation: I unwrap the packets arriving
+    in my inbox and hand the results back to the Simulation, keeping
+    count of my packets, CPU time and per hop latency, the time from
+    a packet's arrival until it was unwrapped.
+    """
+
+    def __init__(self, simulation, node_id, key_state):
+        self.simulation = simulation
+        self.node_id = node_id
+        self.key_state = key_state
+        self.replay_cache = PacketReplayCacheDict()
+        self.inbox = asyncio.Queue()
+        self.packets = 0
+        self.cpu_seconds = 0.0
+        self.hop_latencies = []
+
+    async def run(self):
+        params = self.simulation.params
+        while True:
+            arrived, packet = await self.inbox.get()
+            cpu = time.thread_time()
+            result = sphinx_packet_unwrap(params, self.replay_cache, self.key_state, packet)
+            self.cpu_seconds += time.thread_time() - cpu
+            self.packets += 1
+            self.hop_latencies.append(time.perf_counter() - arrived)
+            await self.simulation.route_result(result)
+
+    def report(self):
+        return {
+            "packets": self.packets,
+            "cpu_seconds": self.cpu_seconds,
+            "hop_latency": _latency_stats(self.hop_latencies),
+        }
+
+
+class Simulation(object):
+    """
+    I build a mix network of num_nodes nodes and push traffic
+    through it. Every message takes a random route of hops nodes.
+
+    :param transport: "queue" hands packets between nodes over
+    asyncio queues, "socket" sends their raw bytes over local
+    TCP connections.
+    """
+
+    def __init__(self, num_nodes, hops, params=None, transport="queue", seed=None):
+        assert transport in TRANSPORTS
+        if params is None:
+            params = SphinxParams(hops, 1024)
+        assert hops <= min(num_nodes, params.max_hops)
+        self.params = params
+        self.hops = hops
+        self.transport = transport
+        self.random = random.Random(seed)
+        self.rand_reader = RandReader()
+        self.mixnet = Mixnet(num_nodes, self.rand_reader)
+        self.pki = self.mixnet.pki
+        self.client = SphinxClient(params, CLIENT_ID, self.rand_reader)
+        self.nymserver = Nymserver(params)
+        self.nodes = {}
+        self._sent = {}
+        self._latencies = []
+        self._done = None
+        self._sending = False
+        self._servers = []
+        self._writers = {}
+        self._handlers = set()
+
+    def _route(self):
+        return self.random.sample(self.mixnet.route, self.hops)
+
+    def _message(self, seq):
+        return struct.pack(">Q", seq)
+
+    async def send(self, node_id, packet):
+        """
+        Deliver a packet to a node over the transport.
+        """
+        if self.transport == "queue":
+            self.nodes[node_id].inbox.put_nowait((time.perf_counter(), packet))
+            return
+        writer = self._writers.get(node_id)
+        if writer is None:
+            host, port = self.pki.get_mix_addr("tcp", node_id)
+            _, writer = await asyncio.open_connection(host, port)
+            self._writers[node_id] = writer
+        writer.writelines(packet.get_buffers())
+        await writer.drain()
+
+    async def route_result(self, result):
+        if result.next_hop is not None:
+            node_id, packet = result.next_hop
+            await self.send(node_id, packet)
+        elif result.exit_hop is not None:
+            self._delivered(result.exit_hop[1])
+        else:
+            _, message_id, body = result.client_hop
+            self._delivered(self.client.decrypt(message_id, body.delta).payload)
+
+    def _delivered(self, message):
+        seq = struct.unpack(">Q", message[:8])[0]
+        self._latencies.append(time.perf_counter() - self._sent.pop(seq))
+        self._check_done()
+
+    def _check_done(self):
+        # every message was sent and delivered
+        if not self._sending and not self._sent and not self._done.done():
+            self._done.set_result(None)
+
+    def _node_stopped(self, task):
+        if task.cancelled() or self._done.done():
+            return
+        exc = task.exception()
+        self._done.set_exception(exc if exc is not None else RuntimeError("mix node stopped"))
+
+    def _serve(self, node):
+        size = sum(self.params.get_dimensions())
+
+        async def handle(reader, writer):
+            task = asyncio.current_task()
+            self._handlers.add(task)
+            try:
+                while True:
+                    raw = await reader.readexactly(size)
+                    packet = SphinxPacket.from_raw_bytes(self.params, raw)
+                    node.inbox.put_nowait((time.perf_counter(), packet))
+            except asyncio.IncompleteReadError:
+                pass
+            finally:
+                self._handlers.discard(task)
+                writer.close()
+        return handle
+
+    async def _start(self):
+        for node_id, key_state in self.mixnet.key_states.items():
+            node = self.nodes[node_id] = SimulatedNode(self, node_id, key_state)
+            if self.transport == "socket":
+                server = await asyncio.start_server(self._serve(node), "127.0.0.1", 0)
+                self.pki.addr_map[node_id] = server.sockets[0].getsockname()[:2]
+                self._servers.append(server)
+        tasks = [asyncio.ensure_future(node.run()) for node in self.nodes.values()]
+        for task in tasks:
+            task.add_done_callback(self._node_stopped)
+        return tasks
+
+    async def _stop(self, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for server in self._servers:
+            server.close()
+        # closing the connections ends the handlers, which would log
+        # a traceback from the stream protocol if cancelled instead
+        writers = list(self._writers.values())
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*[writer.wait_closed() for writer in writers], return_exceptions=True)
+        handlers = list(self._handlers)
+        if handlers:
+            await asyncio.wait(handlers, timeout=1.0)
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._writers = {}
+        self._servers = []
+
+    async def run(self, forward=100, replies=100):
+        """
+        Send forward messages to an exit destination and replies
+        through the Nymserver to the client, returns the report
+        once all of them were delivered.
+        """
+        assert forward + replies > 0
+        self._done = asyncio.get_event_loop().create_future()
+        tasks = await self._start()
+        try:
+            packets = []
+            for seq in range(forward):
+                route = self._route()
+                packet = SphinxPacket.forward_message(self.params, route, self.pki, DESTINATION,
+                                                      self._message(seq), self.rand_reader)
+                packets.append((seq, route[0], packet))
+            for i in range(replies):
+                self.nymserver.add_surb(NYM, self.client.create_nym(self._route(), self.pki))
+
+            started = time.perf_counter()
+            self._sending = True
+            for seq, node_id, packet in packets:
+                self._sent[seq] = time.perf_counter()
+                await self.send(node_id, packet)
+            for seq in range(forward, forward + replies):
+                self._sent[seq] = time.perf_counter()
+                node_id, packet = self.nymserver.process(NYM, self._message(seq)).message_result.next_hop
+                await self.send(node_id, packet)
+            self._sending = False
+            self._check_done()
+            await self._done
+            duration = time.perf_counter() - started
+        finally:
+            await self._stop(tasks)
+        return self.report(forward + replies, duration)
+
+    def report(self, messages, duration):
+        hop_latencies = []
+        for node in self.nodes.values():
+            hop_latencies.extend(node.hop_latencies)
+        hop_packets = sum(node.packets for node in self.nodes.values())
+        return {
+            "nodes": len(self.nodes),
+            "hops": self.hops,
+            "transport": self.transport,
+            "max_hops": self.params.max_hops,
+            "payload_size": self.params.payload_size,
+            "messages": messages,
+            "duration": duration,
+            "messages_per_second": messages / duration,
+            "hop_packets_per_second": hop_packets / duration,
+            "latency": _latency_stats(self._latencies),
+            "hop_latency": _latency_stats(hop_latencies),
+            "per_node": dict((binascii.hexlify(node_id).decode("ascii"), node.report())
+                             for node_id, node in self.nodes.items()),
+        }
+
+
+def format_report(report):
+    lines = [
+        "%(nodes)d nodes, %(hops)d hops, %(transport)s transport, payload_size %(payload_size)d" % report,
+        "%d messages in %.3fs: %.1f messages/s, %.1f hop packets/s" % (
+            report["messages"], report["duration"], report["messages_per_second"], report["hop_packets_per_second"]),
+        "end to end latency p50 %.6fs p99 %.6fs" % (report["latency"]["p50"], report["latency"]["p99"]),
+        "per hop latency    p50 %.6fs p99 %.6fs" % (report["hop_latency"]["p50"], report["hop_latency"]["p99"]),
+    ]
+    for node_id, node in sorted(report["per_node"].items()):
+        lines.append("  %s %6d packets %8.3fs cpu" % (node_id, node["packets"], node["cpu_seconds"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.simulator", description="mix network simulator")
+    parser.add_argument("--nodes", type=int, default=10, help="mix nodes in the network")
+    parser.add_argument("--hops", type=int, default=5, help="hops of every route")
+    parser.add_argument("--max-hops", type=int, default=None, help="SphinxParams max_hops, defaults to --hops")
+    parser.add_argument("--payload-size", type=int, default=1024, help="SphinxParams payload_size")
+    parser.add_argument("--forward", type=int, default=100, help="forward messages to send")
+    parser.add_argument("--replies", type=int, default=100, help="SURB replies to send")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="queue")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the route selection")
+    args = parser.parse_args(argv)
+
+    params = SphinxParams(args.max_hops or args.hops, args.payload_size)
+    simulation = Simulation(args.nodes, args.hops, params, args.transport, args.seed)
+    loop = asyncio.new_event_loop()
+    try:
+        report = loop.run_until_complete(simulation.run(args.forward, args.replies))
+    finally:
+        loop.close()
+    print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,6 +23,7 @@ class SphinxNodeKeyState(object):
     def get_public_key(self):
         pass
 
+
 @given(
     binary(),
     binary(),
@@ -37,6 +38,7 @@ def test_hypothesis_toosmall_body_size(alpha, beta, gamma, delta, private_key):
     key_state = SphinxNodeKeyState(private_key=private_key)
     py.test.raises(SphinxBodySizeMismatchError, sphinx_packet_unwrap, params, replay_cache, key_state, packet)
 
+
 @given(
     binary(),
     binary(),
@@ -64,13 +66,14 @@ def test_hypothesis_scalarmult_error(alpha, beta, gamma, delta, private_key):
     params = SphinxParams(max_hops=5, payload_size=1024)
     replay_cache = PacketReplayCacheDict()
     key_state = SphinxNodeKeyState(private_key=private_key)
+
     def assumptions_wrap():
         try:
             _ = sphinx_packet_unwrap(params, replay_cache, key_state, packet)
             raise Exception("wtf")
-        except IncorrectMACError, _:
+        except IncorrectMACError:
             assume(False)
-        except AssertionError, _:
+        except AssertionError:
             return
 
     assumptions_wrap()
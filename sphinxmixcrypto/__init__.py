@@ -9,24 +9,68 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import with_statement
 
-from pylioness._metadata import __version__, __author__, __contact__
-from pylioness._metadata import __license__, __copyright__, __url__
+from importlib import import_module
+
+from sphinxmixcrypto._metadata import __version__, __author__, __contact__
+from sphinxmixcrypto._metadata import __license__, __copyright__, __url__
 
 from sphinxmixcrypto.errors import CorruptMessageError, NymKeyNotFoundError, IncorrectMACError, SphinxNoSURBSAvailableError
 from sphinxmixcrypto.errors import ReplayError, HeaderAlphaGroupMismatchError, InvalidMessageTypeError, SphinxBodySizeMismatchError
+from sphinxmixcrypto.errors import InvalidProcessDestinationError
+from sphinxmixcrypto.errors import SURBLogFormatError, TraceFormatError, FramingError, PKISnapshotFormatError
+from sphinxmixcrypto.errors import ReadOnlyPKIError, NymMessageSizeError
+from sphinxmixcrypto.errors import FragmentError, AggregateError
+
+from sphinxmixcrypto.params import SphinxParams, SECURITY_PARAMETER, destination_encode, prefix_free_decode
+
+# The names below are imported from their module on first use, so that
+# importing the package does not load the crypto backends, zope.interface
+# or asyncio until they are needed.
+_LAZY_IMPORTS = {
+    "sphinxmixcrypto.client": (
+        "SphinxClient", "create_header", "create_reply_block", "ClientMessage",
+        "SphinxPacket", "SphinxHeader", "SphinxBody",
+    ),
+    "sphinxmixcrypto.node": (
+        "sphinx_packet_unwrap", "PacketReplayCacheDict", "NodeUnwrapper", "UnwrappedMessage", "UnwrappedHeader",
+    ),
+    "sphinxmixcrypto.crypto_primitives": ("GroupCurve25519", "SphinxLioness", "SphinxStreamCipher", "SphinxDigest"),
+    "sphinxmixcrypto.nym_server": ("Nymserver", "SURBStoreDict"),
+    "sphinxmixcrypto.surb_log": ("SURBLogStore",),
+    "sphinxmixcrypto.padding": ("add_padding", "remove_padding", "pad_into"),
+    "sphinxmixcrypto.interfaces": ("IReader", "IMixPKI", "IPacketReplayCache", "IKeyState", "ISURBStore", "IInstrumentSink"),
+    "sphinxmixcrypto.instrumentation": ("HistogramSink",),
+    "sphinxmixcrypto.metrics": ("UnwrapMetrics",),
+    "sphinxmixcrypto.admission": ("AdmissionControl", "AdmissionPolicy"),
+    "sphinxmixcrypto.trace": ("TraceRecorder", "TraceReader"),
+    "sphinxmixcrypto.keyring": ("NodeKeyring",),
+    "sphinxmixcrypto.scheduler": ("TimingWheel", "DelayScheduler"),
+    "sphinxmixcrypto.pool_mix": ("ThresholdMix", "TimedPoolMix"),
+    "sphinxmixcrypto.dispatch": ("OutboundDispatcher",),
+    "sphinxmixcrypto.pki": ("IndexedMixPKI",),
+    "sphinxmixcrypto.pki_snapshot": ("SnapshotMixPKI", "write_snapshot"),
+    "sphinxmixcrypto.pki_cache": ("CachingMixPKI",),
+    "sphinxmixcrypto.cover": ("CoverTraffic", "CoverPolicy", "cover_kind"),
+    "sphinxmixcrypto.fragment": ("ReassemblyBuffer", "fragment_packets"),
+    "sphinxmixcrypto.aggregate": ("MessageAggregator", "split_exit_hop"),
+    "sphinxmixcrypto.framing": ("read_packets", "frame_packet", "AsyncPacketReader"),
+}
+
+_LAZY_MODULES = dict((name, module) for module, names in _LAZY_IMPORTS.items() for name in names)
+
+
+def __getattr__(name):
+    module = _LAZY_MODULES.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(import_module(module), name)
+    globals()[name] = value
+    return value
+
 
-from sphinxmixcrypto.client import SphinxClient, create_header
-from sphinxmixcrypto.client import create_reply_block, ClientMessage, destination_encode
-from sphinxmixcrypto.client import SphinxPacket, SphinxHeader, SphinxBody, SphinxParams
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_MODULES))
 
-from sphinxmixcrypto.node import sphinx_packet_unwrap, prefix_free_decode, SECURITY_PARAMETER
-from sphinxmixcrypto.node import PacketReplayCacheDict
-from sphinxmixcrypto.node import InvalidProcessDestinationError
-from sphinxmixcrypto.node import UnwrappedMessage
-from sphinxmixcrypto.crypto_primitives import GroupCurve25519, SphinxLioness, SphinxStreamCipher, SphinxDigest
-from sphinxmixcrypto.nym_server import Nymserver
-from sphinxmixcrypto.padding import add_padding, remove_padding
-from sphinxmixcrypto.interfaces import IReader, IMixPKI, IPacketReplayCache, IKeyState
 
 __all__ = [
     "SECURITY_PARAMETER",
@@ -40,11 +84,21 @@ __all__ = [
     "IncorrectMACError",
     "HeaderAlphaGroupMismatchError",
     "ReaplayError",
+    "SURBLogFormatError",
+    "TraceFormatError",
+    "FramingError",
+    "PKISnapshotFormatError",
+    "ReadOnlyPKIError",
+    "NymMessageSizeError",
+    "FragmentError",
+    "AggregateError",
 
     "IMixPKI",
     "IPacketReplayCache",
     "IKeyState",
     "IReader",
+    "ISURBStore",
+    "IInstrumentSink",
 
     "SphinxPacket",
     "SphinxHeader",
@@ -53,8 +107,32 @@ __all__ = [
     "SphinxParams",
     "SphinxClient",
     "UnwrappedMessage",
+    "UnwrappedHeader",
     "PacketReplayCacheDict",
+    "NodeUnwrapper",
+    "NodeKeyring",
+    "TimingWheel",
+    "DelayScheduler",
+    "ThresholdMix",
+    "TimedPoolMix",
+    "OutboundDispatcher",
+    "IndexedMixPKI",
+    "SnapshotMixPKI",
+    "CachingMixPKI",
+    "CoverTraffic",
+    "CoverPolicy",
+    "ReassemblyBuffer",
+    "MessageAggregator",
     "Nymserver",
+    "SURBStoreDict",
+    "SURBLogStore",
+    "HistogramSink",
+    "UnwrapMetrics",
+    "AdmissionControl",
+    "AdmissionPolicy",
+    "TraceRecorder",
+    "TraceReader",
+    "AsyncPacketReader",
     "GroupCurve25519",
     "SphinxLioness",
     "SphinxStreamCipher",
@@ -67,6 +145,13 @@ __all__ = [
     "create_header",
     "add_padding",
     "remove_padding",
+    "pad_into",
+    "read_packets",
+    "frame_packet",
+    "write_snapshot",
+    "fragment_packets",
+    "split_exit_hop",
+    "cover_kind",
     "destination_encode",
     "prefix_free_decode",
     "RandReader",
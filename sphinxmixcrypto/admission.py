@@ -0,0 +1,240 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements cheap admission control which mix nodes
+can run before the expensive X25519 step of sphinx_packet_unwrap:
+per upstream peer token buckets, a filter dropping exact duplicate
+packets and load shedding driven by the input queue depth.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import attr
+
+from sphinxmixcrypto.client import SphinxParams, SphinxPacket
+from sphinxmixcrypto.params import CURVE25519_SIZE
+from sphinxmixcrypto.metrics import ShardedCounters
+
+
+ADMIT = "admit"
+REJECT_MALFORMED = "malformed"
+REJECT_OVERLOADED = "overloaded"
+REJECT_RATE_LIMITED = "rate_limited"
+REJECT_DUPLICATE = "duplicate"
+
+ADMISSION_DECISIONS = (ADMIT, REJECT_MALFORMED, REJECT_OVERLOADED, REJECT_RATE_LIMITED, REJECT_DUPLICATE)
+
+
+@attr.s(frozen=True)
+class AdmissionPolicy(object):
+    """
+    I am the configuration of AdmissionControl.
+
+    :param peer_rate: Packets per second each peer may send, None
+    disables rate limiting.
+
+    :param peer_burst: Packets a peer may send in a burst.
+
+    :param max_peers: Token buckets kept, the least recently
+    seen peer's bucket is dropped beyond this.
+
+    :param dedup_capacity: Packets remembered by the duplicate
+    filter per generation, two generations are kept; 0 disables it.
+
+    :param shed_low_watermark: Queue depth above which packets
+    start being shed with increasing probability.
+
+    :param shed_high_watermark: Queue depth at and above which
+    every packet is shed.
+    """
+    peer_rate = attr.ib(default=1000.0, validator=attr.validators.optional(attr.validators.instance_of(float)))
+    peer_burst = attr.ib(default=2000.0, validator=attr.validators.instance_of(float))
+    max_peers = attr.ib(default=65536, validator=attr.validators.instance_of(int))
+    dedup_capacity = attr.ib(default=1 << 20, validator=attr.validators.instance_of(int))
+    shed_low_watermark = attr.ib(default=1000, validator=attr.validators.instance_of(int))
+    shed_high_watermark = attr.ib(default=10000, validator=attr.validators.instance_of(int))
+
+
+class TokenBucket(object):
+    """
+    I am a token bucket holding up to burst tokens,
+    refilled at rate tokens per second.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """
+        Take a token, returns False if none are left.
+        """
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens < 1.0:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1.0
+        return True
+
+
+def packet_digest(*segments):
+    """
+    Returns the 16 byte BLAKE2b digest of a whole packet given
+    as one or more consecutive byte segments.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for segment in segments:
+        h.update(segment)
+    return h.digest()
+
+
+class PacketDedupFilter(object):
+    """
+    I remember the digests of recently seen packets in two
+    generations of at most capacity entries each, so that
+    memory stays bounded. The whole packet is digested rather
+    than its alpha alone: a peer altering beta, gamma or delta
+    of a packet it saw must not get the genuine packet dropped
+    before its MAC is ever checked.
+    """
+
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self._current = set()
+        self._previous = set()
+
+    def seen(self, digest):
+        """
+        Returns True if digest was seen before, otherwise
+        remembers it and returns False.
+        """
+        if digest in self._current or digest in self._previous:
+            return True
+        self._current.add(digest)
+        if len(self._current) >= self.capacity:
+            self._previous = self._current
+            self._current = set()
+        return False
+
+
+class AdmissionControl(object):
+    """
+    I decide whether a packet received from an upstream peer is
+    worth unwrapping. The checks run cheapest first: packet length,
+    load shedding, the peer's token bucket and finally the duplicate
+    packet filter. Duplicates dropped here would otherwise only be
+    rejected as replays after the X25519 exponentiation.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param AdmissionPolicy policy: The admission policy.
+
+    :param clock: A function returning the current time in seconds.
+
+    :param rng: A function returning a float in [0, 1), used
+    to shed load probabilistically.
+    """
+
+    def __init__(self, params, policy=None, clock=time.monotonic, rng=random.random):
+        assert isinstance(params, SphinxParams)
+        if policy is None:
+            policy = AdmissionPolicy()
+        assert isinstance(policy, AdmissionPolicy)
+        assert policy.shed_low_watermark < policy.shed_high_watermark
+        self.params = params
+        self.policy = policy
+        self.clock = clock
+        self.rng = rng
+        self.counters = ShardedCounters(ADMISSION_DECISIONS)
+        self._packet_size = sum(params.get_dimensions())
+        self._buckets = OrderedDict()
+        self._dedup = PacketDedupFilter(policy.dedup_capacity) if policy.dedup_capacity > 0 else None
+        self._lock = threading.Lock()
+
+    def _shed(self, queue_depth):
+        low = self.policy.shed_low_watermark
+        if queue_depth <= low:
+            return False
+        high = self.policy.shed_high_watermark
+        if queue_depth >= high:
+            return True
+        return self.rng() < float(queue_depth - low) / (high - low)
+
+    def _rate_limited(self, peer):
+        policy = self.policy
+        if policy.peer_rate is None:
+            return False
+        now = self.clock()
+        bucket = self._buckets.pop(peer, None)
+        if bucket is None:
+            bucket = TokenBucket(policy.peer_rate, policy.peer_burst, now)
+            if len(self._buckets) >= policy.max_peers:
+                self._buckets.popitem(last=False)
+        self._buckets[peer] = bucket
+        return not bucket.take(now)
+
+    def _decide(self, peer, segments, well_formed, queue_depth):
+        if not well_formed:
+            return REJECT_MALFORMED
+        if self._shed(queue_depth):
+            return REJECT_OVERLOADED
+        with self._lock:
+            if self._rate_limited(peer):
+                return REJECT_RATE_LIMITED
+            if self._dedup is not None and self._dedup.seen(packet_digest(*segments)):
+                return REJECT_DUPLICATE
+        return ADMIT
+
+    def admit(self, peer, sphinx_packet, queue_depth=0):
+        """
+        Returns ADMIT or the reason for rejecting a SphinxPacket
+        received from peer while queue_depth packets are waiting.
+        """
+        assert isinstance(sphinx_packet, SphinxPacket)
+        header = sphinx_packet.header
+        well_formed = len(header.alpha) == CURVE25519_SIZE and len(sphinx_packet.body.delta) == self.params.payload_size
+        segments = (header.alpha, header.beta, header.gamma, sphinx_packet.body.delta)
+        decision = self._decide(peer, segments, well_formed, queue_depth)
+        self.counters.increment(decision)
+        return decision
+
+    def admit_raw(self, peer, raw_packet, queue_depth=0):
+        """
+        Returns ADMIT or the reason for rejecting a raw packet,
+        without decoding it into a SphinxPacket.
+        """
+        well_formed = len(raw_packet) == self._packet_size
+        decision = self._decide(peer, (raw_packet,), well_formed, queue_depth)
+        self.counters.increment(decision)
+        return decision
+
+    def snapshot(self):
+        """
+        Returns a dict of admission decision to count.
+        """
+        return self.counters.totals()
@@ -0,0 +1,286 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module packs several small messages for the same destination
+into the payload of one forward message, so that they share the cost
+of one header and one body encryption. An aggregate payload is an 8
+byte header, a 4 byte magic and the length of the rest of the payload,
+followed by each message prefixed with its length as a varint. Pending
+messages are sent once the payload is full or their flush deadline has
+passed, and unpacked again at the exit hop.
+"""
+
+import asyncio
+import struct
+import time
+
+from sphinxmixcrypto.client import SphinxPacket
+from sphinxmixcrypto.params import SphinxParams
+from sphinxmixcrypto.interfaces import IMixPKI, IReader
+from sphinxmixcrypto.fragment import max_message_size
+from sphinxmixcrypto.scheduler import wait_event
+from sphinxmixcrypto.errors import AggregateError
+
+
+AGGREGATE_MAGIC = b"\xa9AGG"
+
+# magic, length of the messages
+_AGGREGATE_HEADER = struct.Struct(">4sI")
+AGGREGATE_HEADER_SIZE = _AGGREGATE_HEADER.size
+
+AGGREGATOR_COUNTERS = ("messages", "packets", "full_flushes", "deadline_flushes")
+
+
+def varint_size(n):
+    size = 1
+    while n >= 0x80:
+        n >>= 7
+        size += 1
+    return size
+
+
+def encode_varint(n):
+    """
+    Encode a non-negative integer seven bits per byte, least
+    significant first, the high bit set on all but the last byte.
+    """
+    assert n >= 0
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def decode_varint(buf, offset):
+    """
+    Returns the integer encoded at offset in buf and the offset
+    following it, raises AggregateError if it is truncated.
+    """
+    n = 0
+    shift = 0
+    while True:
+        if offset >= len(buf) or shift > 63:
+            raise AggregateError("truncated varint")
+        byte = buf[offset]
+        offset += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, offset
+        shift += 7
+
+
+def pack_messages(messages):
+    """
+    Returns the aggregate payload holding messages.
+    """
+    out = bytearray(AGGREGATE_HEADER_SIZE)
+    for message in messages:
+        out += encode_varint(len(message))
+        out += message
+    _AGGREGATE_HEADER.pack_into(out, 0, AGGREGATE_MAGIC, len(out) - AGGREGATE_HEADER_SIZE)
+    return bytes(out)
+
+
+def is_aggregate(payload):
+    """
+    Returns True if payload starts with the aggregate magic and
+    the length in its header matches the rest of the payload.
+    """
+    if len(payload) < AGGREGATE_HEADER_SIZE:
+        return False
+    magic, length = _AGGREGATE_HEADER.unpack_from(payload)
+    return magic == AGGREGATE_MAGIC and length == len(payload) - AGGREGATE_HEADER_SIZE
+
+
+def unpack_messages(payload):
+    """
+    Returns the list of messages of an aggregate payload,
+    raises AggregateError if it is malformed.
+    """
+    if not is_aggregate(payload):
+        raise AggregateError("not an aggregate payload")
+    buf = bytearray(payload)
+    messages = []
+    offset = AGGREGATE_HEADER_SIZE
+    while offset < len(buf):
+        size, offset = decode_varint(buf, offset)
+        end = offset + size
+        if end > len(buf):
+            raise AggregateError("message of %d bytes overruns the payload" % size)
+        messages.append(bytes(buf[offset:end]))
+        offset = end
+    return messages
+
+
+def split_exit_hop(exit_hop):
+    """
+    Returns the list of (destination, message) tuples delivered by
+    the exit_hop of an UnwrappedMessage, unpacking an aggregate.
+
+    Aggregates are told from plain messages in band: a payload is
+    only split if it starts with the 4 byte magic, the length in its
+    header matches the payload and its messages fill it exactly.
+    Anything else, such as a plain message which merely starts with
+    the magic, is delivered unchanged. A plain message built to pass
+    all three checks is split into the messages it spells out, which
+    its sender could as well have aggregated.
+    """
+    dest, payload = exit_hop
+    if is_aggregate(payload):
+        try:
+            return [(dest, message) for message in unpack_messages(payload)]
+        except AggregateError:
+            pass
+    return [exit_hop]
+
+
+class _Pending(object):
+    __slots__ = ("messages", "size", "deadline")
+
+    def __init__(self, deadline):
+        self.messages = []
+        self.size = AGGREGATE_HEADER_SIZE
+        self.deadline = deadline
+
+
+class MessageAggregator(object):
+    """
+    I collect small messages per destination and send them packed
+    into as few forward messages as possible.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param pki: An IMixPKI provider.
+
+    :param route: A list of node ids, or a function
+    returning the route of each packet.
+
+    :param rand_reader: Source of entropy, an IReader provider.
+
+    :param max_delay: Seconds the first pending message of a
+    destination waits for more before it is sent.
+
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, params, pki, route, rand_reader, max_delay=0.05, clock=time.monotonic):
+        assert isinstance(params, SphinxParams)
+        assert IMixPKI.providedBy(pki)
+        assert IReader.providedBy(rand_reader)
+        assert max_delay >= 0
+        self.params = params
+        self.pki = pki
+        self.route = route
+        self.rand_reader = rand_reader
+        self.max_delay = max_delay
+        self.clock = clock
+        self.counters = dict((name, 0) for name in AGGREGATOR_COUNTERS)
+        self._pending = {}
+        self._wakeup = None
+
+    def capacity(self, dest):
+        """
+        Returns the aggregate payload size a packet to dest can carry.
+        """
+        return max_message_size(self.params, dest)
+
+    def _build(self, dest, pending):
+        route = self.route() if callable(self.route) else self.route
+        packet = SphinxPacket.forward_message(self.params, route, self.pki, dest,
+                                              pack_messages(pending.messages), self.rand_reader)
+        self.counters["packets"] += 1
+        return route[0], packet
+
+    def add(self, dest, message):
+        """
+        Queue message for dest, returns the list of (first hop node
+        id, SphinxPacket) tuples to send now, those whose payload
+        is full.
+        """
+        size = varint_size(len(message)) + len(message)
+        capacity = self.capacity(dest)
+        if size + AGGREGATE_HEADER_SIZE > capacity:
+            raise AggregateError("message of %d bytes does not fit a payload of %d" % (len(message), capacity))
+        ready = []
+        pending = self._pending.get(dest)
+        if pending is not None and pending.size + size > capacity:
+            ready.append(self._build(dest, self._pending.pop(dest)))
+            self.counters["full_flushes"] += 1
+            pending = None
+        if pending is None:
+            pending = self._pending[dest] = _Pending(self.clock() + self.max_delay)
+            if self._wakeup is not None:
+                self._wakeup.set()
+        pending.messages.append(message)
+        pending.size += size
+        self.counters["messages"] += 1
+        if pending.size == capacity:
+            ready.append(self._build(dest, self._pending.pop(dest)))
+            self.counters["full_flushes"] += 1
+        return ready
+
+    def next_deadline(self):
+        if not self._pending:
+            return None
+        return min(pending.deadline for pending in self._pending.values())
+
+    def flush_due(self, now=None):
+        """
+        Returns the packets of the destinations whose deadline has passed.
+        """
+        if now is None:
+            now = self.clock()
+        due = [dest for dest, pending in self._pending.items() if pending.deadline <= now]
+        self.counters["deadline_flushes"] += len(due)
+        return [self._build(dest, self._pending.pop(dest)) for dest in due]
+
+    def flush(self):
+        """
+        Returns the packets of every pending message.
+        """
+        pending, self._pending = self._pending, {}
+        return [self._build(dest, x) for dest, x in pending.items()]
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["pending_messages"] = sum(len(x.messages) for x in self._pending.values())
+        stats["messages_per_packet"] = stats["messages"] / float(stats["packets"]) if stats["packets"] else 0.0
+        return stats
+
+    async def run(self, send):
+        """
+        Send the pending messages as their deadlines pass until
+        cancelled, calling send(node_id, packet) for each packet.
+        Packets returned by add are for the caller to send.
+        """
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                for node_id, packet in self.flush_due():
+                    send(node_id, packet)
+                deadline = self.next_deadline()
+                self._wakeup.clear()
+                if deadline is None:
+                    await self._wakeup.wait()
+                    continue
+                await wait_event(self._wakeup, max(deadline - self.clock(), 0.0))
+        finally:
+            self._wakeup = None
@@ -16,77 +16,66 @@
 # License along with Sphinx.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+from collections import namedtuple
+
 import attr
 
-from sphinxmixcrypto.crypto_primitives import CURVE25519_SIZE
-from sphinxmixcrypto.crypto_primitives import SECURITY_PARAMETER, xor
+from sphinxmixcrypto.params import SphinxParams, destination_encode, SECURITY_PARAMETER
+from sphinxmixcrypto.crypto_primitives import xor
 from sphinxmixcrypto.crypto_primitives import SphinxLioness, SphinxStreamCipher, SphinxDigest, GroupCurve25519
 from sphinxmixcrypto.padding import add_padding, remove_padding
 from sphinxmixcrypto.interfaces import IReader, IMixPKI
+from sphinxmixcrypto.instrumentation import stage_clock
 from sphinxmixcrypto.errors import NymKeyNotFoundError, CorruptMessageError
 
 
-def destination_encode(dest):
+def check_type(name, value, expected_type):
     """
-    encode destination
+    Raise TypeError unless value is an instance of expected_type;
+    the packet and result types validate their fields with me when
+    constructed by callers, internal code builds them with _make.
     """
-    assert len(dest) >= 1 and len(dest) <= 127
-    return b"%c" % len(dest) + dest
+    if not isinstance(value, expected_type):
+        raise TypeError("'%s' must be %r (got %r that is a %r)." % (name, expected_type, value, type(value)))
 
 
-@attr.s(frozen=True)
-class SphinxParams(object):
+def record_type(name, field_names):
+    """
+    Returns a namedtuple class for the packet and result types to
+    subclass. Like the attrs classes they replaced, and unlike plain
+    namedtuples, their instances only compare equal to instances of
+    the same class, never to a tuple holding the same fields.
+    """
+    # NotImplemented would fall back to the tuple comparison
+    def __eq__(self, other):
+        return other.__class__ is self.__class__ and tuple.__eq__(self, other)
 
-    max_hops = attr.ib(validator=attr.validators.instance_of(int))
-    payload_size = attr.ib(validator=attr.validators.instance_of(int))
+    def __ne__(self, other):
+        return other.__class__ is not self.__class__ or tuple.__ne__(self, other)
 
-    @property
-    def beta_cipher_size(self):
-        """
-        i am a helper method that is used to compute the size of the
-        stream cipher output used in sphinx packet operations
-        """
-        return CURVE25519_SIZE + (2 * self.max_hops + 1) * SECURITY_PARAMETER
+    def __hash__(self):
+        return hash((self.__class__, tuple.__hash__(self)))
 
-    def get_dimensions(self):
-        """
-        i am a helper method that returns the sphinx packet element sizes, a 4-tuple.
-        e.g. payload = 1024 && 5 hops ==
-        alpha 32 beta 176 gamma 16 delta 1024
-        """
-        alpha = CURVE25519_SIZE
-        beta = (2 * self.max_hops + 1) * SECURITY_PARAMETER
-        gamma = SECURITY_PARAMETER
-        delta = self.payload_size
-        return alpha, beta, gamma, delta
+    base = namedtuple(name, field_names)
+    return type(name, (base,), {"__slots__": (), "__eq__": __eq__, "__ne__": __ne__, "__hash__": __hash__})
 
-    def elements_from_raw_bytes(self, raw_packet):
-        """
-        return the Sphinx packet elements, a 4-tuple
-        of byte slices: alpha, beta, gamma and delta.
-        """
-        alpha, beta, gamma, delta = self.get_dimensions()
-        assert len(raw_packet) == alpha + beta + gamma + delta
-        _alpha = raw_packet[:alpha]
-        _beta = raw_packet[alpha:alpha + beta]
-        _gamma = raw_packet[alpha + beta:alpha + beta + gamma]
-        _delta = raw_packet[alpha + beta + gamma:]
-        return _alpha, _beta, _gamma, _delta
 
-
-@attr.s(frozen=True)
-class SphinxHeader(object):
+class SphinxHeader(record_type("SphinxHeader", ["alpha", "beta", "gamma"])):
     """
     The Sphinx header.
 
     The Sphinx paper refers to the header fields as the greek letters: alpha, beta and gamma.
     """
-    alpha = attr.ib(validator=attr.validators.instance_of(bytes))
-    beta = attr.ib(validator=attr.validators.instance_of(bytes))
-    gamma = attr.ib(validator=attr.validators.instance_of(bytes))
+    __slots__ = ()
+
+    def __new__(cls, alpha, beta, gamma):
+        check_type("alpha", alpha, bytes)
+        check_type("beta", beta, bytes)
+        check_type("gamma", gamma, bytes)
+        return tuple.__new__(cls, (alpha, beta, gamma))
 
 
-def create_header(params, route, pki, dest, message_id, rand_reader):
+def create_header(params, route, pki, dest, message_id, rand_reader, instrument=None):
     """
     Create a sphinx header, used to construct forward messages and reply blocks.
 
@@ -102,6 +91,9 @@ def create_header(params, route, pki, dest, message_id, rand_reader):
 
     :param rand_reader: Source of entropy, an IReader provider.
 
+    :param instrument: Optional IInstrumentSink provider to record
+    the duration of each stage to.
+
     :returns: a 2-tuple, a SphinxHeader and a list of shared secrets
     for each hop in the route.
     """
@@ -111,6 +103,8 @@ def create_header(params, route, pki, dest, message_id, rand_reader):
     assert route_len <= params.max_hops
     assert len(message_id) == SECURITY_PARAMETER
 
+    clock = stage_clock(instrument)
+    clock.count("create_header.hops", route_len)
     group = GroupCurve25519()
     digest = SphinxDigest()
     stream_cipher = SphinxStreamCipher()
@@ -126,6 +120,7 @@ def create_header(params, route, pki, dest, message_id, rand_reader):
         b = digest.hash_blinding(alpha, s)
         blinds.append(b)
         asbtuples.append({'alpha': alpha, 's': s, 'b': b})
+    clock.lap("create_header.secrets")
 
     # Compute the filler strings
     phi = b''
@@ -134,6 +129,7 @@ def create_header(params, route, pki, dest, message_id, rand_reader):
         min = (2 * (params.max_hops - i) + 3) * SECURITY_PARAMETER
         phi = xor(phi + (b"\x00" * (2 * SECURITY_PARAMETER)),
                   stream_cipher.generate_stream(digest.create_stream_cipher_key(asbtuples[i - 1]['s']), params.beta_cipher_size)[min:])
+    clock.lap("create_header.filler")
 
     # Compute the (beta, gamma) tuples
     beta = dest + message_id + padding
@@ -149,28 +145,35 @@ def create_header(params, route, pki, dest, message_id, rand_reader):
         beta = xor(message_id + gamma + beta[:(2 * params.max_hops - 1) * SECURITY_PARAMETER],
                    stream_cipher.generate_stream(stream_key, params.beta_cipher_size)[:(2 * params.max_hops + 1) * SECURITY_PARAMETER])
         gamma = digest.hmac(digest.create_hmac_key(asbtuples[i]['s']), beta)
-    sphinx_header = SphinxHeader(asbtuples[0]['alpha'], beta, gamma)
+    clock.lap("create_header.beta_gamma")
+    sphinx_header = SphinxHeader._make((asbtuples[0]['alpha'], beta, gamma))
     return sphinx_header, [y['s'] for y in asbtuples]
 
 
-@attr.s(frozen=True)
-class SphinxBody(object):
+class SphinxBody(record_type("SphinxBody", ["delta"])):
     """
     A Sphinx has the body of a lion or lioness.  The sphinx packet
     body is repeated encrypted with the lioness wide-block cipher.
 
     The Sphinx paper refers to this field of the packet as the greek letter delta.
     """
-    delta = attr.ib(validator=attr.validators.instance_of(bytes))
+    __slots__ = ()
+
+    def __new__(cls, delta):
+        check_type("delta", delta, bytes)
+        return tuple.__new__(cls, (delta,))
 
 
-@attr.s(frozen=True)
-class SphinxPacket(object):
+class SphinxPacket(record_type("SphinxPacket", ["header", "body"])):
     """
     I am a decoded sphinx packet
     """
-    header = attr.ib(validator=attr.validators.instance_of(SphinxHeader))
-    body = attr.ib(validator=attr.validators.instance_of(SphinxBody))
+    __slots__ = ()
+
+    def __new__(cls, header, body):
+        check_type("header", header, SphinxHeader)
+        check_type("body", body, SphinxBody)
+        return tuple.__new__(cls, (header, body))
 
     def get_raw_bytes(self):
         """
@@ -179,6 +182,24 @@ class SphinxPacket(object):
         return b"".join((self.header.alpha, self.header.beta,
                         self.header.gamma, self.body.delta))
 
+    def get_buffers(self):
+        """
+        Get the four segments of the packet, alpha, beta, gamma and
+        delta, as a buffer sequence for socket.sendmsg or writelines.
+        """
+        return (self.header.alpha, self.header.beta, self.header.gamma, self.body.delta)
+
+    def write_into(self, buf, offset=0):
+        """
+        Write the packet into the writable buffer buf at offset,
+        returns the offset following the packet.
+        """
+        for segment in self.get_buffers():
+            end = offset + len(segment)
+            buf[offset:end] = segment
+            offset = end
+        return offset
+
     @classmethod
     def from_raw_bytes(cls, params, raw_packet):
         """
@@ -228,7 +249,7 @@ class SphinxPacket(object):
         for i in range(route_len - 2, -1, -1):
             delta = block_cipher.encrypt(block_cipher.create_block_cipher_key(secrets[i]), delta)
 
-        return cls(header, SphinxBody(delta))
+        return cls._make((header, SphinxBody._make((delta,))))
 
 
 def create_reply_block(params, route, pki, dest, rand_reader):
@@ -267,10 +288,13 @@ def create_reply_block(params, route, pki, dest, rand_reader):
     return message_id, keytuple, (route[0], header, ktilde)
 
 
-@attr.s(frozen=True)
-class ClientMessage(object):
-    identity = attr.ib(validator=attr.validators.instance_of(bytes))
-    payload = attr.ib(validator=attr.validators.instance_of(bytes))
+class ClientMessage(record_type("ClientMessage", ["identity", "payload"])):
+    __slots__ = ()
+
+    def __new__(cls, identity, payload):
+        check_type("identity", identity, bytes)
+        check_type("payload", payload, bytes)
+        return tuple.__new__(cls, (identity, payload))
 
 
 @attr.s
@@ -279,7 +303,7 @@ class SphinxClient(object):
     params = attr.ib(validator=attr.validators.instance_of(SphinxParams))
     client_id = attr.ib(validator=attr.validators.instance_of(bytes))
     rand_reader = attr.ib(validator=attr.validators.provides(IReader))
-    _keytable = attr.ib(init=False, default={})
+    _keytable = attr.ib(init=False, default=attr.Factory(dict))
 
     def create_nym(self, route, pki):
         """
@@ -311,6 +335,6 @@ class SphinxClient(object):
 
         if delta[:SECURITY_PARAMETER] == (b"\x00" * SECURITY_PARAMETER):
             plaintext_message = remove_padding(delta[SECURITY_PARAMETER:])
-            return ClientMessage(identity=self.client_id, payload=plaintext_message)
+            return ClientMessage._make((self.client_id, plaintext_message))
 
         raise CorruptMessageError
@@ -0,0 +1,297 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module generates loop and drop cover traffic. Cover packets are
+built ahead of time, in executor threads, into a reservoir per route
+policy and released on a Poisson schedule by popping the reservoir,
+so sending cover traffic costs no public key operation on the send
+path. Packets built under an older PKI epoch are discarded.
+
+Loop packets are delivered back to their sender, drop packets are
+discarded by their exit hop. Each kind carries its own fixed payload,
+which cover_kind recognises once the exit hop decrypted it.
+"""
+
+import asyncio
+import random
+from collections import deque
+
+import attr
+
+from sphinxmixcrypto.client import SphinxPacket
+from sphinxmixcrypto.params import SphinxParams
+from sphinxmixcrypto.interfaces import IMixPKI, IReader
+from sphinxmixcrypto.scheduler import poisson_delay, wait_event
+
+
+LOOP = "loop"
+DROP = "drop"
+
+COVER_PAYLOADS = {
+    LOOP: b"sphinxmixcrypto loop cover",
+    DROP: b"sphinxmixcrypto drop cover",
+}
+
+COVER_COUNTERS = ("built", "released", "expired", "underruns", "build_errors")
+
+_system_random = random.SystemRandom()
+
+
+def cover_kind(payload):
+    """
+    Returns LOOP or DROP if payload, a message delivered by an exit
+    hop, is a cover packet of that kind, otherwise None. Exit hops
+    discard drop packets instead of delivering them, senders count
+    their loop packets coming back.
+    """
+    for kind, cover_payload in COVER_PAYLOADS.items():
+        if payload == cover_payload:
+            return kind
+    return None
+
+
+@attr.s(frozen=True)
+class CoverPolicy(object):
+    """
+    I am the configuration of one kind of cover traffic.
+
+    :param name: The name of the policy, unique per CoverTraffic.
+
+    :param kind: LOOP for packets routed back to the sender,
+    DROP for packets discarded by their exit hop.
+
+    :param route: A function returning the route of a new cover
+    packet, a list of node ids.
+
+    :param dest: The destination of the packets, the sender's
+    client id for loops; only the exit hop sees it for drops.
+
+    :param rate: Mean packets per second released.
+
+    :param reservoir_size: Packets kept built ahead of time, the
+    reservoir is refilled once it is half empty.
+    """
+    name = attr.ib(validator=attr.validators.instance_of(str))
+    kind = attr.ib(validator=attr.validators.in_((LOOP, DROP)))
+    route = attr.ib()
+    dest = attr.ib(validator=attr.validators.instance_of(bytes))
+    rate = attr.ib(validator=attr.validators.instance_of(float))
+    reservoir_size = attr.ib(default=64, validator=attr.validators.instance_of(int))
+
+
+class _Reservoir(object):
+    """
+    I am the built packets and the counters of one policy.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.entries = deque()
+        self.counters = dict((name, 0) for name in COVER_COUNTERS)
+
+
+class CoverTraffic(object):
+    """
+    I keep reservoirs of pre-built cover packets and release them.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param pki: An IMixPKI provider.
+
+    :param policies: A list of CoverPolicy.
+
+    :param rand_reader: Source of entropy for the packets, an IReader
+    provider; it is used from executor threads.
+
+    :param epoch: A function returning the current PKI epoch,
+    packets built under another epoch are discarded. By default
+    the epoch attribute of the PKI, if any.
+
+    :param executor: The concurrent.futures executor building
+    packets in the background, by default the loop's.
+
+    :param rng: A random.Random drawing the release delays.
+    """
+
+    def __init__(self, params, pki, policies, rand_reader, epoch=None, executor=None, rng=_system_random):
+        assert isinstance(params, SphinxParams)
+        assert IMixPKI.providedBy(pki)
+        assert IReader.providedBy(rand_reader)
+        self.params = params
+        self.pki = pki
+        self.rand_reader = rand_reader
+        self.epoch = epoch if epoch is not None else self._pki_epoch
+        self.executor = executor
+        self.rng = rng
+        self._reservoirs = {}
+        for policy in policies:
+            assert policy.name not in self._reservoirs
+            assert policy.rate > 0
+            self._reservoirs[policy.name] = _Reservoir(policy)
+        self._wakeup = None
+        self._tasks = []
+
+    def _pki_epoch(self):
+        return getattr(self.pki, "epoch", None)
+
+    def __len__(self):
+        return sum(len(reservoir.entries) for reservoir in self._reservoirs.values())
+
+    def _build(self, policy, count, epoch):
+        entries = []
+        for i in range(count):
+            route = policy.route()
+            packet = SphinxPacket.forward_message(self.params, route, self.pki, policy.dest,
+                                                  COVER_PAYLOADS[policy.kind], self.rand_reader)
+            entries.append((epoch, route[0], packet))
+        return entries
+
+    def _missing(self, reservoir):
+        return reservoir.policy.reservoir_size - len(reservoir.entries)
+
+    def _add(self, reservoir, entries):
+        reservoir.entries.extend(entries)
+        reservoir.counters["built"] += len(entries)
+
+    def refill(self, name=None):
+        """
+        Fill the reservoir of the policy name, or of every policy,
+        in the calling thread. Returns the number of packets built.
+        """
+        epoch = self.epoch()
+        built = 0
+        for reservoir in self._reservoirs.values():
+            if name is not None and reservoir.policy.name != name:
+                continue
+            entries = self._build(reservoir.policy, self._missing(reservoir), epoch)
+            self._add(reservoir, entries)
+            built += len(entries)
+        return built
+
+    def expire(self):
+        """
+        Discard the packets built under another PKI epoch,
+        returns their number.
+        """
+        epoch = self.epoch()
+        expired = 0
+        for reservoir in self._reservoirs.values():
+            entries = reservoir.entries
+            stale = len([entry for entry in entries if entry[0] != epoch])
+            if stale:
+                reservoir.entries = deque(entry for entry in entries if entry[0] == epoch)
+                reservoir.counters["expired"] += stale
+                expired += stale
+        return expired
+
+    def take(self, name):
+        """
+        Returns a (first hop node id, SphinxPacket) tuple from the
+        reservoir of the policy name, or None if it is empty.
+        """
+        reservoir = self._reservoirs[name]
+        epoch = self.epoch()
+        entries = reservoir.entries
+        while entries:
+            entry = entries.popleft()
+            if entry[0] == epoch:
+                reservoir.counters["released"] += 1
+                if self._wakeup is not None and len(entries) * 2 < reservoir.policy.reservoir_size:
+                    self._wakeup.set()
+                return entry[1], entry[2]
+            reservoir.counters["expired"] += 1
+        reservoir.counters["underruns"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return None
+
+    def stats(self):
+        """
+        Returns a dict of policy name to its counters and reservoir level.
+        """
+        stats = {}
+        for name, reservoir in self._reservoirs.items():
+            policy_stats = dict(reservoir.counters)
+            policy_stats["reservoir"] = len(reservoir.entries)
+            stats[name] = policy_stats
+        return stats
+
+    async def run_refill(self, interval=1.0, batch=8):
+        """
+        Refill the reservoirs from the executor until cancelled,
+        batch packets at a time, whenever one is half empty and at
+        least every interval seconds to notice new PKI epochs. A
+        batch failing to build, for instance because a node left
+        the PKI, is counted as a build error and retried on the
+        next interval.
+        """
+        loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self._wakeup.clear()
+                self.expire()
+                for reservoir in self._reservoirs.values():
+                    if self._missing(reservoir) * 2 < reservoir.policy.reservoir_size:
+                        continue
+                    while self._missing(reservoir) > 0:
+                        epoch = self.epoch()
+                        count = min(batch, self._missing(reservoir))
+                        try:
+                            entries = await loop.run_in_executor(self.executor, self._build, reservoir.policy, count, epoch)
+                        except asyncio.CancelledError:
+                            raise
+                        except Exception:
+                            reservoir.counters["build_errors"] += 1
+                            break
+                        self._add(reservoir, entries)
+                await wait_event(self._wakeup, interval)
+        finally:
+            self._wakeup = None
+
+    async def run_release(self, name, send):
+        """
+        Release the packets of the policy name until cancelled,
+        calling send(node_id, packet) with exponentially distributed
+        delays of mean 1 / rate between them.
+        """
+        mean_delay = 1.0 / self._reservoirs[name].policy.rate
+        while True:
+            await asyncio.sleep(poisson_delay(mean_delay, self.rng))
+            item = self.take(name)
+            if item is not None:
+                send(*item)
+
+    def start(self, send, refill_interval=1.0):
+        """
+        Start refilling and releasing every policy, send is called
+        with the first hop node id and the SphinxPacket, for instance
+        OutboundDispatcher.dispatch.
+        """
+        assert not self._tasks
+        self._tasks.append(asyncio.ensure_future(self.run_refill(refill_interval)))
+        for name in self._reservoirs:
+            self._tasks.append(asyncio.ensure_future(self.run_release(name, send)))
+        return self._tasks
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
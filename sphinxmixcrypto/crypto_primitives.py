@@ -29,6 +29,9 @@ from pyblake2 import blake2b
 from Cryptodome.Cipher import ChaCha20
 from pylioness import Chacha20_Blake2b_Lioness
 
+# CURVE25519_SIZE is re-exported for code importing it from here
+from sphinxmixcrypto.params import SECURITY_PARAMETER, CURVE25519_SIZE  # noqa: F401
+
 
 # prefixes which are prefixed to data before hashing
 BLINDING_HASH_PREFIX = b'\x11'
@@ -37,11 +40,6 @@ HMAC_HASH_PREFIX = b'\x33'
 BLOCK_CIPHER_HASH_PREFIX = b'\x44'
 REPLAY_HASH_PREFIX = b'\x55'
 
-# curve25519 key is 32 bytes
-CURVE25519_SIZE = 32
-# Sphinx provides 128 bits of security as does curve25519
-SECURITY_PARAMETER = 16
-
 
 def xor(str1, str2):
     # XOR two strings
@@ -0,0 +1,246 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module forwards unwrapped packets to their next hop. Packets
+are grouped by next hop node id into a send buffer per peer which
+is written to a small pool of persistent asyncio connections once
+it is large enough or its flush deadline has passed.
+"""
+
+import asyncio
+import binascii
+
+from sphinxmixcrypto.client import SphinxPacket
+from sphinxmixcrypto.interfaces import IMixPKI
+from sphinxmixcrypto.scheduler import wait_event
+
+
+PEER_COUNTERS = ("queued_packets", "sent_packets", "sent_bytes", "writes", "dropped_packets", "connects", "errors")
+
+
+class _Peer(object):
+    """
+    I am the send buffer, connection pool and counters of one peer.
+    """
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.buffer = bytearray()
+        self.buffered_packets = 0
+        self.deadline = None
+        self.inflight = 0
+        self.wakeup = asyncio.Event()
+        # set while nothing is buffered or being written
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.workers = []
+        self.writers = []
+        self.counters = dict((name, 0) for name in PEER_COUNTERS)
+
+
+class OutboundDispatcher(object):
+    """
+    I forward packets to the mix nodes they are addressed to.
+
+    :param pki: An IMixPKI provider, get_mix_addr(transport_name,
+    node_id) returns a (host, port) tuple or a unix socket path.
+
+    :param transport_name: The transport name passed to get_mix_addr.
+
+    :param connections_per_peer: Persistent connections kept per peer.
+
+    :param flush_interval: Seconds a packet may wait in a send buffer
+    for more packets to the same peer.
+
+    :param max_batch_bytes: Send buffer size which is written at once
+    without waiting for the flush deadline.
+
+    :param max_pending_bytes: Send buffer size beyond which further
+    packets to the peer are dropped.
+    """
+
+    def __init__(self, pki, transport_name="tcp", connections_per_peer=1, flush_interval=0.005,
+                 max_batch_bytes=256 * 1024, max_pending_bytes=16 * 1024 * 1024):
+        assert IMixPKI.providedBy(pki)
+        assert connections_per_peer > 0
+        assert max_batch_bytes <= max_pending_bytes
+        self.pki = pki
+        self.transport_name = transport_name
+        self.connections_per_peer = connections_per_peer
+        self.flush_interval = flush_interval
+        self.max_batch_bytes = max_batch_bytes
+        self.max_pending_bytes = max_pending_bytes
+        self._peers = {}
+        self._closed = False
+
+    def _peer(self, node_id):
+        peer = self._peers.get(node_id)
+        if peer is None:
+            peer = self._peers[node_id] = _Peer(node_id)
+            for i in range(self.connections_per_peer):
+                peer.writers.append(None)
+                peer.workers.append(asyncio.ensure_future(self._run_worker(peer, i)))
+        return peer
+
+    def _enqueue(self, node_id, segments, size, packets):
+        assert not self._closed
+        peer = self._peer(node_id)
+        if len(peer.buffer) + size > self.max_pending_bytes:
+            peer.counters["dropped_packets"] += packets
+            return False
+        for segment in segments:
+            peer.buffer += segment
+        peer.buffered_packets += packets
+        peer.counters["queued_packets"] += packets
+        peer.drained.clear()
+        if peer.deadline is None:
+            peer.deadline = asyncio.get_event_loop().time() + self.flush_interval
+        peer.wakeup.set()
+        return True
+
+    def dispatch(self, node_id, packet):
+        """
+        Queue a SphinxPacket or raw packet to the peer node_id,
+        returns False if the peer's send buffer is full.
+        """
+        if isinstance(packet, SphinxPacket):
+            segments = packet.get_buffers()
+        else:
+            segments = (packet,)
+        return self._enqueue(node_id, segments, sum(len(x) for x in segments), 1)
+
+    def dispatch_next_hop(self, next_hop):
+        """
+        Queue the next_hop of an UnwrappedMessage.
+        """
+        return self.dispatch(*next_hop)
+
+    def dispatch_batches(self, batches, packet_size):
+        """
+        Queue the send buffers of a pool mix flush, a dict of
+        node id to packets of packet_size bytes each.
+        """
+        for node_id, batch in batches.items():
+            self._enqueue(node_id, (batch,), len(batch), len(batch) // packet_size)
+
+    async def _connect(self, node_id):
+        address = self.pki.get_mix_addr(self.transport_name, node_id)
+        if isinstance(address, (tuple, list)):
+            _, writer = await asyncio.open_connection(*address)
+        else:
+            _, writer = await asyncio.open_unix_connection(address)
+        return writer
+
+    async def _run_worker(self, peer, index):
+        loop = asyncio.get_event_loop()
+        while True:
+            await peer.wakeup.wait()
+            if not peer.buffer:
+                peer.wakeup.clear()
+                if not peer.inflight:
+                    peer.drained.set()
+                continue
+            if len(peer.buffer) < self.max_batch_bytes and not self._closed:
+                delay = peer.deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+            batch, peer.buffer = peer.buffer, bytearray()
+            packets, peer.buffered_packets = peer.buffered_packets, 0
+            peer.deadline = None
+            peer.wakeup.clear()
+            peer.inflight += 1
+            try:
+                await self._write(peer, index, batch, packets)
+            finally:
+                peer.inflight -= 1
+            if not peer.buffer and not peer.inflight:
+                peer.drained.set()
+
+    async def _write(self, peer, index, batch, packets):
+        try:
+            writer = peer.writers[index]
+            if writer is None:
+                writer = peer.writers[index] = await self._connect(peer.node_id)
+                peer.counters["connects"] += 1
+            writer.write(batch)
+            await writer.drain()
+        except asyncio.CancelledError:
+            peer.counters["dropped_packets"] += packets
+            raise
+        except Exception:
+            # an unreachable or unknown peer must not stop the
+            # worker, the batch is dropped and the next one retried
+            peer.counters["errors"] += 1
+            peer.counters["dropped_packets"] += packets
+            if peer.writers[index] is not None:
+                peer.writers[index].close()
+                peer.writers[index] = None
+            return
+        peer.counters["writes"] += 1
+        peer.counters["sent_packets"] += packets
+        peer.counters["sent_bytes"] += len(batch)
+
+    def stats(self):
+        """
+        Returns a dict of hex encoded peer node id
+        to its queue and connection counters.
+        """
+        stats = {}
+        for node_id, peer in self._peers.items():
+            peer_stats = dict(peer.counters)
+            peer_stats["pending_packets"] = peer.buffered_packets
+            peer_stats["pending_bytes"] = len(peer.buffer)
+            peer_stats["connections"] = len([x for x in peer.writers if x is not None])
+            stats[binascii.hexlify(node_id).decode("ascii")] = peer_stats
+        return stats
+
+    async def close(self, flush=True, flush_timeout=5.0):
+        """
+        Stop forwarding and close all connections, writing out the
+        pending send buffers first if flush is True. Packets not
+        written within flush_timeout seconds are dropped.
+        """
+        self._closed = True
+        peers = list(self._peers.values())
+        if flush:
+            loop = asyncio.get_event_loop()
+            deadline = loop.time() + flush_timeout
+            for peer in peers:
+                peer.wakeup.set()
+            for peer in peers:
+                await wait_event(peer.drained, max(deadline - loop.time(), 0.0))
+        for peer in peers:
+            peer.counters["dropped_packets"] += peer.buffered_packets
+            peer.buffer = bytearray()
+            peer.buffered_packets = 0
+            for worker in peer.workers:
+                worker.cancel()
+            await asyncio.gather(*peer.workers, return_exceptions=True)
+            for writer in peer.writers:
+                if writer is not None:
+                    if writer.transport.get_write_buffer_size():
+                        # unwritten data would keep it open
+                        writer.transport.abort()
+                    else:
+                        writer.close()
+                    try:
+                        await writer.wait_closed()
+                    except OSError:
+                        pass
@@ -55,12 +55,36 @@ class SphinxBodySizeMismatchError(Exception):
     pass
 
 
+class TraceFormatError(Exception):
+    pass
+
+
+class FramingError(Exception):
+    pass
+
+
+class PKISnapshotFormatError(Exception):
+    pass
+
+
+class ReadOnlyPKIError(Exception):
+    pass
+
+
 # nymserver errors
 
 class SphinxNoSURBSAvailableError(Exception):
     pass
 
 
+class SURBLogFormatError(Exception):
+    pass
+
+
+class NymMessageSizeError(Exception):
+    pass
+
+
 # client errors
 
 class NymKeyNotFoundError(Exception):
@@ -69,3 +93,11 @@ class NymKeyNotFoundError(Exception):
 
 class CorruptMessageError(Exception):
     pass
+
+
+class FragmentError(Exception):
+    pass
+
+
+class AggregateError(Exception):
+    pass
@@ -0,0 +1,224 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module sends messages larger than a Sphinx payload as several
+forward messages. Every fragment starts with a 17 byte header: a
+marker byte, an 8 byte message id, the message length, the fragment
+index and the fragment size. The receiver copies fragments straight
+into a buffer preallocated for the whole message, keeping one byte
+per fragment to tell which have arrived.
+"""
+
+import struct
+import time
+from collections import OrderedDict
+
+from sphinxmixcrypto.client import SphinxPacket
+from sphinxmixcrypto.params import SECURITY_PARAMETER
+from sphinxmixcrypto.errors import FragmentError
+
+
+FRAGMENT_MARKER = 0xf1
+MESSAGE_ID_SIZE = 8
+
+# marker, message id, message length, fragment index, fragment size
+_FRAGMENT_HEADER = struct.Struct(">B%dsIHH" % MESSAGE_ID_SIZE)
+FRAGMENT_HEADER_SIZE = _FRAGMENT_HEADER.size
+MAX_FRAGMENTS = 0xffff
+
+REASSEMBLY_COUNTERS = ("fragments", "duplicates", "dropped_fragments", "messages", "expired_messages")
+
+
+def max_message_size(params, dest):
+    """
+    Returns the largest message forward_message can send to dest,
+    what remains of the payload after the zero prefix, the encoded
+    destination and the padding length.
+    """
+    return params.payload_size - SECURITY_PARAMETER - 1 - len(dest) - 3
+
+
+def fragment_message(message, fragment_size, message_id):
+    """
+    Split message into fragments carrying at most fragment_size
+    bytes of it, returns the list of fragments with their header.
+    """
+    assert len(message_id) == MESSAGE_ID_SIZE
+    assert 0 < fragment_size <= 0xffff
+    count = max(1, (len(message) + fragment_size - 1) // fragment_size)
+    if count > MAX_FRAGMENTS:
+        raise FragmentError("message of %d bytes needs more than %d fragments" % (len(message), MAX_FRAGMENTS))
+    view = memoryview(message)
+    fragments = []
+    for index in range(count):
+        chunk = view[index * fragment_size:(index + 1) * fragment_size]
+        header = _FRAGMENT_HEADER.pack(FRAGMENT_MARKER, message_id, len(message), index, fragment_size)
+        fragments.append(header + chunk.tobytes())
+    return fragments
+
+
+def fragment_packets(params, route, pki, dest, message, rand_reader, message_id=None):
+    """
+    Build the forward messages carrying message to dest in one batch.
+
+    :param route: A list of node ids used by every fragment, or a
+    function returning the route of each fragment.
+
+    :returns: a 2-tuple, the message id and the list of SphinxPackets.
+    """
+    if message_id is None:
+        message_id = rand_reader.read(MESSAGE_ID_SIZE)
+    fragment_size = min(max_message_size(params, dest) - FRAGMENT_HEADER_SIZE, 0xffff)
+    assert fragment_size > 0
+    packets = []
+    for fragment in fragment_message(message, fragment_size, message_id):
+        fragment_route = route() if callable(route) else route
+        packets.append(SphinxPacket.forward_message(params, fragment_route, pki, dest, fragment, rand_reader))
+    return message_id, packets
+
+
+def is_fragment(payload):
+    return len(payload) >= FRAGMENT_HEADER_SIZE and bytearray(payload[:1])[0] == FRAGMENT_MARKER
+
+
+class _PartialMessage(object):
+    __slots__ = ("length", "fragment_size", "buffer", "received", "missing", "deadline")
+
+    def __init__(self, length, fragment_size, count, deadline):
+        self.length = length
+        self.fragment_size = fragment_size
+        self.buffer = bytearray(length)
+        self.received = bytearray(count)
+        self.missing = count
+        self.deadline = deadline
+
+
+class ReassemblyBuffer(object):
+    """
+    I reassemble fragmented messages as their fragments arrive, in
+    any order, within bounded memory.
+
+    :param max_message_size: The largest message accepted, in bytes.
+
+    :param max_buffered_bytes: The most bytes preallocated for
+    incomplete messages, counting one byte per expected fragment;
+    fragments of new messages beyond it are dropped.
+
+    :param timeout: Seconds after its first fragment arrived that
+    an incomplete message is dropped.
+
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, max_message_size=16 * 1024 * 1024, max_buffered_bytes=64 * 1024 * 1024,
+                 timeout=60.0, clock=time.monotonic):
+        assert max_message_size <= max_buffered_bytes
+        self.max_message_size = max_message_size
+        self.max_buffered_bytes = max_buffered_bytes
+        self.timeout = timeout
+        self.clock = clock
+        self.buffered_bytes = 0
+        self.counters = dict((name, 0) for name in REASSEMBLY_COUNTERS)
+        # in arrival order, which is also deadline order
+        self._messages = OrderedDict()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def expire(self, now=None):
+        """
+        Drop the incomplete messages whose timeout has passed,
+        returns their number.
+        """
+        if now is None:
+            now = self.clock()
+        expired = 0
+        while self._messages:
+            message_id, partial = next(iter(self._messages.items()))
+            if partial.deadline > now:
+                break
+            self._drop(message_id)
+            expired += 1
+        self.counters["expired_messages"] += expired
+        return expired
+
+    def _drop(self, message_id):
+        partial = self._messages.pop(message_id)
+        self.buffered_bytes -= partial.length + len(partial.received)
+
+    def _start(self, message_id, length, fragment_size, count):
+        if self.buffered_bytes + length + count > self.max_buffered_bytes:
+            return None
+        partial = _PartialMessage(length, fragment_size, count, self.clock() + self.timeout)
+        self._messages[message_id] = partial
+        self.buffered_bytes += length + count
+        return partial
+
+    def add(self, payload):
+        """
+        Add a fragment, returns the reassembled message as a bytearray
+        once its last fragment arrived, otherwise None. Raises
+        FragmentError if the fragment is malformed.
+        """
+        if not is_fragment(payload):
+            raise FragmentError("not a fragment")
+        marker, message_id, length, index, fragment_size = _FRAGMENT_HEADER.unpack_from(payload)
+        if fragment_size == 0:
+            raise FragmentError("zero fragment size")
+        if length > self.max_message_size:
+            raise FragmentError("message of %d bytes is larger than %d" % (length, self.max_message_size))
+        # the header is unauthenticated, check it against the fragment
+        # itself before preallocating anything for the message
+        count = max(1, (length + fragment_size - 1) // fragment_size)
+        if count > MAX_FRAGMENTS:
+            raise FragmentError("message of %d bytes needs more than %d fragments" % (length, MAX_FRAGMENTS))
+        if index >= count:
+            raise FragmentError("fragment index %d out of range" % index)
+        offset = index * fragment_size
+        end = min(offset + fragment_size, length)
+        data = payload[FRAGMENT_HEADER_SIZE:]
+        if len(data) != end - offset:
+            raise FragmentError("fragment %d holds %d bytes instead of %d" % (index, len(data), end - offset))
+        self.expire()
+        self.counters["fragments"] += 1
+        partial = self._messages.get(message_id)
+        if partial is None:
+            partial = self._start(message_id, length, fragment_size, count)
+            if partial is None:
+                self.counters["dropped_fragments"] += 1
+                return None
+        elif partial.length != length or partial.fragment_size != fragment_size:
+            raise FragmentError("fragment header does not match the message")
+        if partial.received[index]:
+            self.counters["duplicates"] += 1
+            return None
+        partial.buffer[offset:end] = data
+        partial.received[index] = 1
+        partial.missing -= 1
+        if partial.missing:
+            return None
+        self._drop(message_id)
+        self.counters["messages"] += 1
+        return partial.buffer
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["incomplete_messages"] = len(self._messages)
+        stats["buffered_bytes"] = self.buffered_bytes
+        return stats
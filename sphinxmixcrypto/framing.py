@@ -0,0 +1,176 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module splits a byte stream into sphinx packets. Packets have
+a fixed size for given SphinxParams, so the stream is read in large
+chunks into one reusable buffer and packets are handed out as
+memoryviews of it. Streams may instead carry every packet behind a
+4 byte big-endian length prefix.
+
+The memoryviews are only valid until the next packet is requested,
+copy them, e.g. with SphinxPacket.from_raw_bytes or bytes(), to keep
+them longer.
+"""
+
+import asyncio
+import struct
+
+from sphinxmixcrypto.client import SphinxParams, SphinxPacket
+from sphinxmixcrypto.errors import FramingError
+
+
+_LENGTH_PREFIX = struct.Struct(">I")
+
+DEFAULT_CHUNK_PACKETS = 64
+
+
+def frame_packet(raw_packet):
+    """
+    Returns the raw packet behind a length prefix.
+    """
+    return _LENGTH_PREFIX.pack(len(raw_packet)) + bytes(raw_packet)
+
+
+class _FrameBuffer(object):
+    """
+    I hold the reusable read buffer and cut the
+    complete frames out of the bytes read into it.
+    """
+
+    def __init__(self, params, chunk_packets, length_prefixed):
+        assert isinstance(params, SphinxParams)
+        assert chunk_packets > 0
+        self.packet_size = sum(params.get_dimensions())
+        self.length_prefixed = length_prefixed
+        self.frame_size = self.packet_size + (_LENGTH_PREFIX.size if length_prefixed else 0)
+        self.buffer = bytearray(self.frame_size * chunk_packets)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def space(self):
+        """
+        Returns a memoryview of the free end of the buffer, first
+        moving a partial frame left over to the front.
+        """
+        if self.start > 0:
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = remaining
+        return self.view[self.end:]
+
+    def filled(self, n):
+        self.end += n
+
+    def frames(self):
+        """
+        Yield a memoryview of every complete frame's packet.
+        """
+        frame_size = self.frame_size
+        view = self.view
+        while self.end - self.start >= frame_size:
+            offset = self.start
+            if self.length_prefixed:
+                length = _LENGTH_PREFIX.unpack_from(self.buffer, offset)[0]
+                if length != self.packet_size:
+                    raise FramingError("frame length %d is not the packet size %d" % (length, self.packet_size))
+                offset += _LENGTH_PREFIX.size
+            self.start += frame_size
+            yield view[offset:offset + self.packet_size]
+
+    def finish(self):
+        if self.end != self.start:
+            raise FramingError("stream ended within a packet, %d bytes left over" % (self.end - self.start))
+
+
+def _reader(source):
+    if hasattr(source, "readinto"):
+        return source.readinto
+    return source.recv_into
+
+
+def read_packets(source, params, chunk_packets=DEFAULT_CHUNK_PACKETS, length_prefixed=False, decode=False):
+    """
+    Yield the packets read from source, a file or other object with
+    a readinto method or a blocking socket, as memoryviews or if
+    decode is True as SphinxPackets. Up to chunk_packets packets are
+    read at once.
+    """
+    frames = _FrameBuffer(params, chunk_packets, length_prefixed)
+    readinto = _reader(source)
+    while True:
+        n = readinto(frames.space())
+        if not n:
+            frames.finish()
+            return
+        frames.filled(n)
+        for raw_packet in frames.frames():
+            if decode:
+                yield SphinxPacket.from_raw_bytes(params, raw_packet.tobytes())
+            else:
+                yield raw_packet
+
+
+class AsyncPacketReader(object):
+    """
+    I am an async iterator over the packets of an asyncio stream,
+    either an asyncio.StreamReader or a non-blocking socket which
+    is read into my buffer directly.
+
+        async for raw_packet in AsyncPacketReader(reader, params):
+            ...
+    """
+
+    def __init__(self, source, params, chunk_packets=DEFAULT_CHUNK_PACKETS, length_prefixed=False, decode=False):
+        self.source = source
+        self.params = params
+        self.decode = decode
+        self._frames = _FrameBuffer(params, chunk_packets, length_prefixed)
+        self._pending = iter(())
+        self._done = False
+
+    async def _fill(self):
+        space = self._frames.space()
+        if isinstance(self.source, asyncio.StreamReader):
+            data = await self.source.read(len(space))
+            n = len(data)
+            space[:n] = data
+        else:
+            n = await asyncio.get_event_loop().sock_recv_into(self.source, space)
+        return n
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            for raw_packet in self._pending:
+                if self.decode:
+                    return SphinxPacket.from_raw_bytes(self.params, raw_packet.tobytes())
+                return raw_packet
+            if self._done:
+                raise StopAsyncIteration
+            n = await self._fill()
+            if n == 0:
+                self._done = True
+                self._frames.finish()
+                raise StopAsyncIteration
+            self._frames.filled(n)
+            self._pending = self._frames.frames()
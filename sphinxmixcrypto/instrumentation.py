@@ -0,0 +1,172 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module is used to time the stages of sphinx packet operations,
+e.g. the X25519 exponentiation, MAC check and Lioness decryption of
+sphinx_packet_unwrap, and report them to an IInstrumentSink.
+"""
+
+import math
+import threading
+import time
+
+import zope.interface
+
+from sphinxmixcrypto.interfaces import IInstrumentSink
+
+
+_now = time.perf_counter
+
+
+class StageClock(object):
+    """
+    I time consecutive stages of one operation; each call to lap
+    records the time elapsed since the previous lap to the sink.
+    """
+    __slots__ = ("sink", "last")
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.last = _now()
+
+    def lap(self, stage):
+        now = _now()
+        self.sink.record(stage, now - self.last)
+        self.last = now
+
+    def count(self, counter, n=1):
+        self.sink.increment(counter, n)
+
+
+class _NullClock(object):
+    """
+    I am the StageClock used when no sink is given, all my
+    methods do nothing.
+    """
+    __slots__ = ()
+
+    def lap(self, stage):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+
+NULL_CLOCK = _NullClock()
+
+
+def stage_clock(sink):
+    """
+    Returns a StageClock for the sink or NULL_CLOCK if sink is None.
+    """
+    if sink is None:
+        return NULL_CLOCK
+    assert IInstrumentSink.providedBy(sink)
+    return StageClock(sink)
+
+
+class _Histogram(object):
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self, num_buckets):
+        self.buckets = [0] * num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+
+@zope.interface.implementer(IInstrumentSink)
+class HistogramSink(object):
+    """
+    I am an IInstrumentSink keeping an in-memory histogram per stage
+    with power of two buckets, the first bucket holding durations
+    below resolution seconds, and a total per counter.
+    """
+
+    def __init__(self, resolution=1e-7, num_buckets=40):
+        self.resolution = resolution
+        self.num_buckets = num_buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def record(self, stage, seconds):
+        bucket = 0
+        if seconds >= self.resolution:
+            bucket = min(math.frexp(seconds / self.resolution)[1], self.num_buckets - 1)
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = _Histogram(self.num_buckets)
+            histogram.buckets[bucket] += 1
+            histogram.count += 1
+            histogram.total += seconds
+            if seconds < histogram.min:
+                histogram.min = seconds
+            if seconds > histogram.max:
+                histogram.max = seconds
+
+    def increment(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def bucket_bounds(self, bucket):
+        """
+        Returns the (lower, upper) duration bounds of a bucket.
+        """
+        if bucket == 0:
+            return 0.0, self.resolution
+        return self.resolution * 2 ** (bucket - 1), self.resolution * 2 ** bucket
+
+    def _quantile(self, histogram, fraction):
+        rank = fraction * histogram.count
+        seen = 0
+        for bucket, n in enumerate(histogram.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(self.bucket_bounds(bucket)[1], histogram.max)
+        return histogram.max
+
+    def snapshot(self):
+        """
+        Returns a dict with "stages", a dict of stage name to its
+        statistics, and "counters", a dict of counter name to total.
+        Quantiles are upper bucket bounds.
+        """
+        with self._lock:
+            stages = {}
+            for stage, histogram in self._histograms.items():
+                stages[stage] = {
+                    "count": histogram.count,
+                    "total": histogram.total,
+                    "mean": histogram.total / histogram.count,
+                    "min": histogram.min,
+                    "max": histogram.max,
+                    "p50": self._quantile(histogram, 0.50),
+                    "p90": self._quantile(histogram, 0.90),
+                    "p99": self._quantile(histogram, 0.99),
+                    "buckets": list(histogram.buckets),
+                }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
@@ -78,6 +78,30 @@ class IPacketReplayCache(zope.interface.Interface):
         """
 
 
+class ISURBStore(zope.interface.Interface):
+    """
+    Interface to the storage of single use reply blocks
+    held by a nym server on behalf of its nyms.
+    """
+
+    def add(self, nym, nymtuple):
+        """
+        Store a nymtuple, a 3-tuple of first hop node ID,
+        SphinxHeader and ktilde, for the given nym.
+        """
+
+    def pop(self, nym):
+        """
+        Remove and return the oldest nymtuple stored for
+        the given nym or None if there are none left.
+        """
+
+    def count(self, nym):
+        """
+        Returns the number of nymtuples stored for the given nym.
+        """
+
+
 class IKeyState(zope.interface.Interface):
     """
     key state interface providers getters from public and private keys
@@ -94,6 +118,23 @@ class IKeyState(zope.interface.Interface):
         """
 
 
+class IInstrumentSink(zope.interface.Interface):
+    """
+    Interface to a sink of timing measurements taken at the
+    stages of sphinx packet operations.
+    """
+
+    def record(self, stage, seconds):
+        """
+        Record the duration of one run of the named stage.
+        """
+
+    def increment(self, counter, n=1):
+        """
+        Add n to the named counter.
+        """
+
+
 class IReader(zope.interface.Interface):
     """
     i'm an interface used for bytes for generating key material.
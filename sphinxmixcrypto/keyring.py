@@ -0,0 +1,185 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements the node side of key rotation: a keyring
+holding the current and previous private keys of a mix node, each
+with its own replay cache partition which is dropped together with
+the key when its grace period ends.
+"""
+
+import threading
+import time
+
+from sphinxmixcrypto.client import SphinxParams, SphinxPacket
+from sphinxmixcrypto.interfaces import IKeyState
+from sphinxmixcrypto.instrumentation import stage_clock
+from sphinxmixcrypto.metrics import ShardedCounters
+from sphinxmixcrypto.node import NodeUnwrapper, PacketReplayCacheDict
+from sphinxmixcrypto.errors import IncorrectMACError, SphinxBodySizeMismatchError
+
+
+class _KeyEntry(object):
+    __slots__ = ("key_state", "replay_cache", "unwrapper", "expires")
+
+    def __init__(self, key_state, replay_cache, unwrapper, expires):
+        self.key_state = key_state
+        self.replay_cache = replay_cache
+        self.unwrapper = unwrapper
+        self.expires = expires
+
+
+class NodeKeyring(object):
+    """
+    I unwrap packets for a mix node which may hold several active
+    private keys during a key rotation grace period.
+
+    A packet encrypted to another key fails the MAC check, so each
+    packet is tried against the keys in turn, the key which last
+    unwrapped a packet first. Once the previous key has expired
+    packets cost a single X25519 exponentiation again.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param replay_cache_factory: A function returning a new, empty
+    IPacketReplayCache provider; every key gets its own.
+
+    :param clock: A function returning the current time in seconds.
+
+    :param instrument: Optional IInstrumentSink provider.
+
+    :param metrics: Optional UnwrapMetrics counting the outcomes.
+    """
+
+    def __init__(self, params, replay_cache_factory=PacketReplayCacheDict, clock=time.monotonic,
+                 instrument=None, metrics=None):
+        assert isinstance(params, SphinxParams)
+        self.params = params
+        self.replay_cache_factory = replay_cache_factory
+        self.clock = clock
+        self.instrument = instrument
+        self.metrics = metrics
+        self.counters = ShardedCounters(("packets", "key_trials", "expired_keys"))
+        self._entries = ()
+        self._next_expiry = None
+        self._lock = threading.Lock()
+        self._packet_size = sum(params.get_dimensions())
+
+    def add_key(self, key_state, expires=None):
+        """
+        Add a key, it is tried first until another key unwraps a
+        packet. If expires is given the key and its replay cache
+        are dropped at that time.
+        """
+        assert IKeyState.providedBy(key_state)
+        replay_cache = self.replay_cache_factory()
+        unwrapper = NodeUnwrapper(self.params, replay_cache, key_state, instrument=self.instrument)
+        entry = _KeyEntry(key_state, replay_cache, unwrapper, expires)
+        with self._lock:
+            self._entries = (entry,) + self._entries
+            self._update_expiry()
+
+    def rotate(self, key_state, grace_period):
+        """
+        Make key_state the current key, keeping the keys
+        already held for grace_period more seconds.
+        """
+        expires = self.clock() + grace_period
+        with self._lock:
+            for entry in self._entries:
+                if entry.expires is None or entry.expires > expires:
+                    entry.expires = expires
+        self.add_key(key_state)
+
+    def public_keys(self):
+        """
+        Returns the public keys of the active keys
+        in the order they are tried.
+        """
+        return [entry.key_state.get_public_key() for entry in self._entries]
+
+    def _update_expiry(self):
+        expiries = [entry.expires for entry in self._entries if entry.expires is not None]
+        self._next_expiry = min(expiries) if expiries else None
+
+    def expire(self, now=None):
+        """
+        Drop the keys whose grace period has ended and flush their
+        replay caches, returns the number of keys dropped.
+        """
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            expired = [entry for entry in self._entries if entry.expires is not None and entry.expires <= now]
+            if not expired:
+                return 0
+            self._entries = tuple(entry for entry in self._entries if entry not in expired)
+            self._update_expiry()
+        for entry in expired:
+            entry.replay_cache.flush()
+        self.counters.increment("expired_keys", len(expired))
+        return len(expired)
+
+    def _promote(self, entry):
+        with self._lock:
+            if self._entries and self._entries[0] is not entry and entry in self._entries:
+                self._entries = (entry,) + tuple(x for x in self._entries if x is not entry)
+
+    def _unwrap(self, alpha, beta, gamma, delta, raise_errors):
+        next_expiry = self._next_expiry
+        if next_expiry is not None and next_expiry <= self.clock():
+            self.expire()
+        entries = self._entries
+        assert entries, "the keyring holds no keys"
+        self.counters.increment("packets")
+        result = IncorrectMACError
+        trials = 0
+        for entry in entries:
+            trials += 1
+            result = entry.unwrapper._unwrap(alpha, beta, gamma, delta, stage_clock(self.instrument))
+            if result is not IncorrectMACError:
+                if entry is not entries[0] and not isinstance(result, type):
+                    self._promote(entry)
+                break
+        self.counters.increment("key_trials", trials)
+        return self._finish(result, raise_errors)
+
+    def _finish(self, result, raise_errors):
+        if self.metrics is not None:
+            self.metrics.record(result)
+        if raise_errors and isinstance(result, type):
+            raise result()
+        return result
+
+    def unwrap(self, sphinx_packet, raise_errors=True):
+        """
+        Returns the UnwrappedMessage of a SphinxPacket, see
+        sphinx_packet_unwrap for raise_errors.
+        """
+        assert isinstance(sphinx_packet, SphinxPacket)
+        header = sphinx_packet.header
+        return self._unwrap(header.alpha, header.beta, header.gamma, sphinx_packet.body.delta, raise_errors)
+
+    def unwrap_raw(self, raw_packet, raise_errors=True):
+        """
+        Returns the UnwrappedMessage of a raw packet.
+        """
+        if len(raw_packet) != self._packet_size:
+            return self._finish(SphinxBodySizeMismatchError, raise_errors)
+        alpha, beta, gamma, delta = self.params.elements_from_raw_bytes(bytes(raw_packet))
+        return self._unwrap(alpha, beta, gamma, delta, raise_errors)
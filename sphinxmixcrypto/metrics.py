@@ -0,0 +1,200 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module provides counters for the outcomes of mix node
+operations, rates over a sliding window and their export in
+the Prometheus text format.
+"""
+
+import threading
+import time
+from collections import deque
+
+from sphinxmixcrypto.errors import HeaderAlphaGroupMismatchError, ReplayError, IncorrectMACError
+from sphinxmixcrypto.errors import InvalidProcessDestinationError, InvalidMessageTypeError
+from sphinxmixcrypto.errors import SphinxBodySizeMismatchError
+
+
+class ShardedCounters(object):
+    """
+    I am a fixed set of named counters which can be incremented from
+    many threads without taking a lock: every thread increments its
+    own shard and reading the counters sums the shards.
+    """
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0] * len(self.names)
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def increment(self, name, n=1):
+        self._shard()[self._index[name]] += n
+
+    def totals(self):
+        """
+        Returns a dict of counter name to its total.
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+        totals = [0] * len(self.names)
+        for shard in shards:
+            for i, n in enumerate(shard):
+                totals[i] += n
+        return dict(zip(self.names, totals))
+
+
+class SlidingWindowRates(object):
+    """
+    I compute per second rates of counters over a sliding window
+    from periodic samples of their totals.
+
+    :param counters: A ShardedCounters to sample.
+
+    :param horizon: Seconds of samples to keep, the longest
+    window rates can be asked for.
+
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, counters, horizon=300.0, clock=time.monotonic):
+        self.counters = counters
+        self.horizon = horizon
+        self.clock = clock
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def tick(self, now=None):
+        """
+        Take a sample of the counter totals, returns the totals.
+        """
+        if now is None:
+            now = self.clock()
+        totals = self.counters.totals()
+        with self._lock:
+            self._samples.append((now, totals))
+            while len(self._samples) > 2 and self._samples[1][0] <= now - self.horizon:
+                self._samples.popleft()
+        return totals
+
+    def rates(self, window=60.0, now=None):
+        """
+        Returns a dict of counter name to its rate per second over
+        the last window seconds, measured between the newest sample
+        and the newest sample at least window seconds older.
+        """
+        totals = self.tick(now)
+        with self._lock:
+            newest_time = self._samples[-1][0]
+            oldest_time, oldest = self._samples[0]
+            for sample_time, sample in reversed(self._samples):
+                if sample_time <= newest_time - window:
+                    oldest_time, oldest = sample_time, sample
+                    break
+        elapsed = newest_time - oldest_time
+        if elapsed <= 0:
+            return dict((name, 0.0) for name in totals)
+        return dict((name, (totals[name] - oldest[name]) / elapsed) for name in totals)
+
+
+OUTCOME_MIX = "mix"
+OUTCOME_EXIT = "exit"
+OUTCOME_CLIENT = "client"
+
+ERROR_OUTCOMES = {
+    SphinxBodySizeMismatchError: "body_size_mismatch",
+    HeaderAlphaGroupMismatchError: "alpha_group_mismatch",
+    ReplayError: "replay",
+    IncorrectMACError: "incorrect_mac",
+    InvalidProcessDestinationError: "invalid_process_destination",
+    InvalidMessageTypeError: "invalid_message_type",
+}
+
+UNWRAP_OUTCOMES = (OUTCOME_MIX, OUTCOME_EXIT, OUTCOME_CLIENT) + tuple(sorted(ERROR_OUTCOMES.values()))
+
+
+class UnwrapMetrics(object):
+    """
+    I count the outcomes of sphinx_packet_unwrap: packets to mix,
+    exit and client hops and each kind of rejected packet.
+    """
+
+    def __init__(self, horizon=300.0, clock=time.monotonic):
+        self.counters = ShardedCounters(UNWRAP_OUTCOMES)
+        self.window = SlidingWindowRates(self.counters, horizon, clock)
+
+    def record(self, result):
+        """
+        Count the result of an unwrap, an UnwrappedMessage
+        or the class of the exception it was rejected with.
+        """
+        if isinstance(result, type):
+            outcome = ERROR_OUTCOMES[result]
+        elif result.next_hop is not None:
+            outcome = OUTCOME_MIX
+        elif result.exit_hop is not None:
+            outcome = OUTCOME_EXIT
+        else:
+            outcome = OUTCOME_CLIENT
+        self.counters.increment(outcome)
+
+    def tick(self, now=None):
+        return self.window.tick(now)
+
+    def snapshot(self, window=60.0, now=None):
+        """
+        Returns a dict with the "totals" of every outcome and
+        their "rates" per second over the window.
+        """
+        rates = self.window.rates(window, now)
+        return {
+            "totals": self.counters.totals(),
+            "rates": rates,
+            "window": window,
+        }
+
+    def to_prometheus(self, prefix="sphinx_unwrap", window=60.0, now=None):
+        """
+        Returns the snapshot in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot(window, now)
+        lines = [
+            "# HELP %s_packets_total Sphinx packets unwrapped by outcome." % prefix,
+            "# TYPE %s_packets_total counter" % prefix,
+        ]
+        for outcome in UNWRAP_OUTCOMES:
+            lines.append('%s_packets_total{outcome="%s"} %d' % (prefix, outcome, snapshot["totals"][outcome]))
+        lines.extend([
+            "# HELP %s_packets_rate Sphinx packets unwrapped per second over the last %g seconds." % (prefix, window),
+            "# TYPE %s_packets_rate gauge" % prefix,
+        ])
+        for outcome in UNWRAP_OUTCOMES:
+            lines.append('%s_packets_rate{outcome="%s"} %r' % (prefix, outcome, snapshot["rates"][outcome]))
+        return "\n".join(lines) + "\n"
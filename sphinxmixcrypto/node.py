@@ -23,44 +23,30 @@ This module includes cryptographic unwrapping of messages for mix net nodes
 """
 
 import zope.interface
-import attr
 
-from sphinxmixcrypto.client import SphinxPacket, SphinxHeader, SphinxBody, SphinxParams
+from sphinxmixcrypto.client import SphinxPacket, SphinxHeader, SphinxBody, SphinxParams, check_type, record_type
+from sphinxmixcrypto.params import prefix_free_decode, SECURITY_PARAMETER
 from sphinxmixcrypto.padding import remove_padding
 from sphinxmixcrypto.interfaces import IPacketReplayCache, IKeyState
-from sphinxmixcrypto.crypto_primitives import SECURITY_PARAMETER, GroupCurve25519, SphinxDigest
-from sphinxmixcrypto.crypto_primitives import SphinxStreamCipher, SphinxLioness, xor, CURVE25519_SIZE
+from sphinxmixcrypto.instrumentation import stage_clock
+from sphinxmixcrypto.crypto_primitives import GroupCurve25519, SphinxDigest
+from sphinxmixcrypto.crypto_primitives import SphinxStreamCipher, SphinxLioness, xor
 from sphinxmixcrypto.errors import HeaderAlphaGroupMismatchError, ReplayError, IncorrectMACError
 from sphinxmixcrypto.errors import InvalidProcessDestinationError, InvalidMessageTypeError
 from sphinxmixcrypto.errors import SphinxBodySizeMismatchError
 
 
-@attr.s(frozen=True)
-class UnwrappedMessage(object):
+class UnwrappedMessage(record_type("UnwrappedMessage", ["next_hop", "exit_hop", "client_hop"])):
     """
     I am the returned result of calling `sphinx_packet_unwrap`.
     """
-    next_hop = attr.ib(validator=attr.validators.optional(attr.validators.instance_of(tuple)))
-    exit_hop = attr.ib(validator=attr.validators.optional(attr.validators.instance_of(tuple)))
-    client_hop = attr.ib(validator=attr.validators.optional(attr.validators.instance_of(tuple)))
-
-
-# Decode the prefix-free encoding.
-# Returns the type, value, and the remainder of the input string
-def prefix_free_decode(s):
-    if len(s) == 0:
-        return None, None, None
-    if isinstance(s[0], int):
-        l = s[0]
-    else:
-        l = ord(s[0])
-    if l == 0:
-        return 'process', None, s[1:]
-    if l == 255:
-        return 'mix', s[:SECURITY_PARAMETER], s[SECURITY_PARAMETER:]
-    if l < 128:
-        return 'client', s[1:l + 1], s[l + 1:]
-    return None, None, None
+    __slots__ = ()
+
+    def __new__(cls, next_hop, exit_hop, client_hop):
+        for name, value in (("next_hop", next_hop), ("exit_hop", exit_hop), ("client_hop", client_hop)):
+            if value is not None:
+                check_type(name, value, tuple)
+        return tuple.__new__(cls, (next_hop, exit_hop, client_hop))
 
 
 @zope.interface.implementer(IPacketReplayCache)
@@ -84,58 +70,251 @@ class PacketReplayCacheDict:
         self.cache = {}
 
 
-def sphinx_packet_unwrap(params, replay_cache, key_state, sphinx_packet):
+def sphinx_packet_unwrap(params, replay_cache, key_state, sphinx_packet, instrument=None, metrics=None, raise_errors=True):
     """
     sphinx_packet_unwrap returns a UnwrappedMessage given the replay
     cache, private key and a packet or raises an exception if an error
     was encountered
+
+    If instrument, an IInstrumentSink provider, is given then the
+    duration of each unwrap stage is recorded to it. If metrics, an
+    UnwrapMetrics, is given then the outcome is counted by it.
+
+    If raise_errors is False a rejected packet does not raise, instead
+    the exception class is returned in place of the UnwrappedMessage;
+    this avoids the cost of raising and catching an exception for
+    every bad packet of a flood.
+
+    Long running nodes should keep a NodeUnwrapper instead of
+    calling me for every packet.
+    """
+    unwrapper = NodeUnwrapper(params, replay_cache, key_state, instrument=instrument, metrics=metrics)
+    return unwrapper.unwrap(sphinx_packet, raise_errors=raise_errors)
+
+
+class NodeUnwrapper(object):
+    """
+    I unwrap sphinx packets for one mix node. I validate and bind the
+    params, replay cache and key state once and precompute the packet
+    offsets, padding constants and crypto primitives used for every
+    packet. A node whose key state changes needs a new NodeUnwrapper.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param replay_cache: An IPacketReplayCache provider.
+
+    :param key_state: An IKeyState provider.
+
+    :param instrument: Optional IInstrumentSink provider to record
+    the duration of each unwrap stage to.
+
+    :param metrics: Optional UnwrapMetrics counting the outcomes.
     """
-    assert isinstance(params, SphinxParams)
-    assert IPacketReplayCache.providedBy(replay_cache)
-    assert IKeyState.providedBy(key_state)
-    assert isinstance(sphinx_packet, SphinxPacket)
-
-    if len(sphinx_packet.body.delta) != params.payload_size:
-        raise SphinxBodySizeMismatchError()
-    group = GroupCurve25519()
-    digest = SphinxDigest()
-    stream_cipher = SphinxStreamCipher()
-    block_cipher = SphinxLioness()
-    if not group.in_group(sphinx_packet.header.alpha):
-        raise HeaderAlphaGroupMismatchError()
-    s = group.expon(sphinx_packet.header.alpha, key_state.get_private_key())
-    tag = digest.hash_replay(s)
-    if replay_cache.has_seen(tag):
-        raise ReplayError()
-    if sphinx_packet.header.gamma != digest.hmac(digest.create_hmac_key(s), sphinx_packet.header.beta):
-        raise IncorrectMACError()
-    replay_cache.set_seen(tag)
-    payload = block_cipher.decrypt(block_cipher.create_block_cipher_key(s), sphinx_packet.body.delta)
-    B = xor(sphinx_packet.header.beta + (b"\x00" * (2 * SECURITY_PARAMETER)), stream_cipher.generate_stream(digest.create_stream_cipher_key(s), params.beta_cipher_size))
-    message_type, val, rest = prefix_free_decode(B)
-
-    if message_type == "mix":
-        b = digest.hash_blinding(sphinx_packet.header.alpha, s)
-        alpha = group.expon(sphinx_packet.header.alpha, b)
-        gamma = B[SECURITY_PARAMETER:SECURITY_PARAMETER * 2]
-        beta = B[SECURITY_PARAMETER * 2:]
-        unwrapped_sphinx_packet = SphinxPacket(
-            header=SphinxHeader(alpha, beta, gamma),
-            body=SphinxBody(payload)
-        )
-        result = UnwrappedMessage(next_hop = (val, unwrapped_sphinx_packet), exit_hop=None, client_hop=None)
+
+    def __init__(self, params, replay_cache, key_state, instrument=None, metrics=None):
+        assert isinstance(params, SphinxParams)
+        assert IPacketReplayCache.providedBy(replay_cache)
+        assert IKeyState.providedBy(key_state)
+        self.params = params
+        self.replay_cache = replay_cache
+        self.key_state = key_state
+        self.instrument = instrument
+        self.metrics = metrics
+        self.private_key = key_state.get_private_key()
+
+        self.group = GroupCurve25519()
+        self.digest = SphinxDigest()
+        self.stream_cipher = SphinxStreamCipher()
+        self.block_cipher = SphinxLioness()
+
+        alpha, beta, gamma, delta = params.get_dimensions()
+        self.payload_size = delta
+        self.packet_size = alpha + beta + gamma + delta
+        self._beta_offset = alpha
+        self._gamma_offset = alpha + beta
+        self._delta_offset = alpha + beta + gamma
+        self._beta_cipher_size = params.beta_cipher_size
+        self._beta_padding = b"\x00" * (2 * SECURITY_PARAMETER)
+        self._zero_prefix = b"\x00" * SECURITY_PARAMETER
+
+    def unwrap(self, sphinx_packet, raise_errors=True):
+        """
+        Returns the UnwrappedMessage of a SphinxPacket, see
+        sphinx_packet_unwrap for raise_errors.
+        """
+        assert isinstance(sphinx_packet, SphinxPacket)
+        header = sphinx_packet.header
+        return self._finish(self._unwrap(header.alpha, header.beta, header.gamma, sphinx_packet.body.delta,
+                                         stage_clock(self.instrument)), raise_errors)
+
+    def unwrap_raw(self, raw_packet, raise_errors=True):
+        """
+        Returns the UnwrappedMessage of a raw packet, a bytes-like
+        object, without building a SphinxPacket for it first.
+        """
+        if len(raw_packet) != self.packet_size:
+            return self._finish(SphinxBodySizeMismatchError, raise_errors)
+        alpha, beta, gamma, delta = self._split_raw(raw_packet)
+        return self._finish(self._unwrap(alpha, beta, gamma, delta, stage_clock(self.instrument)), raise_errors)
+
+    def unwrap_header(self, sphinx_packet, raise_errors=True):
+        """
+        Unwrap only the header of a SphinxPacket, returns an
+        UnwrappedHeader holding the routing decision, whose finish
+        method decrypts the body. A rejected packet is handled as
+        by unwrap; an accepted one is counted by the metrics when
+        finished, a packet dropped unfinished is not counted.
+        """
+        assert isinstance(sphinx_packet, SphinxPacket)
+        header = sphinx_packet.header
+        return self._finish_header(self._unwrap_header(header.alpha, header.beta, header.gamma,
+                                                       sphinx_packet.body.delta, stage_clock(self.instrument)),
+                                   raise_errors)
+
+    def unwrap_header_raw(self, raw_packet, raise_errors=True):
+        """
+        Unwrap only the header of a raw packet, see unwrap_header.
+        """
+        if len(raw_packet) != self.packet_size:
+            return self._finish(SphinxBodySizeMismatchError, raise_errors)
+        alpha, beta, gamma, delta = self._split_raw(raw_packet)
+        return self._finish_header(self._unwrap_header(alpha, beta, gamma, delta, stage_clock(self.instrument)),
+                                   raise_errors)
+
+    def _split_raw(self, raw_packet):
+        alpha = bytes(raw_packet[:self._beta_offset])
+        beta = bytes(raw_packet[self._beta_offset:self._gamma_offset])
+        gamma = bytes(raw_packet[self._gamma_offset:self._delta_offset])
+        delta = bytes(raw_packet[self._delta_offset:])
+        return alpha, beta, gamma, delta
+
+    def _finish_header(self, result, raise_errors):
+        if isinstance(result, type):
+            return self._finish(result, raise_errors)
         return result
-    elif message_type == "process":
-        if payload[:SECURITY_PARAMETER] == (b"\x00" * SECURITY_PARAMETER):
-            inner_type, val, rest = prefix_free_decode(payload[SECURITY_PARAMETER:])
-            if inner_type == "client":
-                # We're to deliver rest (unpadded) to val
-                body = remove_padding(rest)
-                result = UnwrappedMessage(exit_hop = (val, body), next_hop=None, client_hop=None)
-                return result
-        raise InvalidProcessDestinationError()
-    elif message_type == "client":
-        id = rest[:SECURITY_PARAMETER]
-        result = UnwrappedMessage(client_hop = (val, id, SphinxBody(payload)), exit_hop=None, next_hop=None)
+
+    def _finish(self, result, raise_errors):
+        if self.metrics is not None:
+            self.metrics.record(result)
+        if raise_errors and isinstance(result, type):
+            raise result()
+        return result
+
+    def _unwrap(self, alpha, beta, gamma, delta, clock):
+        """
+        _unwrap returns a UnwrappedMessage or the class of the
+        exception describing why the packet was rejected.
+        """
+        header = self._unwrap_header(alpha, beta, gamma, delta, clock)
+        if isinstance(header, type):
+            return header
+        return self._unwrap_body(header, clock)
+
+    def _unwrap_header(self, alpha, beta, gamma, delta, clock):
+        """
+        _unwrap_header returns an UnwrappedHeader or the class of
+        the exception describing why the packet was rejected.
+        """
+        clock.count("unwrap.packets")
+        if len(delta) != self.payload_size:
+            return SphinxBodySizeMismatchError
+        group = self.group
+        digest = self.digest
+        if not group.in_group(alpha):
+            return HeaderAlphaGroupMismatchError
+        clock.lap("unwrap.setup")
+        s = group.expon(alpha, self.private_key)
+        clock.lap("unwrap.expon")
+        tag = digest.hash_replay(s)
+        clock.lap("unwrap.replay_tag")
+        if self.replay_cache.has_seen(tag):
+            return ReplayError
+        clock.lap("unwrap.replay_lookup")
+        if gamma != digest.hmac(digest.create_hmac_key(s), beta):
+            return IncorrectMACError
+        clock.lap("unwrap.mac")
+        self.replay_cache.set_seen(tag)
+        clock.lap("unwrap.replay_insert")
+        B = xor(beta + self._beta_padding, self.stream_cipher.generate_stream(digest.create_stream_cipher_key(s), self._beta_cipher_size))
+        clock.lap("unwrap.beta_stream")
+        message_type, val, rest = prefix_free_decode(B)
+
+        if message_type == "mix":
+            b = digest.hash_blinding(alpha, s)
+            next_alpha = group.expon(alpha, b)
+            clock.lap("unwrap.blinding")
+            next_gamma = B[SECURITY_PARAMETER:SECURITY_PARAMETER * 2]
+            next_beta = B[SECURITY_PARAMETER * 2:]
+            return UnwrappedHeader(self, s, delta, message_type, val,
+                                   SphinxHeader._make((next_alpha, next_beta, next_gamma)), None)
+        elif message_type == "process":
+            return UnwrappedHeader(self, s, delta, message_type, None, None, None)
+        elif message_type == "client":
+            return UnwrappedHeader(self, s, delta, message_type, None, None, (val, rest[:SECURITY_PARAMETER]))
+        return InvalidMessageTypeError
+
+    def _unwrap_body(self, header, clock):
+        """
+        _unwrap_body decrypts the body of a packet whose header was
+        unwrapped, returns a UnwrappedMessage or the class of the
+        exception describing why the packet was rejected.
+        """
+        block_cipher = self.block_cipher
+        payload = block_cipher.decrypt(block_cipher.create_block_cipher_key(header._secret), header._delta)
+        clock.lap("unwrap.lioness")
+        message_type = header.message_type
+        if message_type == "mix":
+            unwrapped_sphinx_packet = SphinxPacket._make((header.next_header, SphinxBody._make((payload,))))
+            return UnwrappedMessage._make(((header.next_node_id, unwrapped_sphinx_packet), None, None))
+        elif message_type == "process":
+            if payload[:SECURITY_PARAMETER] == self._zero_prefix:
+                inner_type, val, rest = prefix_free_decode(payload[SECURITY_PARAMETER:])
+                if inner_type == "client":
+                    # We're to deliver rest (unpadded) to val
+                    body = remove_padding(rest)
+                    return UnwrappedMessage._make((None, (val, body), None))
+            return InvalidProcessDestinationError
+        client_id, message_id = header.client
+        return UnwrappedMessage._make((None, None, (client_id, message_id, SphinxBody._make((payload,)))))
+
+
+class UnwrappedHeader(object):
+    """
+    I am the routing decision of a packet whose header was unwrapped
+    by NodeUnwrapper.unwrap_header, its body still encrypted. The
+    node can decide where the packet goes, or drop it, before paying
+    for the body decryption, which my finish method does and which
+    may run on another thread.
+
+    message_type is "mix", "process" or "client". A mix packet has
+    the next_node_id and next_header it is forwarded with; a client
+    packet has client, the client id and message id of the reply.
+    """
+    __slots__ = ("message_type", "next_node_id", "next_header", "client", "_unwrapper", "_secret", "_delta", "_result")
+
+    def __init__(self, unwrapper, secret, delta, message_type, next_node_id, next_header, client):
+        self._unwrapper = unwrapper
+        self._secret = secret
+        self._delta = delta
+        self.message_type = message_type
+        self.next_node_id = next_node_id
+        self.next_header = next_header
+        self.client = client
+        self._result = None
+
+    def finish(self, raise_errors=True):
+        """
+        Decrypt the body, returns the UnwrappedMessage of the packet,
+        see sphinx_packet_unwrap for raise_errors. Calling me again
+        returns the same result without decrypting or counting it twice.
+        """
+        result = self._result
+        if result is None:
+            unwrapper = self._unwrapper
+            result = unwrapper._finish(unwrapper._unwrap_body(self, stage_clock(unwrapper.instrument)), False)
+            self._result = result
+            self._secret = None
+            self._delta = None
+        if raise_errors and isinstance(result, type):
+            raise result()
         return result
-    raise InvalidMessageTypeError()
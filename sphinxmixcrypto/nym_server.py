@@ -16,43 +16,142 @@
 # License along with Sphinx.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+from collections import deque
+
+import zope.interface
+
 from sphinxmixcrypto.node import UnwrappedMessage
 from sphinxmixcrypto.client import SphinxPacket, SphinxBody
-from sphinxmixcrypto.padding import add_padding
+from sphinxmixcrypto.padding import pad_into
+from sphinxmixcrypto.interfaces import ISURBStore
 from sphinxmixcrypto.crypto_primitives import SphinxLioness, SphinxDigest, SECURITY_PARAMETER
-from sphinxmixcrypto.errors import SphinxNoSURBSAvailableError
+from sphinxmixcrypto.errors import SphinxNoSURBSAvailableError, NymMessageSizeError
+
+
+@zope.interface.implementer(ISURBStore)
+class SURBStoreDict:
+    """
+    I am an implementation of ISURBStore that keeps
+    the reply blocks in memory, a dict of nym to a
+    queue of nymtuples.
+    """
+
+    def __init__(self):
+        self.database = {}
+
+    def add(self, nym, nymtuple):
+        db = self.database
+        if nym in db:
+            db[nym].append(nymtuple)
+        else:
+            db[nym] = deque([nymtuple])
+
+    def pop(self, nym):
+        surbs = self.database.get(nym)
+        if not surbs:
+            return None
+        nymtuple = surbs.popleft()
+        if not surbs:
+            del self.database[nym]
+        return nymtuple
+
+    def count(self, nym):
+        return len(self.database.get(nym, ()))
 
 
 class NymResult:
     def __init__(self):
         self.message_result = None
+        self.error = None
 
 
 class Nymserver:
-    def __init__(self, params):
+    def __init__(self, params, surb_store=None):
         self.params = params
-        self.database = {}
+        if surb_store is None:
+            surb_store = SURBStoreDict()
+        assert ISURBStore.providedBy(surb_store)
+        self.surb_store = surb_store
         self.digest = SphinxDigest()
         self.block_cipher = SphinxLioness()
 
     def add_surb(self, nym, nymtuple):
-        db = self.database
-        if nym in db:
-            db[nym].append(nymtuple)
-        else:
-            db[nym] = [nymtuple]
+        self.surb_store.add(nym, nymtuple)
+
+    def max_message_size(self):
+        """
+        Returns the largest message a reply can carry, what remains
+        of the payload after the zero prefix and the padding length.
+        """
+        return self.params.payload_size - SECURITY_PARAMETER - 3
+
+    def _pad(self, buf, message):
+        return bytes(pad_into(buf, message, SECURITY_PARAMETER))
+
+    def _encrypt(self, nymtuple, block):
+        n0, header0, ktilde = nymtuple
+        key = self.block_cipher.create_block_cipher_key(ktilde)
+        body = self.block_cipher.encrypt(key, block)
+        sphinx_packet = SphinxPacket._make((header0, SphinxBody._make((body,))))
+        return UnwrappedMessage._make(((n0, sphinx_packet), None, None))
 
     def process(self, nym, message):
+        # checked first, so that a message too large does not use up a SURB
+        if len(message) > self.max_message_size():
+            raise NymMessageSizeError
         result = NymResult()
-        db = self.database
-        if nym in db and len(db[nym]) > 0:
-            n0, header0, ktilde = db[nym].pop(0)
-            key = self.block_cipher.create_block_cipher_key(ktilde)
-            block = add_padding((b"\x00" * SECURITY_PARAMETER) + message, self.params.payload_size)
-            body = self.block_cipher.encrypt(key, block)
-            sphinx_packet = SphinxPacket(header0, SphinxBody(body))
-            unwrapped_message = UnwrappedMessage(next_hop=(n0, sphinx_packet), exit_hop=None, client_hop=None)
-            result.message_result = unwrapped_message
-        else:
+        nymtuple = self.surb_store.pop(nym)
+        if nymtuple is None:
             raise SphinxNoSURBSAvailableError
+        block = self._pad(bytearray(self.params.payload_size), message)
+        result.message_result = self._encrypt(nymtuple, block)
         return result
+
+    def process_many(self, messages, executor=None):
+        """
+        Process a batch of messages, e.g. a message fanned out to
+        many nyms.
+
+        :param messages: An iterable of (nym, message) 2-tuples.
+
+        :param executor: Optional concurrent.futures executor to run
+        the block cipher encryptions on.
+
+        :returns: a list of NymResult, one per input message and in the
+        same order. A nym without reply blocks gets a NymResult whose
+        error is a SphinxNoSURBSAvailableError, and a message too large
+        one whose error is a NymMessageSizeError without using up a
+        reply block, instead of aborting the batch.
+        """
+        results = []
+        jobs = []
+        # every distinct message is padded once into the same buffer
+        buf = bytearray(self.params.payload_size)
+        blocks = {}
+        max_message_size = self.max_message_size()
+        for nym, message in messages:
+            result = NymResult()
+            if len(message) > max_message_size:
+                result.error = NymMessageSizeError()
+                results.append(result)
+                continue
+            nymtuple = self.surb_store.pop(nym)
+            if nymtuple is None:
+                result.error = SphinxNoSURBSAvailableError()
+            else:
+                block = blocks.get(message)
+                if block is None:
+                    block = blocks[message] = self._pad(buf, message)
+                jobs.append((result, nymtuple, block))
+            results.append(result)
+
+        def encrypt(job):
+            result, nymtuple, block = job
+            result.message_result = self._encrypt(nymtuple, block)
+        if executor is None:
+            for job in jobs:
+                encrypt(job)
+        else:
+            for _ in executor.map(encrypt, jobs):
+                pass
+        return results
@@ -0,0 +1,294 @@
+# Copyright 2011 Ian Goldberg
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+This module serves a Nymserver over TCP or unix sockets with asyncio,
+it requires Python 3.7 or later.
+"""
+
+import asyncio
+import struct
+
+from sphinxmixcrypto.client import SphinxHeader
+from sphinxmixcrypto.nym_server import Nymserver
+from sphinxmixcrypto.params import SECURITY_PARAMETER
+from sphinxmixcrypto.errors import SphinxNoSURBSAvailableError, NymMessageSizeError
+
+
+# The nym service protocol: every frame is a 4 byte big endian length
+# followed by that many bytes, a one byte command or status and its
+# payload. Deposit and submit payloads begin with a length prefixed nym.
+CMD_DEPOSIT = 1
+CMD_SUBMIT = 2
+
+STATUS_OK = 0
+STATUS_NO_SURBS = 1
+STATUS_BAD_REQUEST = 2
+
+_FRAME_LENGTH = struct.Struct(">I")
+
+
+def encode_frame(kind, payload):
+    return _FRAME_LENGTH.pack(1 + len(payload)) + struct.pack(">B", kind) + payload
+
+
+def encode_deposit(nym, nymtuple):
+    """
+    Encode a CMD_DEPOSIT frame storing nymtuple for nym.
+    """
+    n0, header0, ktilde = nymtuple
+    assert len(nym) < 256
+    return encode_frame(CMD_DEPOSIT, b"".join((
+        struct.pack(">B", len(nym)), nym, n0, header0.alpha, header0.beta, header0.gamma, ktilde)))
+
+
+def encode_submit(nym, message):
+    """
+    Encode a CMD_SUBMIT frame sending message to nym.
+    """
+    assert len(nym) < 256
+    return encode_frame(CMD_SUBMIT, struct.pack(">B", len(nym)) + nym + message)
+
+
+async def read_frame(reader, max_size):
+    """
+    Read one frame from an asyncio StreamReader, returns a 2-tuple
+    of command or status and payload, or None at end of stream.
+    """
+    try:
+        prefix = await reader.readexactly(_FRAME_LENGTH.size)
+    except asyncio.IncompleteReadError:
+        return None
+    length, = _FRAME_LENGTH.unpack(prefix)
+    if length < 1 or length > max_size:
+        raise ValueError("invalid frame length %d" % length)
+    frame = await reader.readexactly(length)
+    return frame[0], frame[1:]
+
+
+class NymService(object):
+    """
+    I am an asyncio service in front of a Nymserver, accepting SURB
+    deposits and message submissions over TCP or a Unix socket.
+
+    Requests go through a bounded queue to a fixed number of workers,
+    so that slow crypto pushes back on the connections. SURB
+    consumption is serialized per nym and the work itself runs on an
+    executor. Replies generated by the Nymserver are put on the
+    bounded `outgoing` queue as UnwrappedMessage instances, ready to be
+    sent to their first hop.
+
+    :param nymserver: The Nymserver to serve.
+
+    :param executor: concurrent.futures executor for the crypto,
+    None for the event loop's default executor.
+
+    :param workers: Number of concurrent requests being processed.
+
+    :param max_pending: Bound of the request and outgoing queues.
+    """
+
+    def __init__(self, nymserver, executor=None, workers=4, max_pending=1024):
+        assert isinstance(nymserver, Nymserver)
+        self.nymserver = nymserver
+        self.executor = executor
+        self.outgoing = asyncio.Queue(maxsize=max_pending)
+        self._requests = asyncio.Queue(maxsize=max_pending)
+        self._num_workers = workers
+        self._workers = []
+        self._servers = []
+        self._connections = set()
+        self._nym_locks = {}
+        alpha, beta, gamma, _ = nymserver.params.get_dimensions()
+        self._header_dimensions = (alpha, beta, gamma)
+        self._deposit_size = SECURITY_PARAMETER + alpha + beta + gamma + 32
+        self._max_message_size = nymserver.max_message_size()
+        self.max_frame_size = 2 + 255 + max(self._deposit_size, self._max_message_size)
+
+    async def start_tcp(self, host, port):
+        """
+        Listen on a TCP address, returns the asyncio Server.
+        """
+        self._start_workers()
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        self._servers.append(server)
+        return server
+
+    async def start_unix(self, path):
+        """
+        Listen on a Unix domain socket, returns the asyncio Server.
+        """
+        self._start_workers()
+        server = await asyncio.start_unix_server(self._handle_connection, path)
+        self._servers.append(server)
+        return server
+
+    async def close(self):
+        """
+        Stop listening, drop the open connections and stop the workers.
+        """
+        servers, self._servers = self._servers, []
+        for server in servers:
+            server.close()
+        tasks = list(self._connections) + self._workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        for server in servers:
+            await server.wait_closed()
+
+    def _start_workers(self):
+        if not self._workers:
+            self._workers = [asyncio.ensure_future(self._work()) for _ in range(self._num_workers)]
+
+    def _parse_nym(self, payload):
+        nym_len = payload[0]
+        if len(payload) < 1 + nym_len:
+            raise ValueError("truncated nym")
+        return payload[1:1 + nym_len], payload[1 + nym_len:]
+
+    def _parse_deposit(self, payload):
+        if len(payload) != self._deposit_size:
+            raise ValueError("invalid deposit size")
+        alpha, beta, gamma = self._header_dimensions
+        i = SECURITY_PARAMETER
+        header = SphinxHeader(payload[i:i + alpha],
+                              payload[i + alpha:i + alpha + beta],
+                              payload[i + alpha + beta:i + alpha + beta + gamma])
+        return payload[:SECURITY_PARAMETER], header, payload[i + alpha + beta + gamma:]
+
+    def _parse_submit(self, payload):
+        # rejected here, the Nymserver would only fail after taking a SURB
+        if len(payload) > self._max_message_size:
+            raise ValueError("message too large")
+        return payload
+
+    async def _handle_connection(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader, self.max_frame_size)
+                except ValueError:
+                    break
+                if frame is None:
+                    break
+                command, payload = frame
+                try:
+                    nym, payload = self._parse_nym(payload)
+                    if command == CMD_DEPOSIT:
+                        request = (command, nym, self._parse_deposit(payload))
+                    elif command == CMD_SUBMIT:
+                        request = (command, nym, self._parse_submit(payload))
+                    else:
+                        raise ValueError("invalid command")
+                except (ValueError, IndexError):
+                    writer.write(encode_frame(STATUS_BAD_REQUEST, b""))
+                    continue
+                reply = loop.create_future()
+                await self._requests.put((request, reply))
+                status = await reply
+                writer.write(encode_frame(status, b""))
+                await writer.drain()
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _work(self):
+        while True:
+            request, reply = await self._requests.get()
+            try:
+                status = await self._serve(*request)
+            except Exception as e:
+                if not reply.done():
+                    reply.set_exception(e)
+                continue
+            if not reply.done():
+                reply.set_result(status)
+
+    async def _serve(self, command, nym, argument):
+        loop = asyncio.get_event_loop()
+        entry = self._nym_locks.get(nym)
+        if entry is None:
+            entry = self._nym_locks[nym] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if command == CMD_DEPOSIT:
+                    await loop.run_in_executor(self.executor, self.nymserver.add_surb, nym, argument)
+                    return STATUS_OK
+                try:
+                    result = await loop.run_in_executor(self.executor, self.nymserver.process, nym, argument)
+                except SphinxNoSURBSAvailableError:
+                    return STATUS_NO_SURBS
+                except NymMessageSizeError:
+                    return STATUS_BAD_REQUEST
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._nym_locks[nym]
+        await self.outgoing.put(result.message_result)
+        return STATUS_OK
+
+
+class NymServiceClient(object):
+    """
+    I am a client of the NymService protocol over an
+    asyncio stream reader and writer pair.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect_tcp(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    @classmethod
+    async def connect_unix(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    async def _request(self, frame):
+        self.writer.write(frame)
+        await self.writer.drain()
+        frame = await read_frame(self.reader, 1)
+        if frame is None:
+            raise ConnectionError("nym service closed the connection")
+        status, _ = frame
+        return status
+
+    def deposit(self, nym, nymtuple):
+        """
+        Store a SURB for nym, returns a status code.
+        """
+        return self._request(encode_deposit(nym, nymtuple))
+
+    def submit(self, nym, message):
+        """
+        Send message to nym, returns a status code.
+        """
+        return self._request(encode_submit(nym, message))
+
+    def close(self):
+        self.writer.close()
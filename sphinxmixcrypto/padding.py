@@ -33,6 +33,24 @@ def add_padding(src, block_size):
     return bytes(src) + bytes(padding) + bytes(offset_bytes)
 
 
+def pad_into(buf, src, offset=0):
+    """
+    pad_into writes src at offset into the preallocated bytearray buf
+    and pads the rest of buf the same way add_padding would, so that
+    buf == add_padding(buf[:offset] + src, len(buf)). src may be
+    empty as long as offset is not.
+    """
+    block_size = len(buf) - offset
+    assert block_size > 0
+    assert offset + len(src) != 0
+    assert len(src) < block_size - 2
+    end = offset + len(src)
+    buf[offset:end] = src
+    buf[end:len(buf) - 2] = b"\x00" * (len(buf) - 2 - end)
+    struct.pack_into('H', buf, len(buf) - 2, block_size - len(src))
+    return buf
+
+
 def remove_padding(src):
     """
     remove_padding removes the message padding
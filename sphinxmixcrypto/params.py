@@ -0,0 +1,131 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module holds the Sphinx packet parameters and the routing
+information encoding. It imports no third party module, not even
+attrs, so that tools which only compute packet sizes or parse
+routing information start quickly.
+"""
+
+
+# curve25519 key is 32 bytes
+CURVE25519_SIZE = 32
+# Sphinx provides 128 bits of security as does curve25519
+SECURITY_PARAMETER = 16
+
+
+def destination_encode(dest):
+    """
+    encode destination
+    """
+    assert len(dest) >= 1 and len(dest) <= 127
+    return b"%c" % len(dest) + dest
+
+
+# Decode the prefix-free encoding.
+# Returns the type, value, and the remainder of the input string
+def prefix_free_decode(s):
+    if len(s) == 0:
+        return None, None, None
+    if isinstance(s[0], int):
+        l = s[0]
+    else:
+        l = ord(s[0])
+    if l == 0:
+        return 'process', None, s[1:]
+    if l == 255:
+        return 'mix', s[:SECURITY_PARAMETER], s[SECURITY_PARAMETER:]
+    if l < 128:
+        return 'client', s[1:l + 1], s[l + 1:]
+    return None, None, None
+
+
+class SphinxParams(object):
+    """
+    I am the immutable parameters of a Sphinx packet format, the
+    maximum number of hops of a route and the size of the payload.
+    Two instances with the same parameters are equal.
+    """
+    __slots__ = ("max_hops", "payload_size")
+
+    def __init__(self, max_hops, payload_size):
+        for name, value in (("max_hops", max_hops), ("payload_size", payload_size)):
+            if not isinstance(value, int):
+                raise TypeError("'%s' must be %r (got %r that is a %r)." % (name, int, value, type(value)))
+        object.__setattr__(self, "max_hops", max_hops)
+        object.__setattr__(self, "payload_size", payload_size)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SphinxParams are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("SphinxParams are immutable")
+
+    def __reduce__(self):
+        return SphinxParams, (self.max_hops, self.payload_size)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.max_hops, self.payload_size) == (other.max_hops, other.payload_size)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash((self.__class__, self.max_hops, self.payload_size))
+
+    def __repr__(self):
+        return "SphinxParams(max_hops=%r, payload_size=%r)" % (self.max_hops, self.payload_size)
+
+    @property
+    def beta_cipher_size(self):
+        """
+        i am a helper method that is used to compute the size of the
+        stream cipher output used in sphinx packet operations
+        """
+        return CURVE25519_SIZE + (2 * self.max_hops + 1) * SECURITY_PARAMETER
+
+    def get_dimensions(self):
+        """
+        i am a helper method that returns the sphinx packet element sizes, a 4-tuple.
+        e.g. payload = 1024 && 5 hops ==
+        alpha 32 beta 176 gamma 16 delta 1024
+        """
+        alpha = CURVE25519_SIZE
+        beta = (2 * self.max_hops + 1) * SECURITY_PARAMETER
+        gamma = SECURITY_PARAMETER
+        delta = self.payload_size
+        return alpha, beta, gamma, delta
+
+    def elements_from_raw_bytes(self, raw_packet):
+        """
+        return the Sphinx packet elements, a 4-tuple
+        of byte slices: alpha, beta, gamma and delta.
+        """
+        alpha, beta, gamma, delta = self.get_dimensions()
+        assert len(raw_packet) == alpha + beta + gamma + delta
+        _alpha = raw_packet[:alpha]
+        _beta = raw_packet[alpha:alpha + beta]
+        _gamma = raw_packet[alpha + beta:alpha + beta + gamma]
+        _delta = raw_packet[alpha + beta + gamma:]
+        return _alpha, _beta, _gamma, _delta
@@ -0,0 +1,283 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements an in-memory IMixPKI which keeps the mix
+nodes in arrays so that clients can choose routes quickly: uniform
+sampling without replacement in O(k), bandwidth weighted sampling in
+O(k log n) using a Fenwick tree and one node per layer for layered
+topologies.
+"""
+
+import bisect
+import struct
+
+import zope.interface
+
+from sphinxmixcrypto.interfaces import IMixPKI, IReader
+from sphinxmixcrypto.errors import KeyMismatchError
+
+
+def random_below(rand_reader, n):
+    """
+    Returns a uniformly random integer in [0, n) read from an IReader.
+    """
+    assert n > 0
+    bits = n.bit_length()
+    size = (bits + 7) // 8
+    mask = (1 << bits) - 1
+    while True:
+        value = int.from_bytes(rand_reader.read(size), "big") & mask
+        if value < n:
+            return value
+
+
+def random_fraction(rand_reader):
+    """
+    Returns a uniformly random float in [0, 1) read from an IReader.
+    """
+    return (struct.unpack(">Q", rand_reader.read(8))[0] >> 11) / float(1 << 53)
+
+
+class FenwickTree(object):
+    """
+    I am a binary indexed tree of non-negative weights supporting
+    updates, prefix sums and finding the index of a cumulative
+    weight in O(log n).
+    """
+
+    def __init__(self, weights=()):
+        self.size = 0
+        self._tree = [0.0]
+        self._weights = []
+        for weight in weights:
+            self.append(weight)
+
+    def append(self, weight):
+        self.size += 1
+        self._weights.append(0.0)
+        self._tree.append(0.0)
+        # the new node covers the range ending at it,
+        # sum the nodes it covers
+        i = self.size
+        lowest = i & -i
+        j = 1
+        while j < lowest:
+            self._tree[i] += self._tree[i - j]
+            j <<= 1
+        self.update(self.size - 1, weight)
+
+    def pop(self):
+        self.update(self.size - 1, 0.0)
+        self._weights.pop()
+        self._tree.pop()
+        self.size -= 1
+
+    def weight(self, index):
+        return self._weights[index]
+
+    def update(self, index, weight):
+        assert weight >= 0
+        delta = weight - self._weights[index]
+        self._weights[index] = weight
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        total = 0.0
+        i = self.size
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, value):
+        """
+        Returns the smallest index whose cumulative weight exceeds value.
+        """
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            following = position + step
+            if following <= self.size and self._tree[following] <= value:
+                position = following
+                value -= self._tree[following]
+            step >>= 1
+        return min(position, self.size - 1)
+
+
+@zope.interface.implementer(IMixPKI)
+class IndexedMixPKI(object):
+    """
+    I am an implementation of IMixPKI holding node ids, public keys,
+    addresses, bandwidth weights and layers in parallel arrays with a
+    dict from node id to array index.
+
+    :param rand_reader: Source of entropy for route selection,
+    an IReader provider.
+
+    :param verifier: Optional function called with the old public
+    key, the new public key and the signature by rotate, returning
+    True if the signature is valid.
+    """
+
+    def __init__(self, rand_reader, verifier=None):
+        assert IReader.providedBy(rand_reader)
+        self.rand_reader = rand_reader
+        self.verifier = verifier
+        self._ids = []
+        self._keys = []
+        self._addrs = []
+        self._layers = []
+        self._index = {}
+        self._weights = FenwickTree()
+        self._layer_cache = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def set(self, node_id, pub_key, addr, weight=1.0, layer=None):
+        """
+        Add a node with its public key and address, either one
+        address or a dict of transport name to address. weight is
+        its bandwidth weight and layer its layer of a layered topology.
+        """
+        assert node_id not in self._index
+        self._index[node_id] = len(self._ids)
+        self._ids.append(node_id)
+        self._keys.append(pub_key)
+        self._addrs.append(addr)
+        self._layers.append(layer)
+        self._weights.append(weight)
+        self._layer_cache = None
+
+    def remove(self, node_id):
+        """
+        Remove a node, moving the last node into its place.
+        """
+        index = self._index.pop(node_id)
+        last = len(self._ids) - 1
+        if index != last:
+            moved = self._ids[last]
+            self._index[moved] = index
+            for array in (self._ids, self._keys, self._addrs, self._layers):
+                array[index] = array[last]
+            self._weights.update(index, self._weights.weight(last))
+        for array in (self._ids, self._keys, self._addrs, self._layers):
+            array.pop()
+        self._weights.pop()
+        self._layer_cache = None
+
+    def get(self, node_id):
+        return self._keys[self._index[node_id]]
+
+    def get_many(self, node_ids):
+        """
+        Returns the public keys of a list of node ids.
+        """
+        index = self._index
+        keys = self._keys
+        return [keys[index[node_id]] for node_id in node_ids]
+
+    def identities(self):
+        return list(self._ids)
+
+    def get_mix_addr(self, transport_name, node_id):
+        addr = self._addrs[self._index[node_id]]
+        if isinstance(addr, dict):
+            return addr[transport_name]
+        return addr
+
+    def set_weight(self, node_id, weight):
+        self._weights.update(self._index[node_id], weight)
+        self._layer_cache = None
+
+    def rotate(self, node_id, new_pub_key, signature):
+        index = self._index[node_id]
+        if self.verifier is None or not self.verifier(self._keys[index], new_pub_key, signature):
+            raise KeyMismatchError()
+        self._keys[index] = new_pub_key
+
+    def sample(self, k):
+        """
+        Returns k distinct node ids chosen uniformly at random in
+        O(k), a Fisher-Yates shuffle of only the first k positions
+        with the swaps kept in a dict.
+        """
+        n = len(self._ids)
+        assert 0 <= k <= n
+        swaps = {}
+        route = []
+        for i in range(k):
+            j = i + random_below(self.rand_reader, n - i)
+            route.append(self._ids[swaps.get(j, j)])
+            swaps[j] = swaps.get(i, i)
+        return route
+
+    def sample_weighted(self, k):
+        """
+        Returns k distinct node ids chosen at random with probability
+        proportional to their weights, without replacement, in O(k log n).
+        """
+        weights = self._weights
+        chosen = []
+        try:
+            for i in range(k):
+                total = weights.total()
+                assert total > 0, "fewer than k nodes have a positive weight"
+                index = weights.find(random_fraction(self.rand_reader) * total)
+                chosen.append((index, weights.weight(index)))
+                weights.update(index, 0.0)
+        finally:
+            for index, weight in chosen:
+                weights.update(index, weight)
+        return [self._ids[index] for index, weight in chosen]
+
+    def _layer_tables(self):
+        if self._layer_cache is None:
+            tables = {}
+            for index, layer in enumerate(self._layers):
+                if layer is None:
+                    continue
+                indexes, cumulative = tables.setdefault(layer, ([], []))
+                total = cumulative[-1] if cumulative else 0.0
+                weight = self._weights.weight(index)
+                if weight > 0:
+                    indexes.append(index)
+                    cumulative.append(total + weight)
+            self._layer_cache = tables
+        return self._layer_cache
+
+    def layered_route(self, layers, weighted=False):
+        """
+        Returns a route of one node from each of the given layers,
+        chosen uniformly or, if weighted, by bandwidth weight.
+        """
+        tables = self._layer_tables()
+        route = []
+        for layer in layers:
+            indexes, cumulative = tables[layer]
+            if weighted:
+                position = bisect.bisect_right(cumulative, random_fraction(self.rand_reader) * cumulative[-1])
+                position = min(position, len(indexes) - 1)
+            else:
+                position = random_below(self.rand_reader, len(indexes))
+            route.append(self._ids[indexes[position]])
+        return route
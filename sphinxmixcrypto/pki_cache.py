@@ -0,0 +1,219 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements a caching IMixPKI for remote directory
+services. Public keys and addresses are kept in memory with a time
+to live and refreshed in bulk by an asyncio task, so that the per
+hop lookups of create_header are answered locally; only a lookup
+missing the cache falls through to the wrapped, possibly blocking,
+IMixPKI.
+"""
+
+import asyncio
+import time
+
+import zope.interface
+
+from sphinxmixcrypto.interfaces import IMixPKI
+from sphinxmixcrypto.metrics import ShardedCounters
+
+
+CACHE_COUNTERS = ("hits", "misses", "negative_hits", "refreshes", "refresh_errors")
+
+
+@zope.interface.implementer(IMixPKI)
+class CachingMixPKI(object):
+    """
+    I am an IMixPKI caching the answers of another IMixPKI.
+
+    :param pki: The wrapped IMixPKI provider, asked on cache misses.
+
+    :param fetcher: Optional coroutine function returning the whole
+    directory, an iterable of (node id, public key, address) tuples
+    where the address is one address or a dict of transport name to
+    address. It is awaited by refresh.
+
+    :param ttl: Seconds a cached public key or address stays valid.
+
+    :param negative_ttl: Seconds a node unknown to the wrapped
+    IMixPKI is remembered as unknown.
+
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, pki, fetcher=None, ttl=300.0, negative_ttl=30.0, clock=time.monotonic):
+        assert IMixPKI.providedBy(pki)
+        assert ttl > 0 and negative_ttl >= 0
+        self.pki = pki
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.counters = ShardedCounters(CACHE_COUNTERS)
+        self._keys = {}
+        self._addrs = {}
+        self._absent = {}
+        self._identities = None
+        self._task = None
+
+    def _lookup(self, cache, key):
+        """
+        Returns the fresh cached value of key or None.
+        """
+        entry = cache.get(key)
+        if entry is not None and entry[1] > self.clock():
+            return entry[0]
+        return None
+
+    def _check_absent(self, node_id):
+        expires = self._absent.get(node_id)
+        if expires is not None:
+            if expires > self.clock():
+                self.counters.increment("negative_hits")
+                raise KeyError(node_id)
+            self._absent.pop(node_id, None)
+
+    def _fetch(self, node_id, function, *args):
+        self.counters.increment("misses")
+        try:
+            return function(*args)
+        except KeyError:
+            if self.negative_ttl > 0:
+                self._absent[node_id] = self.clock() + self.negative_ttl
+            raise
+
+    def set(self, node_id, pub_key, addr):
+        self.pki.set(node_id, pub_key, addr)
+        self._keys[node_id] = (pub_key, self.clock() + self.ttl)
+        # the cached addresses of the node, whatever their transport, are stale
+        for key in [key for key in self._addrs if key[1] == node_id]:
+            del self._addrs[key]
+        self._absent.pop(node_id, None)
+        self._identities = None
+
+    def get(self, node_id):
+        pub_key = self._lookup(self._keys, node_id)
+        if pub_key is not None:
+            self.counters.increment("hits")
+            return pub_key
+        self._check_absent(node_id)
+        pub_key = self._fetch(node_id, self.pki.get, node_id)
+        self._keys[node_id] = (pub_key, self.clock() + self.ttl)
+        return pub_key
+
+    def identities(self):
+        if self._identities is not None and self._identities[1] > self.clock():
+            self.counters.increment("hits")
+            return list(self._identities[0])
+        self.counters.increment("misses")
+        identities = self.pki.identities()
+        self._identities = (tuple(identities), self.clock() + self.ttl)
+        return list(identities)
+
+    def get_mix_addr(self, transport_name, node_id):
+        addr = self._lookup(self._addrs, (transport_name, node_id))
+        if addr is None:
+            # an address fetched without transport serves them all
+            addr = self._lookup(self._addrs, (None, node_id))
+        if addr is not None:
+            self.counters.increment("hits")
+            return addr
+        self._check_absent(node_id)
+        addr = self._fetch(node_id, self.pki.get_mix_addr, transport_name, node_id)
+        self._addrs[(transport_name, node_id)] = (addr, self.clock() + self.ttl)
+        return addr
+
+    def rotate(self, node_id, new_pub_key, signature):
+        self.pki.rotate(node_id, new_pub_key, signature)
+        self._keys[node_id] = (new_pub_key, self.clock() + self.ttl)
+
+    def prefetch(self, node_ids):
+        """
+        Fill the cache with the public keys of node_ids, for instance
+        the nodes of the routes about to be built.
+        """
+        for node_id in node_ids:
+            try:
+                self.get(node_id)
+            except KeyError:
+                pass
+
+    async def refresh(self):
+        """
+        Replace the cache with the directory returned by the fetcher,
+        returns False, keeping the cache, if fetching or reading it
+        failed.
+        """
+        assert self.fetcher is not None
+        try:
+            directory = await self.fetcher()
+            expires = self.clock() + self.ttl
+            keys = {}
+            addrs = {}
+            for node_id, pub_key, addr in directory:
+                keys[node_id] = (pub_key, expires)
+                if isinstance(addr, dict):
+                    for transport_name, transport_addr in addr.items():
+                        addrs[(transport_name, node_id)] = (transport_addr, expires)
+                else:
+                    addrs[(None, node_id)] = (addr, expires)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.counters.increment("refresh_errors")
+            return False
+        self._keys = keys
+        self._addrs = addrs
+        self._identities = (tuple(keys), expires)
+        self._absent = dict((node_id, expiry) for node_id, expiry in self._absent.items() if node_id not in keys)
+        self.counters.increment("refreshes")
+        return True
+
+    async def run(self, interval):
+        """
+        Refresh every interval seconds until cancelled, interval
+        should be shorter than the ttl for lookups to always hit.
+        """
+        while True:
+            await self.refresh()
+            await asyncio.sleep(interval)
+
+    def start(self, interval):
+        self._task = asyncio.ensure_future(self.run(interval))
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        """
+        Returns the cache counters, their hit rate and the
+        number of cached public keys.
+        """
+        stats = self.counters.totals()
+        lookups = stats["hits"] + stats["misses"] + stats["negative_hits"]
+        stats["hit_rate"] = (stats["hits"] + stats["negative_hits"]) / float(lookups) if lookups else 0.0
+        stats["cached_keys"] = len(self._keys)
+        return stats
@@ -0,0 +1,176 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements PKI snapshots: a binary file of fixed size
+node records, node id, public key, epoch and address, sorted by node
+id, and a read only IMixPKI which memory maps a snapshot and answers
+lookups by binary search without loading it. A new snapshot replaces
+the old file atomically and is picked up by remapping it.
+"""
+
+import mmap
+import os
+import struct
+
+import zope.interface
+
+from sphinxmixcrypto.interfaces import IMixPKI
+from sphinxmixcrypto.params import SECURITY_PARAMETER, CURVE25519_SIZE
+from sphinxmixcrypto.errors import PKISnapshotFormatError, ReadOnlyPKIError
+
+
+SNAPSHOT_MAGIC = b"SPHXPKI1"
+SNAPSHOT_VERSION = 1
+ADDRESS_SIZE = 63
+
+# magic, version, record count, consensus epoch
+_SNAPSHOT_HEADER = struct.Struct(">8sBIQ")
+# node id, public key, epoch, address length, address
+_RECORD = struct.Struct(">%ds%dsQB%ds" % (SECURITY_PARAMETER, CURVE25519_SIZE, ADDRESS_SIZE))
+
+
+def encode_address(addr):
+    """
+    Encode a (host, port) tuple or a unix socket path.
+    """
+    if isinstance(addr, (tuple, list)):
+        host, port = addr
+        text = "%s:%d" % (host, port)
+    else:
+        text = addr
+    encoded = text.encode("utf-8")
+    assert len(encoded) <= ADDRESS_SIZE
+    return encoded
+
+
+def decode_address(encoded):
+    text = encoded.decode("utf-8")
+    if text.startswith("/"):
+        return text
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+
+def write_snapshot(path, nodes, epoch):
+    """
+    Atomically write a snapshot of nodes, an iterable of
+    (node id, public key, address, node epoch) tuples.
+    """
+    records = sorted(nodes, key=lambda node: node[0])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(records), epoch))
+        previous = None
+        for node_id, public_key, addr, node_epoch in records:
+            assert len(node_id) == SECURITY_PARAMETER
+            assert len(public_key) == CURVE25519_SIZE
+            assert node_id != previous, "duplicate node id"
+            previous = node_id
+            encoded = encode_address(addr)
+            f.write(_RECORD.pack(node_id, public_key, node_epoch, len(encoded), encoded))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+class _Snapshot(object):
+    """
+    I am one mapped snapshot file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(_SNAPSHOT_HEADER.size)
+            if len(header) != _SNAPSHOT_HEADER.size:
+                raise PKISnapshotFormatError("truncated snapshot header")
+            magic, version, self.count, self.epoch = _SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise PKISnapshotFormatError("not a version %d PKI snapshot" % SNAPSHOT_VERSION)
+            size = os.fstat(f.fileno()).st_size
+            if size != _SNAPSHOT_HEADER.size + self.count * _RECORD.size:
+                raise PKISnapshotFormatError("snapshot size does not match its %d records" % self.count)
+            self.mapping = None
+            if self.count > 0:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def node_id(self, index):
+        offset = _SNAPSHOT_HEADER.size + index * _RECORD.size
+        return self.mapping[offset:offset + SECURITY_PARAMETER]
+
+    def find(self, node_id):
+        """
+        Returns the record of node_id, raises KeyError if absent.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.node_id(middle) < node_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.node_id(low) == node_id:
+            return _RECORD.unpack_from(self.mapping, _SNAPSHOT_HEADER.size + low * _RECORD.size)
+        raise KeyError(node_id)
+
+
+@zope.interface.implementer(IMixPKI)
+class SnapshotMixPKI(object):
+    """
+    I am a read only IMixPKI answering from a memory mapped snapshot
+    file. Opening a snapshot costs the same whatever its size, the
+    records are only read when looked up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._snapshot = _Snapshot(path)
+
+    def remap(self):
+        """
+        Map the snapshot file again, after it was replaced by a new
+        consensus. Lookups in progress finish on the old mapping.
+        """
+        self._snapshot = _Snapshot(self.path)
+
+    @property
+    def epoch(self):
+        return self._snapshot.epoch
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def set(self, node_id, pub_key, addr):
+        raise ReadOnlyPKIError("a PKI snapshot is read only, write a new one with write_snapshot")
+
+    def get(self, node_id):
+        return self._snapshot.find(node_id)[1]
+
+    def get_node_epoch(self, node_id):
+        return self._snapshot.find(node_id)[2]
+
+    def identities(self):
+        snapshot = self._snapshot
+        return [snapshot.node_id(index) for index in range(snapshot.count)]
+
+    def get_mix_addr(self, transport_name, node_id):
+        record = self._snapshot.find(node_id)
+        return decode_address(record[4][:record[3]])
+
+    def rotate(self, node_id, new_pub_key, signature):
+        raise ReadOnlyPKIError("a PKI snapshot is read only, write a new one with write_snapshot")
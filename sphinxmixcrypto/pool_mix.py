@@ -0,0 +1,221 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements batching mixes: a threshold mix which flushes
+all of its packets once it holds threshold of them and a timed pool
+mix which flushes part of its pool at every interval. Packets are
+stored in a preallocated arena, a flush shuffles slot indexes and
+copies the packets straight into one send buffer per next hop.
+"""
+
+import asyncio
+import random
+
+from sphinxmixcrypto.client import SphinxParams, SphinxPacket
+from sphinxmixcrypto.params import SECURITY_PARAMETER
+
+
+_system_random = random.SystemRandom()
+
+
+class PacketArena(object):
+    """
+    I am a preallocated buffer holding up to capacity raw packets
+    and the next hop node id of each of them.
+    """
+
+    def __init__(self, params, capacity):
+        assert isinstance(params, SphinxParams)
+        assert capacity > 0
+        self.packet_size = sum(params.get_dimensions())
+        self.capacity = capacity
+        self.buffer = bytearray(self.packet_size * capacity)
+        self.view = memoryview(self.buffer)
+        self.node_ids = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.used = []
+
+    def __len__(self):
+        return len(self.used)
+
+    def add(self, node_id, packet):
+        """
+        Store a SphinxPacket or raw packet, returns False if full.
+        """
+        if isinstance(packet, SphinxPacket):
+            assert sum(len(x) for x in packet.get_buffers()) == self.packet_size
+        else:
+            assert len(packet) == self.packet_size
+        if not self.free:
+            return False
+        slot = self.free.pop()
+        offset = slot * self.packet_size
+        try:
+            if isinstance(packet, SphinxPacket):
+                packet.write_into(self.view, offset)
+            else:
+                self.view[offset:offset + self.packet_size] = packet
+        except Exception:
+            self.free.append(slot)
+            raise
+        self.node_ids[slot] = node_id
+        self.used.append(slot)
+        return True
+
+    def drain(self, slots):
+        """
+        Returns a dict of next hop node id to a bytearray of its
+        packets, in the order of slots, and frees the slots.
+        """
+        batches = {}
+        view = self.view
+        node_ids = self.node_ids
+        size = self.packet_size
+        for slot in slots:
+            node_id = node_ids[slot]
+            batch = batches.get(node_id)
+            if batch is None:
+                batch = batches[node_id] = bytearray()
+            offset = slot * size
+            batch += view[offset:offset + size]
+            node_ids[slot] = None
+        self.free.extend(slots)
+        return batches
+
+
+class ThresholdMix(object):
+    """
+    I am a threshold mix: I hold packets until threshold of them
+    arrived and then flush them all in a random order.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param threshold: The number of packets of a batch.
+
+    :param rng: A random.Random used to shuffle, by default
+    random.SystemRandom.
+    """
+
+    def __init__(self, params, threshold, rng=_system_random):
+        self.arena = PacketArena(params, threshold)
+        self.threshold = threshold
+        self.rng = rng
+
+    def __len__(self):
+        return len(self.arena)
+
+    def add(self, node_id, packet):
+        """
+        Add a packet for the next hop node_id, returns the flushed
+        batches once the threshold is reached, otherwise None.
+        """
+        assert len(node_id) == SECURITY_PARAMETER
+        self.arena.add(node_id, packet)
+        if len(self.arena) >= self.threshold:
+            return self.flush()
+        return None
+
+    def add_next_hop(self, next_hop):
+        """
+        Add the next_hop of an UnwrappedMessage.
+        """
+        return self.add(*next_hop)
+
+    def flush(self):
+        """
+        Returns a dict of next hop node id to a send buffer holding
+        all packets of the pool, shuffled.
+        """
+        slots = self.arena.used
+        self.arena.used = []
+        self.rng.shuffle(slots)
+        return self.arena.drain(slots)
+
+
+class TimedPoolMix(object):
+    """
+    I am a timed pool mix: at every flush I send a random fraction of
+    the packets above pool_min and keep the rest in the pool.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param capacity: The most packets the pool holds, packets
+    added to a full pool are dropped.
+
+    :param pool_min: Packets always kept in the pool.
+
+    :param fraction: Fraction of the packets above pool_min
+    sent at each flush.
+
+    :param rng: A random.Random used to shuffle, by default
+    random.SystemRandom.
+    """
+
+    def __init__(self, params, capacity, pool_min=0, fraction=1.0, rng=_system_random):
+        assert 0 <= pool_min < capacity
+        assert 0.0 < fraction <= 1.0
+        self.arena = PacketArena(params, capacity)
+        self.pool_min = pool_min
+        self.fraction = fraction
+        self.rng = rng
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.arena)
+
+    def add(self, node_id, packet):
+        """
+        Add a packet for the next hop node_id, returns
+        False if the pool is full and it was dropped.
+        """
+        assert len(node_id) == SECURITY_PARAMETER
+        if not self.arena.add(node_id, packet):
+            self.dropped += 1
+            return False
+        return True
+
+    def add_next_hop(self, next_hop):
+        """
+        Add the next_hop of an UnwrappedMessage.
+        """
+        return self.add(*next_hop)
+
+    def flush(self):
+        """
+        Returns a dict of next hop node id to a send buffer
+        holding the packets chosen to leave the pool.
+        """
+        slots = self.arena.used
+        count = int((len(slots) - self.pool_min) * self.fraction)
+        if count <= 0:
+            return {}
+        self.rng.shuffle(slots)
+        self.arena.used = slots[count:]
+        return self.arena.drain(slots[:count])
+
+    async def run(self, interval, send):
+        """
+        Flush every interval seconds until cancelled, calling
+        send with each non-empty dict of batches.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            batches = self.flush()
+            if batches:
+                send(batches)
@@ -0,0 +1,269 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module holds unwrapped packets until their release time, as
+needed by stop-and-go and Poisson mixing: a hierarchical timing wheel
+with constant time insertion and expiry, and an asyncio scheduler
+releasing the due packets of the wheel.
+"""
+
+import asyncio
+import math
+import random
+import time
+
+
+_system_random = random.SystemRandom()
+
+
+def poisson_delay(mean_delay, rng=_system_random):
+    """
+    Returns a delay drawn from the exponential distribution with the
+    given mean, the per hop delay of a Poisson mix.
+    """
+    assert mean_delay > 0
+    return rng.expovariate(1.0 / mean_delay)
+
+
+async def wait_event(event, timeout):
+    """
+    Wait until the asyncio.Event event is set or timeout seconds
+    have passed. Unlike asyncio.wait_for before Python 3.12, a
+    cancellation arriving just as the event is set is never lost.
+    """
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait((waiter,), timeout=timeout)
+    finally:
+        waiter.cancel()
+
+
+class TimingWheel(object):
+    """
+    I am a hierarchical timing wheel. Time is counted in ticks of
+    tick seconds; every level has slots buckets, each bucket of a
+    level spanning all the buckets of the level below. An entry is a
+    (due tick, item) tuple, it is put in the lowest level bucket which
+    can hold it and cascades down to lower levels as time advances.
+
+    :param tick: The resolution of the wheel in seconds.
+
+    :param slots: Buckets per level, a power of two.
+
+    :param levels: Number of levels, the wheel spans
+    slots ** levels ticks; later entries wait in the last
+    bucket of the top level.
+
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, tick=0.001, slots=256, levels=4, clock=time.monotonic):
+        assert tick > 0
+        assert slots > 1 and slots & (slots - 1) == 0
+        assert levels > 0
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels = [[[] for i in range(slots)] for level in range(levels)]
+        self._ready = []
+        self._current = self._to_tick(clock())
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _to_tick(self, seconds):
+        return int(math.floor(seconds / self.tick))
+
+    def _place(self, entry):
+        due = entry[0]
+        delta = due - self._current
+        if delta <= 0:
+            self._ready.append(entry)
+            return
+        bits = self._bits
+        for level in range(self.levels):
+            if delta < 1 << (bits * (level + 1)):
+                self._wheels[level][(due >> (bits * level)) & self._mask].append(entry)
+                return
+        # beyond the span of the wheel, wait in the furthest top level
+        # bucket and get placed again when it cascades
+        top = self.levels - 1
+        self._wheels[top][((self._current >> (bits * top)) - 1) & self._mask].append(entry)
+
+    def insert_at(self, release_time, item):
+        """
+        Hold item until release_time, in seconds of the clock.
+        """
+        due = int(math.ceil(release_time / self.tick))
+        self._place((due, item))
+        self._size += 1
+
+    def insert(self, delay, item):
+        """
+        Hold item for delay seconds from now.
+        """
+        self.insert_at(self.clock() + delay, item)
+
+    def _cascade(self, level):
+        index = (self._current >> (self._bits * level)) & self._mask
+        bucket = self._wheels[level][index]
+        if bucket:
+            self._wheels[level][index] = []
+            for entry in bucket:
+                self._place(entry)
+
+    def expire(self, now=None):
+        """
+        Advance the wheel to now and return the list of
+        (due time, item) tuples which are due.
+        """
+        if now is None:
+            now = self.clock()
+        target = self._to_tick(now)
+        bits = self._bits
+        mask = self._mask
+        wheel0 = self._wheels[0]
+        while self._current < target:
+            if self._size == len(self._ready):
+                # nothing left in the wheel, jump ahead
+                self._current = target
+                break
+            self._current += 1
+            current = self._current
+            if current & mask == 0:
+                for level in range(1, self.levels):
+                    self._cascade(level)
+                    if (current >> (bits * level)) & mask != 0:
+                        break
+            index = current & mask
+            if wheel0[index]:
+                self._ready.extend(wheel0[index])
+                wheel0[index] = []
+        due, self._ready = self._ready, []
+        self._size -= len(due)
+        tick = self.tick
+        return [(entry[0] * tick, entry[1]) for entry in due]
+
+    def next_due(self):
+        """
+        Returns an upper bound on the time of the next due entry, the
+        end of the current level 0 revolution, or None if empty.
+        """
+        if self._size == 0:
+            return None
+        if self._ready:
+            return self._current * self.tick
+        for offset in range(1, self.slots + 1):
+            if self._wheels[0][(self._current + offset) & self._mask]:
+                return (self._current + offset) * self.tick
+        return ((self._current | self._mask) + 1) * self.tick
+
+
+class DelayScheduler(object):
+    """
+    I release items held in a TimingWheel from an asyncio task,
+    calling release(item) for each due item and keeping count of
+    the queue depth and how late items were released.
+
+    :param wheel: The TimingWheel holding the items.
+
+    :param release: A function called with every due item.
+
+    :param instrument: Optional IInstrumentSink provider, the
+    lateness of every release is recorded to it.
+    """
+
+    def __init__(self, wheel, release, instrument=None):
+        self.wheel = wheel
+        self.release = release
+        self.instrument = instrument
+        self.inserted = 0
+        self.released = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self._wakeup = None
+        self._task = None
+
+    def schedule(self, delay, item):
+        self.wheel.insert(delay, item)
+        self.inserted += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def release_due(self, now=None):
+        """
+        Release every due item, returns their number.
+        """
+        if now is None:
+            now = self.wheel.clock()
+        due = self.wheel.expire(now)
+        for due_time, item in due:
+            lateness = max(0.0, now - due_time)
+            self.total_lateness += lateness
+            if lateness > self.max_lateness:
+                self.max_lateness = lateness
+            if self.instrument is not None:
+                self.instrument.record("scheduler.lateness", lateness)
+            self.release(item)
+        self.released += len(due)
+        return len(due)
+
+    def stats(self):
+        return {
+            "depth": len(self.wheel),
+            "inserted": self.inserted,
+            "released": self.released,
+            "max_lateness": self.max_lateness,
+            "mean_lateness": self.total_lateness / self.released if self.released else 0.0,
+        }
+
+    async def run(self):
+        """
+        Release items as they become due until cancelled.
+        """
+        self._wakeup = asyncio.Event()
+        wheel = self.wheel
+        try:
+            while True:
+                self.release_due()
+                next_due = wheel.next_due()
+                self._wakeup.clear()
+                if next_due is None:
+                    await self._wakeup.wait()
+                    continue
+                await wait_event(self._wakeup, max(next_due - wheel.clock(), wheel.tick))
+        finally:
+            self._wakeup = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,437 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements a durable ISURBStore for the nym server,
+an append-only log of reply blocks split into segment files.
+
+Every stored SURB is an ADD record carrying a sequence number, the
+nym, the first hop, the header and ktilde. Consuming a SURB appends
+a CONSUME record naming its sequence number. Segments are memory
+mapped when the store is opened and the in-memory index is only
+built when it is first needed. Sealed segments are periodically
+rewritten by compaction which drops consumed reply blocks.
+"""
+
+import os
+import mmap
+import struct
+import threading
+import zlib
+from collections import deque
+
+import zope.interface
+
+from sphinxmixcrypto.client import SphinxHeader, SphinxParams
+from sphinxmixcrypto.interfaces import ISURBStore
+from sphinxmixcrypto.crypto_primitives import SECURITY_PARAMETER
+from sphinxmixcrypto.errors import SURBLogFormatError
+
+
+SEGMENT_MAGIC = b"SPHXSURB"
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = ".seg"
+COMPACTION_SUFFIX = ".compact"
+
+RECORD_ADD = 1
+RECORD_CONSUME = 2
+
+KTILDE_SIZE = 32
+
+# magic, version, max_hops, payload_size
+_SEGMENT_HEADER = struct.Struct(">8sBHI")
+# crc32, record kind, sequence number, nym length
+_RECORD_HEADER = struct.Struct(">IBQB")
+
+
+def _segment_name(segment_id):
+    return "%020d%s" % (segment_id, SEGMENT_SUFFIX)
+
+
+class _Segment(object):
+    """
+    I am the bookkeeping for one segment file.
+    """
+
+    def __init__(self, segment_id, path):
+        self.segment_id = segment_id
+        self.path = path
+        self.mapping = None
+        self.size = 0
+        self.added = 0
+        self.consumed = 0
+
+    def map(self):
+        self.size = os.path.getsize(self.path)
+        if self.size > 0:
+            with open(self.path, "rb") as f:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def unmap(self):
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+@zope.interface.implementer(ISURBStore)
+class SURBLogStore(object):
+    """
+    I am an implementation of ISURBStore which persists
+    reply blocks in an append-only segment log.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param path: The directory holding the segment files.
+
+    :param segment_size: Size in bytes after which the active
+    segment is sealed and a new one started.
+
+    :param sync_every: Number of appended records after which
+    the active segment is fsync'ed.
+
+    :param compact_ratio: Fraction of consumed reply blocks in the
+    sealed segments above which `maybe_compact` rewrites them.
+    """
+
+    def __init__(self, params, path, segment_size=64 * 1024 * 1024, sync_every=256, compact_ratio=0.5):
+        assert isinstance(params, SphinxParams)
+        assert segment_size > 0
+        assert sync_every > 0
+        self.params = params
+        self.path = path
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.compact_ratio = compact_ratio
+
+        alpha, beta, gamma, _ = params.get_dimensions()
+        self._dimensions = (alpha, beta, gamma)
+        self._add_body_size = SECURITY_PARAMETER + alpha + beta + gamma + KTILDE_SIZE
+        self._segment_header = _SEGMENT_HEADER.pack(
+            SEGMENT_MAGIC, SEGMENT_VERSION, params.max_hops, params.payload_size)
+
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._index = None
+        self._locations = None
+        self._next_seq = 0
+        self._pending = 0
+        self._active = None
+        self._active_file = None
+        self._active_reader = None
+        self._closed = False
+        self._maintenance = None
+        self._stopping = threading.Event()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._segments = []
+        for name in sorted(os.listdir(path)):
+            if name.endswith(COMPACTION_SUFFIX):
+                # an interrupted compaction, its source segments are still intact
+                os.unlink(os.path.join(path, name))
+                continue
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            segment = _Segment(int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(path, name))
+            segment.map()
+            if segment.size > 0:
+                self._check_segment_header(segment)
+            self._segments.append(segment)
+
+    def _check_segment_header(self, segment):
+        if segment.size < _SEGMENT_HEADER.size:
+            raise SURBLogFormatError("truncated segment header: %s" % segment.path)
+        magic, version, max_hops, payload_size = _SEGMENT_HEADER.unpack_from(segment.mapping, 0)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise SURBLogFormatError("not a SURB log segment: %s" % segment.path)
+        if (max_hops, payload_size) != (self.params.max_hops, self.params.payload_size):
+            raise SURBLogFormatError("segment %s was written with different SphinxParams" % segment.path)
+
+    def _record_size(self, kind, nym_len):
+        if kind == RECORD_ADD:
+            return _RECORD_HEADER.size + nym_len + self._add_body_size
+        return _RECORD_HEADER.size + nym_len
+
+    def _iter_records(self, segment, verify):
+        """
+        Yield (kind, seq, nym, offset) for every complete record of a
+        sealed segment, stopping at the first torn or corrupt record.
+        """
+        buf = segment.mapping
+        if buf is None:
+            return
+        end = segment.size
+        offset = _SEGMENT_HEADER.size
+        while offset + _RECORD_HEADER.size <= end:
+            crc, kind, seq, nym_len = _RECORD_HEADER.unpack_from(buf, offset)
+            if kind != RECORD_ADD and kind != RECORD_CONSUME:
+                return
+            size = self._record_size(kind, nym_len)
+            if offset + size > end:
+                return
+            if verify and zlib.crc32(buf[offset + 4:offset + size]) & 0xffffffff != crc:
+                return
+            nym_start = offset + _RECORD_HEADER.size
+            yield kind, seq, buf[nym_start:nym_start + nym_len], offset
+            offset += size
+
+    def load_index(self):
+        """
+        Build the in-memory index by scanning the segments; this
+        happens on first use if it has not been called before.
+        """
+        with self._lock:
+            if self._index is not None:
+                return
+            index = {}
+            locations = {}
+            next_seq = 0
+            for segment in self._segments:
+                for kind, seq, nym, offset in self._iter_records(segment, verify=True):
+                    if kind == RECORD_ADD:
+                        if seq in locations:
+                            # left behind by an interrupted compaction
+                            continue
+                        locations[seq] = (segment, offset)
+                        index.setdefault(nym, deque()).append(seq)
+                        segment.added += 1
+                    else:
+                        location = locations.pop(seq, None)
+                        if location is not None:
+                            location[0].consumed += 1
+                            surbs = index[nym]
+                            surbs.remove(seq)
+                            if not surbs:
+                                del index[nym]
+                    if seq >= next_seq:
+                        next_seq = seq + 1
+            self._index = index
+            self._locations = locations
+            self._next_seq = next_seq
+            self._open_active()
+
+    def _open_active(self):
+        segment_id = self._segments[-1].segment_id + 1 if self._segments else 0
+        segment = _Segment(segment_id, os.path.join(self.path, _segment_name(segment_id)))
+        self._active_file = open(segment.path, "ab")
+        self._active_file.write(self._segment_header)
+        self._active_file.flush()
+        self._active_reader = open(segment.path, "rb")
+        segment.size = len(self._segment_header)
+        self._active = segment
+        self._sync_directory()
+
+    def _seal_active(self):
+        self.sync()
+        self._active_file.close()
+        self._active_reader.close()
+        self._active.map()
+        self._segments.append(self._active)
+        self._open_active()
+
+    def _sync_directory(self):
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _append(self, kind, seq, nym, body):
+        record = struct.pack(">BQB", kind, seq, len(nym)) + nym + body
+        offset = self._active.size
+        self._active_file.write(struct.pack(">I", zlib.crc32(record) & 0xffffffff))
+        self._active_file.write(record)
+        self._active.size += 4 + len(record)
+        self._pending += 1
+        if self._pending >= self.sync_every:
+            self.sync()
+        return offset
+
+    def _read_record(self, segment, offset, nym_len):
+        size = self._record_size(RECORD_ADD, nym_len)
+        if segment is self._active:
+            self._active_file.flush()
+            self._active_reader.seek(offset)
+            return self._active_reader.read(size)
+        return segment.mapping[offset:offset + size]
+
+    def _decode_nymtuple(self, record, nym_len):
+        alpha, beta, gamma = self._dimensions
+        i = _RECORD_HEADER.size + nym_len
+        node_id = record[i:i + SECURITY_PARAMETER]
+        i += SECURITY_PARAMETER
+        header = SphinxHeader(record[i:i + alpha],
+                              record[i + alpha:i + alpha + beta],
+                              record[i + alpha + beta:i + alpha + beta + gamma])
+        i += alpha + beta + gamma
+        return node_id, header, record[i:i + KTILDE_SIZE]
+
+    def add(self, nym, nymtuple):
+        node_id, header, ktilde = nymtuple
+        assert isinstance(nym, bytes) and len(nym) < 256
+        assert len(node_id) == SECURITY_PARAMETER
+        assert (len(header.alpha), len(header.beta), len(header.gamma)) == self._dimensions
+        assert len(ktilde) == KTILDE_SIZE
+        body = b"".join((node_id, header.alpha, header.beta, header.gamma, ktilde))
+        with self._lock:
+            self.load_index()
+            seq = self._next_seq
+            self._next_seq += 1
+            offset = self._append(RECORD_ADD, seq, nym, body)
+            self._locations[seq] = (self._active, offset)
+            self._index.setdefault(nym, deque()).append(seq)
+            self._active.added += 1
+            if self._active.size >= self.segment_size:
+                self._seal_active()
+
+    def pop(self, nym):
+        with self._lock:
+            self.load_index()
+            surbs = self._index.get(nym)
+            if not surbs:
+                return None
+            seq = surbs.popleft()
+            if not surbs:
+                del self._index[nym]
+            segment, offset = self._locations.pop(seq)
+            nymtuple = self._decode_nymtuple(self._read_record(segment, offset, len(nym)), len(nym))
+            segment.consumed += 1
+            self._append(RECORD_CONSUME, seq, nym, b"")
+            if self._active.size >= self.segment_size:
+                self._seal_active()
+            return nymtuple
+
+    def count(self, nym):
+        with self._lock:
+            self.load_index()
+            return len(self._index.get(nym, ()))
+
+    def sync(self):
+        """
+        Flush and fsync all records appended so far.
+        """
+        with self._lock:
+            if self._active_file is None or self._pending == 0:
+                return
+            self._active_file.flush()
+            os.fsync(self._active_file.fileno())
+            self._pending = 0
+
+    def garbage_ratio(self):
+        """
+        Returns the fraction of reply blocks in the sealed
+        segments which have already been consumed.
+        """
+        with self._lock:
+            added = sum(s.added for s in self._segments)
+            if added == 0:
+                return 0.0
+            return float(sum(s.consumed for s in self._segments)) / added
+
+    def maybe_compact(self):
+        """
+        Compact the sealed segments if enough of their
+        reply blocks have been consumed.
+        """
+        if self._index is not None and self._segments and self.garbage_ratio() >= self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite all sealed segments into a single segment which holds
+        only the reply blocks that have not been consumed. Consumption
+        may continue while the live records are being copied; those
+        are reconciled under the lock before the new segment replaces
+        the old ones.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                self.load_index()
+                sources = list(self._segments)
+            if not sources:
+                return
+            # the compacted segment takes the place of the oldest source so
+            # that a crash before the other sources are removed leaves
+            # their CONSUME records to be replayed after it
+            target_id = sources[0].segment_id
+            tmp_path = os.path.join(self.path, _segment_name(target_id) + COMPACTION_SUFFIX)
+            moved = []
+            with open(tmp_path, "wb") as f:
+                f.write(self._segment_header)
+                offset = len(self._segment_header)
+                for segment in sources:
+                    for kind, seq, nym, src_offset in self._iter_records(segment, verify=False):
+                        if kind != RECORD_ADD or self._locations.get(seq) != (segment, src_offset):
+                            continue
+                        size = self._record_size(kind, len(nym))
+                        f.write(segment.mapping[src_offset:src_offset + size])
+                        moved.append((seq, offset))
+                        offset += size
+                f.flush()
+                os.fsync(f.fileno())
+            compacted = _Segment(target_id, os.path.join(self.path, _segment_name(target_id)))
+            with self._lock:
+                os.rename(tmp_path, compacted.path)
+                for segment in sources[1:]:
+                    os.unlink(segment.path)
+                self._sync_directory()
+                compacted.map()
+                for seq, offset in moved:
+                    compacted.added += 1
+                    if seq in self._locations:
+                        self._locations[seq] = (compacted, offset)
+                    else:
+                        compacted.consumed += 1
+                self._segments = [compacted] + self._segments[len(sources):]
+            for segment in sources:
+                segment.unmap()
+
+    def start(self, interval=1.0):
+        """
+        Start a background thread which periodically fsyncs
+        pending records and compacts the sealed segments.
+        """
+        assert self._maintenance is None
+
+        def run():
+            while not self._stopping.wait(interval):
+                self.sync()
+                self.maybe_compact()
+        self._maintenance = threading.Thread(target=run, name="surb-log-maintenance")
+        self._maintenance.daemon = True
+        self._maintenance.start()
+
+    def close(self):
+        """
+        Stop the maintenance thread, fsync and release all files.
+        """
+        if self._maintenance is not None:
+            self._stopping.set()
+            self._maintenance.join()
+            self._maintenance = None
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._active_file is not None:
+                self.sync()
+                self._active_file.close()
+                self._active_reader.close()
+            for segment in self._segments:
+                segment.unmap()
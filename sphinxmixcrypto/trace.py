@@ -0,0 +1,216 @@
+# Copyright 2016-2017 David Stainton
+#
+# This file is part of Sphinx.
+#
+# Sphinx is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU Lesser General Public
+# License as published by the Free Software Foundation.
+#
+# Sphinx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Sphinx.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module implements packet traces: a binary file holding the
+SphinxParams followed by fixed size records of a receive timestamp
+and a raw sphinx packet. A TraceRecorder captures the input of a
+node and a TraceReader memory maps a trace to replay it, at the
+original pace or as fast as possible, into sphinx_packet_unwrap
+or the batch APIs.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+from sphinxmixcrypto.client import SphinxParams, SphinxPacket
+from sphinxmixcrypto.errors import TraceFormatError
+
+
+TRACE_MAGIC = b"SPHXTRAC"
+TRACE_VERSION = 1
+
+# magic, version, max_hops, payload_size
+_TRACE_HEADER = struct.Struct(">8sBHI")
+# receive timestamp in seconds
+_RECORD_HEADER = struct.Struct(">d")
+
+
+class TraceRecorder(object):
+    """
+    I append received packets to a trace file.
+
+    :param SphinxParams params: An instance of SphinxParams.
+
+    :param path: The trace file, truncated if it exists.
+
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, params, path, clock=time.time):
+        assert isinstance(params, SphinxParams)
+        self.params = params
+        self.path = path
+        self.clock = clock
+        self.count = 0
+        self._packet_size = sum(params.get_dimensions())
+        self._file = open(path, "wb")
+        self._file.write(_TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, params.max_hops, params.payload_size))
+
+    def record(self, packet, timestamp=None):
+        """
+        Append a SphinxPacket or a raw packet to the trace.
+        """
+        if isinstance(packet, SphinxPacket):
+            packet = packet.get_raw_bytes()
+        assert len(packet) == self._packet_size
+        if timestamp is None:
+            timestamp = self.clock()
+        self._file.write(_RECORD_HEADER.pack(timestamp))
+        self._file.write(packet)
+        self.count += 1
+
+    def wrap(self, handler):
+        """
+        Returns a function which records each packet
+        before passing it on to handler.
+        """
+        def recording_handler(packet, *args, **kwargs):
+            self.record(packet)
+            return handler(packet, *args, **kwargs)
+        return recording_handler
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TraceReader(object):
+    """
+    I memory map a trace file and hand out its packets as
+    memoryviews into the mapping, without copying them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(_TRACE_HEADER.size)
+            if len(header) != _TRACE_HEADER.size:
+                raise TraceFormatError("truncated trace header")
+            magic, version, max_hops, payload_size = _TRACE_HEADER.unpack(header)
+            if magic != TRACE_MAGIC or version != TRACE_VERSION:
+                raise TraceFormatError("not a version %d packet trace" % TRACE_VERSION)
+            self.params = SphinxParams(max_hops, payload_size)
+            self._packet_size = sum(self.params.get_dimensions())
+            self._record_size = _RECORD_HEADER.size + self._packet_size
+            size = os.fstat(f.fileno()).st_size - _TRACE_HEADER.size
+            # a partially written last record is ignored
+            self.count = size // self._record_size
+            self._mapping = None
+            self._view = None
+            if self.count > 0:
+                self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mapping)
+
+    def __len__(self):
+        return self.count
+
+    def _offset(self, index):
+        return _TRACE_HEADER.size + index * self._record_size
+
+    def timestamp(self, index):
+        return _RECORD_HEADER.unpack_from(self._mapping, self._offset(index))[0]
+
+    def raw_packet(self, index):
+        """
+        Returns a memoryview of the raw packet of a record.
+        """
+        offset = self._offset(index) + _RECORD_HEADER.size
+        return self._view[offset:offset + self._packet_size]
+
+    def records(self):
+        """
+        Yield (timestamp, raw packet memoryview) for every record.
+        """
+        for index in range(self.count):
+            yield self.timestamp(index), self.raw_packet(index)
+
+    def packets(self):
+        """
+        Yield a SphinxPacket for every record.
+        """
+        params = self.params
+        for index in range(self.count):
+            yield SphinxPacket.from_raw_bytes(params, self.raw_packet(index).tobytes())
+
+    def batches(self, batch_size):
+        """
+        Yield lists of at most batch_size SphinxPackets.
+        """
+        assert batch_size > 0
+        batch = []
+        for packet in self.packets():
+            batch.append(packet)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def replay(self, handler, speed=None, sleep=time.sleep, clock=time.monotonic):
+        """
+        Call handler with every SphinxPacket of the trace, returns
+        the number of packets replayed. If speed is None packets are
+        replayed as fast as possible, otherwise at speed times their
+        original pace.
+        """
+        if self.count == 0:
+            return 0
+        first = self.timestamp(0)
+        started = clock()
+        for index, packet in enumerate(self.packets()):
+            if speed is not None:
+                delay = (self.timestamp(index) - first) / speed - (clock() - started)
+                if delay > 0:
+                    sleep(delay)
+            handler(packet)
+        return self.count
+
+    def close(self):
+        """
+        Unmap the trace file. Memoryviews returned by raw_packet or
+        records stay valid: while any of them is alive the mapping
+        is left for the garbage collector to unmap once they are gone.
+        """
+        view, mapping = self._view, self._mapping
+        self._view = None
+        self._mapping = None
+        if mapping is None:
+            return
+        view.release()
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
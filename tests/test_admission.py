@@ -0,0 +1,91 @@
+from sphinxmixcrypto import SphinxParams, SphinxPacket, AdmissionControl, AdmissionPolicy
+from sphinxmixcrypto.admission import ADMIT, REJECT_MALFORMED, REJECT_OVERLOADED, REJECT_RATE_LIMITED, REJECT_DUPLICATE
+from sphinxmixcrypto.admission import PacketDedupFilter
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def new_packets(params, count):
+    pki, route, key_states = new_route(3)
+    rand_reader = RandReader()
+    return [SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", rand_reader) for i in range(count)]
+
+
+def test_admission_duplicates():
+    params = SphinxParams(5, 1024)
+    packet, other = new_packets(params, 2)
+    admission = AdmissionControl(params, AdmissionPolicy(peer_rate=None))
+    assert admission.admit(b"peer", packet) == ADMIT
+    assert admission.admit(b"peer", packet) == REJECT_DUPLICATE
+    assert admission.admit_raw(b"other peer", packet.get_raw_bytes()) == REJECT_DUPLICATE
+    assert admission.admit_raw(b"peer", other.get_raw_bytes()) == ADMIT
+    assert admission.admit_raw(b"peer", other.get_raw_bytes()[:-1]) == REJECT_MALFORMED
+    snapshot = admission.snapshot()
+    assert snapshot[ADMIT] == 2
+    assert snapshot[REJECT_DUPLICATE] == 2
+    assert snapshot[REJECT_MALFORMED] == 1
+
+
+def test_admission_duplicates_whole_packet():
+    params = SphinxParams(5, 1024)
+    packet = new_packets(params, 1)[0]
+    raw = bytearray(packet.get_raw_bytes())
+    raw[-1] ^= 1
+    tampered = SphinxPacket.from_raw_bytes(params, bytes(raw))
+    admission = AdmissionControl(params, AdmissionPolicy(peer_rate=None))
+    # a copy with the same alpha must not shadow the genuine packet
+    assert admission.admit(b"attacker", tampered) == ADMIT
+    assert admission.admit(b"peer", packet) == ADMIT
+    assert admission.admit_raw(b"peer", bytes(raw)) == REJECT_DUPLICATE
+
+
+def test_packet_dedup_filter_generations():
+    dedup = PacketDedupFilter(2)
+    assert not dedup.seen(b"a")
+    assert not dedup.seen(b"b")
+    assert not dedup.seen(b"c")
+    assert dedup.seen(b"a")
+    assert not dedup.seen(b"d")
+    assert not dedup.seen(b"a")
+
+
+def test_admission_rate_limit():
+    params = SphinxParams(5, 1024)
+    clock = FakeClock()
+    policy = AdmissionPolicy(peer_rate=10.0, peer_burst=2.0, max_peers=2, dedup_capacity=0)
+    admission = AdmissionControl(params, policy, clock=clock)
+    raw = new_packets(params, 1)[0].get_raw_bytes()
+    assert admission.admit_raw(b"a", raw) == ADMIT
+    assert admission.admit_raw(b"a", raw) == ADMIT
+    assert admission.admit_raw(b"a", raw) == REJECT_RATE_LIMITED
+    assert admission.admit_raw(b"b", raw) == ADMIT
+    clock.now = 0.1
+    assert admission.admit_raw(b"a", raw) == ADMIT
+    assert admission.admit_raw(b"a", raw) == REJECT_RATE_LIMITED
+
+    # a third peer evicts the least recently seen bucket, b's
+    assert admission.admit_raw(b"c", raw) == ADMIT
+    assert admission.admit_raw(b"c", raw) == ADMIT
+    assert admission.admit_raw(b"b", raw) == ADMIT
+    assert admission.admit_raw(b"b", raw) == ADMIT
+
+
+def test_admission_load_shedding():
+    params = SphinxParams(5, 1024)
+    policy = AdmissionPolicy(peer_rate=None, dedup_capacity=0, shed_low_watermark=10, shed_high_watermark=20)
+    admission = AdmissionControl(params, policy, rng=lambda: 0.5)
+    raw = new_packets(params, 1)[0].get_raw_bytes()
+    assert admission.admit_raw(b"a", raw, queue_depth=10) == ADMIT
+    assert admission.admit_raw(b"a", raw, queue_depth=14) == ADMIT
+    assert admission.admit_raw(b"a", raw, queue_depth=16) == REJECT_OVERLOADED
+    assert admission.admit_raw(b"a", raw, queue_depth=20) == REJECT_OVERLOADED
+    assert admission.snapshot()[REJECT_OVERLOADED] == 2
@@ -0,0 +1,85 @@
+import asyncio
+
+import py.test
+
+from sphinxmixcrypto import MessageAggregator, split_exit_hop, AggregateError
+from sphinxmixcrypto import SphinxParams
+from sphinxmixcrypto.aggregate import pack_messages, unpack_messages, encode_varint, decode_varint
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+from tests.test_scheduler import FakeClock
+from tests.test_fragment import deliver
+
+
+def test_varint_and_packing():
+    for n in (0, 1, 127, 128, 300, 1 << 20):
+        encoded = encode_varint(n)
+        assert decode_varint(bytearray(encoded + b"x"), 0) == (n, len(encoded))
+    messages = [b"", b"a", b"b" * 200]
+    assert unpack_messages(pack_messages(messages)) == messages
+    py.test.raises(AggregateError, unpack_messages, b"plain")
+    py.test.raises(AggregateError, unpack_messages, pack_messages([b"abc"])[:-1])
+    py.test.raises(AggregateError, unpack_messages, pack_messages([b"b" * 200])[:2])
+    broken = bytearray(pack_messages([b"abc"]))
+    broken[8] = 5
+    py.test.raises(AggregateError, unpack_messages, bytes(broken))
+
+
+def test_split_exit_hop_plain_messages():
+    for message in (b"", b"plain", b"\xa9hello world", b"\xa9AGG\x00\x00\x00\x09too short",
+                    b"\xa9AGG\x00\x00\x00\x02\x05x"):
+        assert split_exit_hop((b"carol", message)) == [(b"carol", message)]
+    assert split_exit_hop((b"carol", pack_messages([b"a", b"b"]))) == [(b"carol", b"a"), (b"carol", b"b")]
+
+
+def test_aggregator():
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(3)
+    clock = FakeClock()
+    aggregator = MessageAggregator(params, pki, route, RandReader(), max_delay=0.1, clock=clock)
+    sent = []
+    for i in range(40):
+        sent.extend(aggregator.add(b"alice", b"message %02d" % i + b"x" * 30))
+    assert aggregator.add(b"bob", b"hello") == []
+    py.test.raises(AggregateError, aggregator.add, b"bob", b"x" * 1024)
+    assert len(sent) == 1
+    assert aggregator.flush_due() == []
+    clock.now = 0.1
+    sent.extend(aggregator.flush_due())
+    assert len(sent) == 3
+    assert aggregator.next_deadline() is None
+
+    received = []
+    for node_id, packet in sent:
+        assert node_id == route[0]
+        received.extend(split_exit_hop(deliver(params, route, key_states, packet)))
+    assert [x for x in received if x[0] == b"alice"] == [(b"alice", b"message %02d" % i + b"x" * 30) for i in range(40)]
+    assert (b"bob", b"hello") in received
+    stats = aggregator.stats()
+    assert (stats["messages"], stats["packets"], stats["full_flushes"], stats["deadline_flushes"]) == (41, 3, 1, 2)
+    assert split_exit_hop((b"carol", b"plain")) == [(b"carol", b"plain")]
+
+
+def test_aggregator_deadline():
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(2)
+    aggregator = MessageAggregator(params, pki, route, RandReader(), max_delay=0.02)
+    sent = []
+    loop = asyncio.new_event_loop()
+
+    async def main():
+        task = asyncio.ensure_future(aggregator.run(lambda node_id, packet: sent.append(packet)))
+        await asyncio.sleep(0.01)
+        aggregator.add(b"alice", b"one")
+        aggregator.add(b"alice", b"two")
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert len(sent) == 1
+    assert split_exit_hop(deliver(params, route, key_states, sent[0])) == [(b"alice", b"one"), (b"alice", b"two")]
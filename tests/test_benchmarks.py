@@ -0,0 +1,92 @@
+import asyncio
+import json
+import subprocess
+import sys
+
+import py.test
+
+from sphinxmixcrypto import SphinxParams, IncorrectMACError
+
+from benchmarks.cases import all_cases
+from benchmarks.fixtures import NodeKeyState
+from benchmarks.harness import run_benchmark, write_results, load_results, compare, percentile
+from benchmarks.simulator import Simulation, TRANSPORTS, format_report
+from benchmarks.importtime import measure_import
+
+
+def test_percentile():
+    samples = [float(x) for x in range(101)]
+    assert percentile(samples, 0.5) == 50.0
+    assert percentile(samples, 0.99) == 99.0
+    assert percentile([3.0], 0.9) == 3.0
+
+
+def test_benchmark_smoke(tmpdir):
+    results = []
+    for case in all_cases(max_hops_sweep=(2,), payload_sizes=(512,)):
+        result = run_benchmark(case, operations=2, allocation_operations=1, warmup=1)
+        assert result["ops_per_sec"] > 0
+        assert result["latency_p50"] <= result["latency_p99"] <= result["latency_max"]
+        results.append(result)
+    names = set(x["name"] for x in results)
+    for name in ("create_header", "SphinxPacket.forward_message", "create_reply_block",
+                 "sphinx_packet_unwrap", "Nymserver.process", "SphinxClient.decrypt",
+                 "GroupCurve25519.expon", "SphinxLioness.encrypt"):
+        assert name in names
+    result = run_benchmark(next(all_cases((2,), (512,))), operations=2, allocation_operations=0)
+    assert (result["allocations_per_op"], result["peak_bytes_per_op"]) == (0.0, 0.0)
+
+    path = str(tmpdir.join("bench.json"))
+    write_results(path, results)
+    with open(path) as f:
+        assert json.load(f)["results"][0]["key"] == results[0]["key"]
+    assert load_results(path) == json.loads(json.dumps(results))
+
+
+def test_compare():
+    baseline = [{"key": "a", "ops_per_sec": 100.0}, {"key": "b", "ops_per_sec": 100.0}]
+    current = [{"key": "a", "ops_per_sec": 95.0}, {"key": "b", "ops_per_sec": 50.0}, {"key": "c", "ops_per_sec": 1.0}]
+    rows, regressions = compare(current, baseline, threshold=0.10)
+    assert [x[0] for x in rows] == ["a", "b"]
+    assert [x[0] for x in regressions] == ["b"]
+
+
+def test_simulator():
+    for transport in TRANSPORTS:
+        simulation = Simulation(num_nodes=4, hops=3, params=SphinxParams(5, 1024), transport=transport, seed=1)
+        loop = asyncio.new_event_loop()
+        try:
+            report = loop.run_until_complete(simulation.run(forward=5, replies=5))
+        finally:
+            loop.close()
+        assert report["messages"] == 10
+        assert report["latency"]["count"] == 10
+        assert report["hop_latency"]["count"] == 30
+        assert sum(node["packets"] for node in report["per_node"].values()) == 30
+        assert report["messages_per_second"] > 0
+        assert format_report(report)
+
+
+def test_simulator_node_failure():
+    simulation = Simulation(num_nodes=4, hops=3, params=SphinxParams(5, 1024), seed=1)
+    for node_id, key_state in simulation.mixnet.key_states.items():
+        # the wrong private key fails the MAC check of every packet
+        simulation.mixnet.key_states[node_id] = NodeKeyState(key_state.public_key, b"\x01" * 32)
+    loop = asyncio.new_event_loop()
+    try:
+        py.test.raises(IncorrectMACError, loop.run_until_complete,
+                       asyncio.wait_for(simulation.run(forward=5, replies=0), 5.0))
+    finally:
+        loop.close()
+
+
+def test_lazy_import():
+    statement = ("import sys, sphinxmixcrypto; sphinxmixcrypto.SphinxParams(5, 1024); sphinxmixcrypto.prefix_free_decode(b'')\n"
+                 "print(' '.join(sorted(sys.modules)))")
+    output = subprocess.check_output([sys.executable, "-c", statement]).decode("ascii").split()
+    for module in ("sphinxmixcrypto.client", "sphinxmixcrypto.crypto_primitives", "nacl", "pylioness",
+                   "Cryptodome", "zope.interface", "attr", "asyncio"):
+        assert module not in output
+    total, rows = measure_import(runs=1)
+    assert total > 0
+    assert "sphinxmixcrypto.params" in [row[2] for row in rows]
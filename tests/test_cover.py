@@ -0,0 +1,102 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from sphinxmixcrypto import CoverTraffic, CoverPolicy, SphinxParams, PacketReplayCacheDict, sphinx_packet_unwrap
+from sphinxmixcrypto.cover import LOOP, DROP, cover_kind
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+from tests.test_fragment import deliver
+
+
+class Epoch(object):
+    def __init__(self):
+        self.epoch = 1
+
+    def __call__(self):
+        return self.epoch
+
+
+def new_cover(epoch=None, rate=50.0, reservoir_size=4, executor=None):
+    pki, route, key_states = new_route(3)
+    policies = [
+        CoverPolicy("loop", LOOP, lambda: route, b"client", rate, reservoir_size),
+        CoverPolicy("drop", DROP, lambda: route[:2], b"drop", rate, reservoir_size),
+    ]
+    cover = CoverTraffic(SphinxParams(5, 1024), pki, policies, RandReader(), epoch=epoch,
+                         executor=executor, rng=random.Random(1))
+    return cover, route, key_states
+
+
+def test_cover_reservoir():
+    epoch = Epoch()
+    cover, route, key_states = new_cover(epoch)
+    assert cover.refill() == 8
+    assert len(cover) == 8
+    node_id, packet = cover.take("loop")
+    assert node_id == route[0]
+    result = sphinx_packet_unwrap(SphinxParams(5, 1024), PacketReplayCacheDict(), key_states[route[0]], packet)
+    assert result.next_hop[0] == route[1]
+    assert cover.refill("loop") == 1
+
+    params = SphinxParams(5, 1024)
+    dest, payload = deliver(params, route, key_states, cover.take("loop")[1])
+    assert dest == b"client" and cover_kind(payload) == LOOP
+    dest, payload = deliver(params, route[:2], key_states, cover.take("drop")[1])
+    assert cover_kind(payload) == DROP
+    assert cover_kind(b"hello") is None
+
+    epoch.epoch = 2
+    assert cover.take("drop") is None
+    assert cover.expire() == 3
+    stats = cover.stats()
+    assert stats["drop"] == {"built": 4, "released": 1, "expired": 3, "underruns": 1, "build_errors": 0, "reservoir": 0}
+    assert stats["loop"] == {"built": 5, "released": 2, "expired": 3, "underruns": 0, "build_errors": 0, "reservoir": 0}
+
+
+def test_cover_release():
+    sent = []
+    executor = ThreadPoolExecutor(2)
+    cover, route, key_states = new_cover(rate=200.0, reservoir_size=8, executor=executor)
+    loop = asyncio.new_event_loop()
+
+    async def main():
+        cover.start(lambda node_id, packet: sent.append((node_id, packet)), refill_interval=0.01)
+        await asyncio.sleep(0.3)
+        await cover.stop()
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+        executor.shutdown()
+    stats = cover.stats()
+    assert len(sent) > 0
+    assert len(sent) == stats["loop"]["released"] + stats["drop"]["released"]
+    for name in ("loop", "drop"):
+        assert stats[name]["built"] == stats[name]["released"] + stats[name]["reservoir"]
+    assert all(node_id == route[0] for node_id, packet in sent)
+
+
+def test_cover_build_errors():
+    pki, route, key_states = new_route(3)
+    # the first two batches route through a node missing from the PKI
+    routes = [[b"\x00" * 16], [b"\x00" * 16]]
+    policy = CoverPolicy("loop", LOOP, lambda: routes.pop() if routes else route, b"client", 50.0, 2)
+    cover = CoverTraffic(SphinxParams(5, 1024), pki, [policy], RandReader())
+    loop = asyncio.new_event_loop()
+
+    async def main():
+        task = asyncio.ensure_future(cover.run_refill(interval=0.01, batch=1))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+    stats = cover.stats()
+    assert stats["loop"]["build_errors"] == 2
+    assert stats["loop"]["reservoir"] == 2
@@ -0,0 +1,197 @@
+import asyncio
+import os
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, OutboundDispatcher, ThresholdMix
+
+from tests.test_mix import DummyPKI
+
+
+class Listener(object):
+    """
+    I stand in for a mix node, keeping all bytes received.
+    """
+
+    def __init__(self):
+        self.received = bytearray()
+        self.connections = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            self.received += data
+        writer.close()
+
+    async def start_tcp(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def start_unix(self, path):
+        self.server = await asyncio.start_unix_server(self.handle, path)
+        return path
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def new_packets(params, count):
+    size = sum(params.get_dimensions())
+    return [SphinxPacket.from_raw_bytes(params, os.urandom(size)) for i in range(count)]
+
+
+def test_dispatcher(tmpdir):
+    params = SphinxParams(5, 1024)
+    size = sum(params.get_dimensions())
+    hops = [b"\xff" + bytes(bytearray([i])) * 15 for i in range(3)]
+    pki = DummyPKI()
+    listeners = [Listener() for i in range(3)]
+    packets = new_packets(params, 30)
+
+    async def main():
+        pki.set(hops[0], b"", await listeners[0].start_tcp())
+        pki.set(hops[1], b"", await listeners[1].start_unix(str(tmpdir.join("mix.sock"))))
+        pki.set(hops[2], b"", ("127.0.0.1", 1))
+        dispatcher = OutboundDispatcher(pki, connections_per_peer=2, flush_interval=0.01,
+                                        max_batch_bytes=8 * size, max_pending_bytes=32 * size)
+        for i, packet in enumerate(packets[:20]):
+            assert dispatcher.dispatch_next_hop((hops[i % 2], packet))
+        dispatcher.dispatch(hops[2], packets[20].get_raw_bytes())
+        mix = ThresholdMix(params, threshold=9)
+        for packet in packets[21:]:
+            batches = mix.add(hops[0], packet)
+        dispatcher.dispatch_batches(batches, size)
+        await asyncio.sleep(0.05)
+        stats = dispatcher.stats()
+        await dispatcher.close()
+        await asyncio.sleep(0.01)
+        for listener in listeners[:2]:
+            await listener.close()
+        return stats
+
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    first = stats[hops[0].hex()]
+    assert first["sent_packets"] == 19
+    assert first["writes"] < 19
+    assert first["connects"] <= 2
+    assert stats[hops[1].hex()]["sent_packets"] == 10
+    assert stats[hops[2].hex()]["errors"] == 1
+    assert stats[hops[2].hex()]["dropped_packets"] == 1
+    received = bytes(listeners[0].received)
+    chunks = set(received[i:i + size] for i in range(0, len(received), size))
+    assert chunks == set(packet.get_raw_bytes() for packet in packets[0:20:2] + packets[21:])
+    assert bytes(listeners[1].received) == b"".join(packet.get_raw_bytes() for packet in packets[1:20:2])
+
+
+def test_dispatcher_backpressure():
+    params = SphinxParams(5, 1024)
+    size = sum(params.get_dimensions())
+    pki = DummyPKI()
+    pki.set(b"\xff" * 16, b"", ("127.0.0.1", 1))
+
+    async def main():
+        dispatcher = OutboundDispatcher(pki, flush_interval=10.0, max_batch_bytes=2 * size, max_pending_bytes=2 * size)
+        results = [dispatcher.dispatch(b"\xff" * 16, packet) for packet in new_packets(params, 3)]
+        stats = dispatcher.stats()
+        await dispatcher.close(flush=False)
+        return results, stats
+
+    loop = asyncio.new_event_loop()
+    try:
+        results, stats = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert results == [True, True, False]
+    assert stats["ff" * 16]["dropped_packets"] == 1
+    assert stats["ff" * 16]["pending_packets"] == 2
+
+
+def test_dispatcher_unknown_peer():
+    params = SphinxParams(5, 1024)
+    pki = DummyPKI()
+    packets = new_packets(params, 2)
+
+    async def main():
+        dispatcher = OutboundDispatcher(pki, flush_interval=0.001)
+        dispatcher.dispatch(b"\xee" * 16, packets[0])
+        await asyncio.sleep(0.02)
+        dispatcher.dispatch(b"\xee" * 16, packets[1])
+        await dispatcher.close()
+        return dispatcher.stats()
+
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(asyncio.wait_for(main(), 5.0))
+    finally:
+        loop.close()
+    assert stats["ee" * 16]["errors"] == 2
+    assert stats["ee" * 16]["dropped_packets"] == 2
+    assert stats["ee" * 16]["sent_packets"] == 0
+
+
+def test_dispatcher_flush_timeout(tmpdir):
+    path = str(tmpdir.join("stuck.sock"))
+    pki = DummyPKI()
+    pki.set(b"\xdd" * 16, b"", path)
+    stuck = []
+
+    async def handle(reader, writer):
+        # never read, so that the dispatcher's writes block
+        stuck.append(writer)
+
+    async def main():
+        server = await asyncio.start_unix_server(handle, path)
+        dispatcher = OutboundDispatcher(pki, flush_interval=0.001, max_batch_bytes=1024 * 1024)
+        for i in range(8):
+            dispatcher.dispatch(b"\xdd" * 16, b"\x00" * (1024 * 1024))
+        await dispatcher.close(flush_timeout=0.1)
+        for writer in stuck:
+            writer.close()
+        server.close()
+        await server.wait_closed()
+        return dispatcher.stats()
+
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(asyncio.wait_for(main(), 5.0))
+    finally:
+        loop.close()
+    peer = stats["dd" * 16]
+    assert peer["sent_packets"] < 8
+    assert peer["sent_packets"] + peer["dropped_packets"] == 8
+    assert peer["pending_packets"] == 0
+
+
+def test_dispatcher_close_flushes():
+    params = SphinxParams(5, 1024)
+    pki = DummyPKI()
+    listener = Listener()
+    packets = new_packets(params, 3)
+
+    async def main():
+        pki.set(b"\xff" * 16, b"", await listener.start_tcp())
+        # the flush deadline is never reached, close writes the buffer out
+        dispatcher = OutboundDispatcher(pki, flush_interval=60.0)
+        for packet in packets:
+            dispatcher.dispatch(b"\xff" * 16, packet)
+        await dispatcher.close(flush_timeout=5.0)
+        await asyncio.sleep(0.01)
+        await listener.close()
+        return dispatcher.stats()
+
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(asyncio.wait_for(main(), 2.0))
+    finally:
+        loop.close()
+    assert stats["ff" * 16]["sent_packets"] == 3
+    assert stats["ff" * 16]["dropped_packets"] == 0
+    assert bytes(listener.received) == b"".join(packet.get_raw_bytes() for packet in packets)
@@ -0,0 +1,79 @@
+import os
+import struct
+
+import py.test
+
+from sphinxmixcrypto import ReassemblyBuffer, fragment_packets, FragmentError
+from sphinxmixcrypto import SphinxParams, NodeUnwrapper, PacketReplayCacheDict
+from sphinxmixcrypto.fragment import fragment_message, max_message_size, FRAGMENT_HEADER_SIZE, FRAGMENT_MARKER
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+from tests.test_scheduler import FakeClock
+
+
+def deliver(params, route, key_states, packet):
+    for node_id in route:
+        unwrapper = NodeUnwrapper(params, PacketReplayCacheDict(), key_states[node_id])
+        result = unwrapper.unwrap(packet)
+        if result.exit_hop is not None:
+            return result.exit_hop
+        packet = result.next_hop[1]
+
+
+def test_fragment_packets_reassembly():
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(3)
+    message = os.urandom(10000)
+    message_id, packets = fragment_packets(params, route, pki, b"dest", message, RandReader())
+    fragment_size = max_message_size(params, b"dest") - FRAGMENT_HEADER_SIZE
+    assert len(packets) == (len(message) + fragment_size - 1) // fragment_size
+    reassembly = ReassemblyBuffer()
+    results = []
+    for packet in reversed(packets):
+        dest, payload = deliver(params, route, key_states, packet)
+        assert dest == b"dest"
+        results.append(reassembly.add(payload))
+    assert results[:-1] == [None] * (len(packets) - 1)
+    assert results[-1] == message
+    stats = reassembly.stats()
+    assert stats["messages"] == 1
+    assert stats["buffered_bytes"] == 0
+
+
+def test_reassembly_limits():
+    clock = FakeClock()
+    reassembly = ReassemblyBuffer(max_message_size=1000, max_buffered_bytes=1500, timeout=10.0, clock=clock)
+    first = fragment_message(b"a" * 1000, 100, b"\x01" * 8)
+    second = fragment_message(b"b" * 1000, 100, b"\x02" * 8)
+    assert reassembly.add(first[0]) is None
+    assert reassembly.add(first[0]) is None
+    # no room left for a second message
+    assert reassembly.add(second[0]) is None
+    stats = reassembly.stats()
+    assert (stats["duplicates"], stats["dropped_fragments"], stats["buffered_bytes"]) == (1, 1, 1010)
+    clock.now = 10.0
+    assert reassembly.add(second[0]) is None
+    assert reassembly.stats()["expired_messages"] == 1
+    for fragment in second[1:]:
+        result = reassembly.add(fragment)
+    assert result == b"b" * 1000
+
+    py.test.raises(FragmentError, reassembly.add, fragment_message(b"c" * 1001, 100, b"\x03" * 8)[0])
+    py.test.raises(FragmentError, reassembly.add, b"not a fragment at all")
+    py.test.raises(FragmentError, reassembly.add, first[1][:-1])
+    assert fragment_message(b"", 100, b"\x04" * 8)[0][FRAGMENT_HEADER_SIZE:] == b""
+    assert reassembly.add(fragment_message(b"", 100, b"\x04" * 8)[0]) == b""
+
+
+def test_reassembly_forged_header():
+    reassembly = ReassemblyBuffer()
+    header = struct.Struct(">B8sIHH")
+    # 16 MiB in one byte fragments would need 16M of them
+    forged = header.pack(FRAGMENT_MARKER, b"\x05" * 8, 16 * 1024 * 1024, 0, 1) + b"x"
+    py.test.raises(FragmentError, reassembly.add, forged)
+    # a fragment shorter than the fragment size it claims
+    forged = header.pack(FRAGMENT_MARKER, b"\x06" * 8, 60000, 0, 1000) + b"x" * 10
+    py.test.raises(FragmentError, reassembly.add, forged)
+    assert reassembly.stats()["buffered_bytes"] == 0
+    assert len(reassembly) == 0
@@ -0,0 +1,95 @@
+import asyncio
+import io
+import socket
+import threading
+
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, FramingError, AsyncPacketReader
+from sphinxmixcrypto import read_packets, frame_packet
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+
+
+class TrickleReader(object):
+    """
+    I return at most step bytes per readinto, so
+    packets straddle the chunk boundaries.
+    """
+
+    def __init__(self, data, step):
+        self.stream = io.BytesIO(data)
+        self.step = step
+
+    def readinto(self, buf):
+        return self.stream.readinto(buf[:self.step])
+
+
+def new_packets(params, count):
+    pki, route, key_states = new_route(2)
+    rand_reader = RandReader()
+    return [SphinxPacket.forward_message(params, route, pki, b"dest", b"hello %d" % i, rand_reader) for i in range(count)]
+
+
+def test_read_packets_partial_reads():
+    params = SphinxParams(5, 1024)
+    packets = new_packets(params, 7)
+    data = b"".join(packet.get_raw_bytes() for packet in packets)
+    for step in (1000, 1200, len(data)):
+        raw = [bytes(x) for x in read_packets(TrickleReader(data, step), params, chunk_packets=2)]
+        assert raw == [packet.get_raw_bytes() for packet in packets]
+    assert list(read_packets(io.BytesIO(data), params, decode=True)) == packets
+
+    py.test.raises(FramingError, list, read_packets(io.BytesIO(data[:-1]), params))
+
+
+def test_read_packets_length_prefixed_socket():
+    params = SphinxParams(5, 1024)
+    packets = new_packets(params, 5)
+    data = b"".join(frame_packet(packet.get_raw_bytes()) for packet in packets)
+    left, right = socket.socketpair()
+
+    def send():
+        left.sendall(data)
+        left.close()
+    sender = threading.Thread(target=send)
+    sender.start()
+    try:
+        assert list(read_packets(right, params, chunk_packets=3, length_prefixed=True, decode=True)) == packets
+    finally:
+        sender.join()
+        right.close()
+
+    bad = frame_packet(packets[0].get_raw_bytes()[:-1]) + b"\x00"
+    py.test.raises(FramingError, list, read_packets(io.BytesIO(bad), params, length_prefixed=True))
+
+
+def test_async_packet_reader():
+    params = SphinxParams(5, 1024)
+    packets = new_packets(params, 5)
+    data = b"".join(packet.get_raw_bytes() for packet in packets)
+
+    async def from_stream_reader():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data[:1500])
+        reader.feed_data(data[1500:])
+        reader.feed_eof()
+        return [bytes(raw) async for raw in AsyncPacketReader(reader, params, chunk_packets=2)]
+
+    async def from_socket():
+        left, right = socket.socketpair()
+        right.setblocking(False)
+        left.sendall(frame_packet(data[:len(data) // 5]))
+        left.close()
+        try:
+            return [packet async for packet in AsyncPacketReader(right, params, length_prefixed=True, decode=True)]
+        finally:
+            right.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(from_stream_reader()) == [packet.get_raw_bytes() for packet in packets]
+        assert loop.run_until_complete(from_socket()) == packets[:1]
+    finally:
+        loop.close()
@@ -0,0 +1,63 @@
+from sphinxmixcrypto import SphinxParams, SphinxPacket, PacketReplayCacheDict, HistogramSink
+from sphinxmixcrypto import sphinx_packet_unwrap, create_header, SECURITY_PARAMETER
+
+from tests.test_mix import DummyPKI, RandReader, SphinxNodeKeyState
+from tests.test_mix import generate_node_keypair, generate_node_id_name
+
+
+def new_route(num_hops):
+    pki = DummyPKI()
+    rand_reader = RandReader()
+    key_states = {}
+    for i in range(num_hops):
+        public_key, private_key = generate_node_keypair(rand_reader)
+        node_id, name = generate_node_id_name(SECURITY_PARAMETER, rand_reader)
+        pki.set(node_id, public_key, i)
+        key_states[node_id] = SphinxNodeKeyState(private_key)
+    return pki, list(pki.identities()), key_states
+
+
+def test_histogram_sink():
+    sink = HistogramSink(resolution=1e-6)
+    for seconds in (5e-7, 1.5e-6, 3e-6, 3e-6, 1e-3):
+        sink.record("stage", seconds)
+    sink.increment("counter")
+    sink.increment("counter", 4)
+    snapshot = sink.snapshot()
+    stats = snapshot["stages"]["stage"]
+    assert stats["count"] == 5
+    assert stats["min"] == 5e-7
+    assert stats["max"] == 1e-3
+    assert sum(stats["buckets"]) == 5
+    assert stats["buckets"][0] == 1
+    assert stats["p50"] == 4e-6
+    assert stats["p99"] == 1e-3
+    assert snapshot["counters"] == {"counter": 5}
+    sink.reset()
+    assert sink.snapshot() == {"stages": {}, "counters": {}}
+
+
+def test_unwrap_instrumentation():
+    pki, route, key_states = new_route(3)
+    params = SphinxParams(5, 1024)
+    sink = HistogramSink()
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", RandReader())
+    result = sphinx_packet_unwrap(params, PacketReplayCacheDict(), key_states[route[0]], packet, instrument=sink)
+    assert result.next_hop is not None
+    snapshot = sink.snapshot()
+    for stage in ("unwrap.expon", "unwrap.replay_tag", "unwrap.replay_lookup", "unwrap.mac",
+                  "unwrap.lioness", "unwrap.beta_stream", "unwrap.blinding"):
+        assert snapshot["stages"][stage]["count"] == 1
+    assert snapshot["counters"]["unwrap.packets"] == 1
+
+
+def test_create_header_instrumentation():
+    pki, route, key_states = new_route(4)
+    params = SphinxParams(5, 1024)
+    sink = HistogramSink()
+    create_header(params, route, pki, b"\x00", b"\x00" * SECURITY_PARAMETER, RandReader(), instrument=sink)
+    create_header(params, route, pki, b"\x00", b"\x00" * SECURITY_PARAMETER, RandReader(), instrument=sink)
+    snapshot = sink.snapshot()
+    for stage in ("create_header.secrets", "create_header.filler", "create_header.beta_gamma"):
+        assert snapshot["stages"][stage]["count"] == 2
+    assert snapshot["counters"]["create_header.hops"] == 8
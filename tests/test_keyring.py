@@ -0,0 +1,69 @@
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, NodeKeyring, UnwrapMetrics
+from sphinxmixcrypto import ReplayError, IncorrectMACError
+
+from tests.test_mix import DummyPKI, RandReader, SphinxNodeKeyState, generate_node_keypair
+from tests.test_instrumentation import new_route
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keyring_rotation():
+    params = SphinxParams(5, 1024)
+    rand_reader = RandReader()
+    pki, route, key_states = new_route(2)
+    node_id = route[0]
+    old_key = key_states[node_id]
+    new_public_key, new_private_key = generate_node_keypair(rand_reader)
+    new_pki = DummyPKI()
+    new_pki.set(node_id, new_public_key, 0)
+    new_pki.set(route[1], pki.get(route[1]), 1)
+
+    clock = FakeClock()
+    metrics = UnwrapMetrics()
+    keyring = NodeKeyring(params, clock=clock, metrics=metrics)
+    keyring.add_key(old_key)
+    old_packets = [SphinxPacket.forward_message(params, route, pki, b"dest", b"old", rand_reader) for i in range(3)]
+    assert keyring.unwrap(old_packets[0]).next_hop[0] == route[1]
+
+    keyring.rotate(SphinxNodeKeyState(new_private_key), grace_period=60.0)
+    new_packet = SphinxPacket.forward_message(params, route, new_pki, b"dest", b"new", rand_reader)
+    assert keyring.unwrap(new_packet).next_hop[0] == route[1]
+    assert keyring.counters.totals()["key_trials"] == 2
+
+    # an old packet promotes the old key, replays are caught per key
+    assert keyring.unwrap_raw(old_packets[1].get_raw_bytes()).next_hop[0] == route[1]
+    assert keyring.unwrap(old_packets[2]).next_hop[0] == route[1]
+    py.test.raises(ReplayError, keyring.unwrap, old_packets[0])
+    py.test.raises(ReplayError, keyring.unwrap, new_packet)
+    totals = keyring.counters.totals()
+    assert totals["packets"] == 6
+    assert totals["key_trials"] == 2 + 2 + 1 + 1 + 2
+
+    clock.now = 60.0
+    py.test.raises(IncorrectMACError, keyring.unwrap,
+                   SphinxPacket.forward_message(params, route, pki, b"dest", b"late", rand_reader))
+    assert keyring.counters.totals()["expired_keys"] == 1
+    assert keyring.unwrap(SphinxPacket.forward_message(params, route, new_pki, b"dest", b"new", rand_reader)).next_hop
+    assert metrics.counters.totals()["mix"] == 5
+    assert metrics.counters.totals()["replay"] == 2
+    assert metrics.counters.totals()["incorrect_mac"] == 1
+
+
+def test_keyring_expire_flushes_replay_cache():
+    params = SphinxParams(5, 1024)
+    keyring = NodeKeyring(params, clock=FakeClock())
+    keyring.add_key(SphinxNodeKeyState(generate_node_keypair(RandReader())[1]), expires=10.0)
+    entry = keyring._entries[0]
+    entry.replay_cache.set_seen(b"tag")
+    assert keyring.expire(now=5.0) == 0
+    assert keyring.expire(now=10.0) == 1
+    assert entry.replay_cache.cache == {}
+    assert keyring.public_keys() == []
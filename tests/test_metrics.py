@@ -0,0 +1,75 @@
+import threading
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, SphinxHeader, PacketReplayCacheDict, UnwrapMetrics
+from sphinxmixcrypto import sphinx_packet_unwrap, ReplayError, IncorrectMACError, HeaderAlphaGroupMismatchError
+from sphinxmixcrypto.metrics import ShardedCounters, UNWRAP_OUTCOMES
+
+from tests.test_mix import RandReader, SphinxNodeKeyState, generate_node_keypair
+from tests.test_instrumentation import new_route
+
+
+def test_sharded_counters_threads():
+    counters = ShardedCounters(["a", "b"])
+
+    def work():
+        for i in range(1000):
+            counters.increment("a")
+            counters.increment("b", 2)
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counters.totals() == {"a": 4000, "b": 8000}
+
+
+def test_unwrap_metrics_rates():
+    metrics = UnwrapMetrics(horizon=100.0)
+    metrics.tick(now=0.0)
+    for i in range(30):
+        metrics.counters.increment("mix")
+    metrics.tick(now=10.0)
+    for i in range(10):
+        metrics.counters.increment("replay")
+    snapshot = metrics.snapshot(window=10.0, now=20.0)
+    assert snapshot["totals"]["mix"] == 30
+    assert snapshot["totals"]["replay"] == 10
+    assert snapshot["rates"]["mix"] == 0.0
+    assert snapshot["rates"]["replay"] == 1.0
+    assert metrics.snapshot(window=20.0, now=20.0)["rates"]["mix"] == 1.5
+
+    text = metrics.to_prometheus(window=20.0, now=20.0)
+    assert 'sphinx_unwrap_packets_total{outcome="mix"} 30\n' in text
+    assert 'sphinx_unwrap_packets_total{outcome="replay"} 10\n' in text
+    assert 'sphinx_unwrap_packets_rate{outcome="mix"} 1.5\n' in text
+    assert len([x for x in text.splitlines() if not x.startswith("#")]) == 2 * len(UNWRAP_OUTCOMES)
+
+
+def test_unwrap_metrics_outcomes():
+    pki, route, key_states = new_route(2)
+    params = SphinxParams(5, 1024)
+    metrics = UnwrapMetrics()
+    replay_cache = PacketReplayCacheDict()
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", RandReader())
+    result = sphinx_packet_unwrap(params, replay_cache, key_states[route[0]], packet, metrics=metrics)
+    exit_result = sphinx_packet_unwrap(params, PacketReplayCacheDict(), key_states[route[1]], result.next_hop[1], metrics=metrics)
+    assert exit_result.exit_hop == (b"dest", b"hello")
+
+    py.test.raises(ReplayError, sphinx_packet_unwrap, params, replay_cache, key_states[route[0]], packet, metrics=metrics)
+    assert sphinx_packet_unwrap(params, replay_cache, key_states[route[0]], packet,
+                                metrics=metrics, raise_errors=False) is ReplayError
+    public_key, private_key = generate_node_keypair(RandReader())
+    assert sphinx_packet_unwrap(params, replay_cache, SphinxNodeKeyState(private_key), packet,
+                                metrics=metrics, raise_errors=False) is IncorrectMACError
+    bad_alpha = SphinxPacket(SphinxHeader(b"A", packet.header.beta, packet.header.gamma), packet.body)
+    assert sphinx_packet_unwrap(params, replay_cache, key_states[route[0]], bad_alpha,
+                                metrics=metrics, raise_errors=False) is HeaderAlphaGroupMismatchError
+
+    totals = metrics.snapshot()["totals"]
+    assert totals["mix"] == 1
+    assert totals["exit"] == 1
+    assert totals["replay"] == 2
+    assert totals["incorrect_mac"] == 1
+    assert totals["alpha_group_mismatch"] == 1
+    assert totals["client"] == 0
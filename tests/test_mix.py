@@ -11,6 +11,7 @@ from sphinxmixcrypto import IncorrectMACError, HeaderAlphaGroupMismatchError, de
 from sphinxmixcrypto import add_padding, InvalidProcessDestinationError, InvalidMessageTypeError, SphinxBodySizeMismatchError
 from sphinxmixcrypto import SphinxParams, SphinxClient, NymKeyNotFoundError, CorruptMessageError
 from sphinxmixcrypto import IReader, IMixPKI, IKeyState, Nymserver, SphinxNoSURBSAvailableError
+from sphinxmixcrypto import UnwrappedMessage, ClientMessage
 from sphinxmixcrypto import _metadata
 
 
@@ -126,6 +127,34 @@ def test_sphinx_params():
     assert delta == 1024
 
 
+def test_sphinx_packet_buffers():
+    params = SphinxParams(5, 1024)
+    size = sum(params.get_dimensions())
+    raw = RandReader().read(size)
+    packet = SphinxPacket.from_raw_bytes(params, raw)
+    assert b"".join(packet.get_buffers()) == raw
+    buf = bytearray(3 * size)
+    offset = packet.write_into(buf, size)
+    assert offset == 2 * size
+    assert packet.write_into(memoryview(buf), offset) == 3 * size
+    assert bytes(buf) == b"\x00" * size + raw + raw
+
+
+def test_sphinx_packet_types():
+    header = SphinxHeader(b"A" * 32, b"B" * 176, b"G" * 16)
+    packet = SphinxPacket(header=header, body=SphinxBody(b"D" * 1024))
+    assert packet.header.alpha == b"A" * 32
+    assert packet == SphinxPacket(SphinxHeader(b"A" * 32, b"B" * 176, b"G" * 16), SphinxBody(b"D" * 1024))
+    assert not hasattr(packet, "__dict__")
+    assert not hasattr(header, "__dict__")
+    py.test.raises(TypeError, SphinxHeader, u"A", b"B", b"G")
+    py.test.raises(TypeError, SphinxBody, bytearray(b"D"))
+    py.test.raises(TypeError, SphinxPacket, header, b"D" * 1024)
+    py.test.raises(TypeError, UnwrappedMessage, next_hop=[b"id", packet], exit_hop=None, client_hop=None)
+    py.test.raises(TypeError, ClientMessage, b"client", None)
+    assert UnwrappedMessage(next_hop=(b"id", packet), exit_hop=None, client_hop=None).next_hop[1] is packet
+
+
 class TestSphinxCorrectness():
 
     def newTestRoute(self, numHops):
@@ -438,6 +467,10 @@ def test_client_corrupt_message():
     client = SphinxClient(params, b"client id", rand_reader=rand_reader)
     client._keytable[message_id] = [b"A" * 32]
     py.test.raises(CorruptMessageError, client.decrypt, message_id, b"A" * 1024)
+    # every client has its own key table
+    client._keytable[message_id] = [b"A" * 32]
+    other = SphinxClient(params, b"other client id", rand_reader=rand_reader)
+    py.test.raises(NymKeyNotFoundError, other.decrypt, message_id, b"A" * 1024)
 
 
 def test_nymserver_no_such_surb():
@@ -0,0 +1,85 @@
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, SphinxHeader, PacketReplayCacheDict, NodeUnwrapper
+from sphinxmixcrypto import UnwrapMetrics, ReplayError, IncorrectMACError, SphinxBodySizeMismatchError
+from sphinxmixcrypto import InvalidProcessDestinationError
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+
+
+def test_node_unwrapper():
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(3)
+    rand_reader = RandReader()
+    unwrappers = dict((node_id, NodeUnwrapper(params, PacketReplayCacheDict(), key_states[node_id])) for node_id in route)
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", rand_reader)
+
+    result = unwrappers[route[0]].unwrap(packet)
+    node_id, packet = result.next_hop
+    assert node_id == route[1]
+    result = unwrappers[route[1]].unwrap_raw(memoryview(packet.get_raw_bytes()))
+    node_id, packet = result.next_hop
+    assert node_id == route[2]
+    result = unwrappers[route[2]].unwrap_raw(bytearray(packet.get_raw_bytes()))
+    assert result.exit_hop == (b"dest", b"hello")
+    py.test.raises(ReplayError, unwrappers[route[2]].unwrap, packet)
+
+
+def test_node_unwrapper_errors():
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(2)
+    metrics = UnwrapMetrics()
+    unwrapper = NodeUnwrapper(params, PacketReplayCacheDict(), key_states[route[0]], metrics=metrics)
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", RandReader())
+    raw = packet.get_raw_bytes()
+
+    assert unwrapper.unwrap_raw(raw[:-1], raise_errors=False) is SphinxBodySizeMismatchError
+    py.test.raises(SphinxBodySizeMismatchError, unwrapper.unwrap_raw, raw + b"\x00")
+    bad_mac = SphinxPacket(SphinxHeader(packet.header.alpha, packet.header.beta, b"\x00" * 16), packet.body)
+    assert unwrapper.unwrap(bad_mac, raise_errors=False) is IncorrectMACError
+    assert unwrapper.unwrap(packet).next_hop is not None
+    assert unwrapper.unwrap_raw(raw, raise_errors=False) is ReplayError
+    totals = metrics.counters.totals()
+    assert totals["body_size_mismatch"] == 2
+    assert totals["incorrect_mac"] == 1
+    assert totals["replay"] == 1
+    assert totals["mix"] == 1
+
+
+def test_node_unwrapper_split_header_body():
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(2)
+    metrics = UnwrapMetrics()
+    unwrappers = dict((node_id, NodeUnwrapper(params, PacketReplayCacheDict(), key_states[node_id], metrics=metrics))
+                      for node_id in route)
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", RandReader())
+    expected = NodeUnwrapper(params, PacketReplayCacheDict(), key_states[route[0]]).unwrap(packet)
+
+    header = unwrappers[route[0]].unwrap_header(packet)
+    assert header.message_type == "mix"
+    assert header.next_node_id == route[1]
+    assert header.next_header == expected.next_hop[1].header
+    assert metrics.counters.totals()["mix"] == 0
+    result = header.finish()
+    assert result == expected
+    assert metrics.counters.totals()["mix"] == 1
+    assert header.finish() is result
+    assert metrics.counters.totals()["mix"] == 1
+    assert unwrappers[route[0]].unwrap_header(packet, raise_errors=False) is ReplayError
+    py.test.raises(ReplayError, unwrappers[route[0]].unwrap_header_raw, packet.get_raw_bytes())
+
+    header = unwrappers[route[1]].unwrap_header_raw(bytearray(result.next_hop[1].get_raw_bytes()))
+    assert header.message_type == "process"
+    assert header.next_node_id is None
+    assert header.finish().exit_hop == (b"dest", b"hello")
+    assert unwrappers[route[1]].unwrap_header_raw(b"", raise_errors=False) is SphinxBodySizeMismatchError
+
+    # the body is not covered by the header MAC, a corrupt one fails in finish
+    packet = SphinxPacket.forward_message(params, route[1:], pki, b"dest", b"hello", RandReader())
+    raw = bytearray(packet.get_raw_bytes())
+    raw[-1] ^= 1
+    header = unwrappers[route[1]].unwrap_header_raw(raw)
+    assert header.finish(raise_errors=False) is InvalidProcessDestinationError
+    py.test.raises(InvalidProcessDestinationError, header.finish)
+    assert metrics.counters.totals()["invalid_process_destination"] == 1
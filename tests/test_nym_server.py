@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxHeader, Nymserver, SphinxNoSURBSAvailableError, NymMessageSizeError
+
+
+def make_nymtuple(i):
+    node_id = b"\xff" + (b"%015d" % i)
+    header = SphinxHeader(b"A" * 32, b"B" * 176, b"G" * 16)
+    return node_id, header, b"K" * 31 + b"%c" % i
+
+
+def test_nymserver_process_many():
+    params = SphinxParams(5, 1024)
+    nymserver = Nymserver(params)
+    reference = Nymserver(params)
+    for i in range(4):
+        nymserver.add_surb(b"nym%d" % i, make_nymtuple(i))
+        reference.add_surb(b"nym%d" % i, make_nymtuple(i))
+    batch = [(b"nym0", b"hello"), (b"nym1", b"hello"), (b"nobody", b"hello"), (b"nym2", b"other"), (b"nym0", b"again")]
+    results = nymserver.process_many(batch)
+    assert len(results) == 5
+    assert isinstance(results[2].error, SphinxNoSURBSAvailableError)
+    assert results[2].message_result is None
+    assert isinstance(results[4].error, SphinxNoSURBSAvailableError)
+    for i in (0, 1, 3):
+        nym, message = batch[i]
+        assert results[i].error is None
+        assert results[i].message_result == reference.process(nym, message).message_result
+
+
+def test_nymserver_process_many_executor():
+    params = SphinxParams(5, 1024)
+    nymserver = Nymserver(params)
+    reference = Nymserver(params)
+    for i in range(16):
+        nymserver.add_surb(b"list", make_nymtuple(i))
+        reference.add_surb(b"list", make_nymtuple(i))
+    with ThreadPoolExecutor(4) as executor:
+        results = nymserver.process_many([(b"list", b"mailing list post")] * 17, executor=executor)
+    assert isinstance(results[16].error, SphinxNoSURBSAvailableError)
+    for result in results[:16]:
+        assert result.message_result == reference.process(b"list", b"mailing list post").message_result
+
+
+def test_nymserver_process_empty_message():
+    params = SphinxParams(5, 1024)
+    nymserver = Nymserver(params)
+    nymserver.add_surb(b"nym", make_nymtuple(0))
+    result = nymserver.process(b"nym", b"")
+    assert result.error is None
+    assert result.message_result is not None
+
+
+def test_nymserver_oversized_message_keeps_surb():
+    params = SphinxParams(5, 1024)
+    nymserver = Nymserver(params)
+    nymserver.add_surb(b"nym", make_nymtuple(0))
+    nymserver.add_surb(b"nym", make_nymtuple(1))
+    largest = b"A" * nymserver.max_message_size()
+    with py.test.raises(NymMessageSizeError):
+        nymserver.process(b"nym", largest + b"A")
+    assert nymserver.surb_store.count(b"nym") == 2
+    batch = [(b"nym", b"hello"), (b"nym", largest + b"A"), (b"nym", largest)]
+    results = nymserver.process_many(batch)
+    assert results[0].error is None
+    assert isinstance(results[1].error, NymMessageSizeError)
+    assert results[1].message_result is None
+    assert results[2].error is None
+    assert nymserver.surb_store.count(b"nym") == 0
@@ -0,0 +1,119 @@
+import asyncio
+
+import py.test
+
+from sphinxmixcrypto import SphinxParams, Nymserver
+from sphinxmixcrypto.nym_service import NymService, NymServiceClient, STATUS_OK, STATUS_NO_SURBS
+from sphinxmixcrypto.nym_service import STATUS_BAD_REQUEST, CMD_DEPOSIT, encode_frame, encode_deposit, encode_submit, read_frame
+
+from tests.test_nym_server import make_nymtuple
+
+
+def run_service_test(params, connect):
+    nymserver = Nymserver(params)
+    reference = Nymserver(params)
+    service = NymService(nymserver, workers=2, max_pending=4)
+
+    async def scenario():
+        address = await connect.listen(service)
+        client = await connect.client(address)
+        for i in range(3):
+            assert await client.deposit(b"alice", make_nymtuple(i)) == STATUS_OK
+            reference.add_surb(b"alice", make_nymtuple(i))
+        for i in range(3):
+            assert await client.submit(b"alice", b"message %d" % i) == STATUS_OK
+            unwrapped = await service.outgoing.get()
+            assert unwrapped == reference.process(b"alice", b"message %d" % i).message_result
+        assert await client.submit(b"alice", b"one too many") == STATUS_NO_SURBS
+        assert await client.submit(b"bob", b"nobody home") == STATUS_NO_SURBS
+        client.close()
+        await service.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+
+class TCPConnect(object):
+
+    async def listen(self, service):
+        server = await service.start_tcp("127.0.0.1", 0)
+        return server.sockets[0].getsockname()[:2]
+
+    async def client(self, address):
+        return await NymServiceClient.connect_tcp(*address)
+
+
+class UnixConnect(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    async def listen(self, service):
+        await service.start_unix(self.path)
+        return self.path
+
+    async def client(self, address):
+        return await NymServiceClient.connect_unix(address)
+
+
+def test_nym_service_tcp():
+    run_service_test(SphinxParams(5, 1024), TCPConnect())
+
+
+def test_nym_service_unix(tmpdir):
+    run_service_test(SphinxParams(5, 1024), UnixConnect(str(tmpdir.join("nym.sock"))))
+
+
+def test_nym_service_bad_request():
+    params = SphinxParams(5, 1024)
+    service = NymService(Nymserver(params))
+
+    async def scenario():
+        server = await service.start_tcp("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(encode_frame(CMD_DEPOSIT, b"\x05alice" + b"truncated"))
+        writer.write(encode_frame(99, b"\x05alice"))
+        status, _ = await read_frame(reader, 1)
+        assert status == STATUS_BAD_REQUEST
+        status, _ = await read_frame(reader, 1)
+        assert status == STATUS_BAD_REQUEST
+        # an oversized message is refused without using up the SURB
+        largest = b"A" * service.nymserver.max_message_size()
+        writer.write(encode_deposit(b"alice", make_nymtuple(0)))
+        writer.write(encode_submit(b"alice", largest + b"A"))
+        writer.write(encode_submit(b"alice", largest))
+        for want in (STATUS_OK, STATUS_BAD_REQUEST, STATUS_OK):
+            status, _ = await read_frame(reader, 1)
+            assert status == want
+        writer.close()
+        await service.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+
+def test_nym_service_client_connection_closed():
+
+    async def handle(reader, writer):
+        writer.close()
+
+    async def scenario():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        client = await NymServiceClient.connect_tcp(*server.sockets[0].getsockname()[:2])
+        with py.test.raises(ConnectionError):
+            await client.submit(b"alice", b"hello")
+        client.close()
+        server.close()
+        await server.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
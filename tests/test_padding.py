@@ -1,7 +1,7 @@
 
 import binascii
 
-from sphinxmixcrypto.padding import add_padding, remove_padding
+from sphinxmixcrypto.padding import add_padding, remove_padding, pad_into
 
 
 def test_add_padding():
@@ -11,3 +11,15 @@ def test_add_padding():
     assert padded == want
     unpadded = remove_padding(padded)
     assert unpadded == message
+
+
+def test_pad_into():
+    message = b"the quick brown fox"
+    buf = bytearray(b"X" * 116)
+    pad_into(buf, message, 16)
+    assert buf[:16] == b"X" * 16
+    assert bytes(buf[16:]) == add_padding(message, 100)
+    pad_into(buf, b"short", 16)
+    assert bytes(buf[16:]) == add_padding(b"short", 100)
+    pad_into(buf, b"", 16)
+    assert bytes(buf) == add_padding(b"X" * 16, 116)
@@ -0,0 +1,119 @@
+import random
+from collections import Counter
+
+import py.test
+
+from sphinxmixcrypto import IndexedMixPKI, SphinxParams, SphinxPacket, sphinx_packet_unwrap
+from sphinxmixcrypto import PacketReplayCacheDict, SECURITY_PARAMETER
+from sphinxmixcrypto.errors import KeyMismatchError
+from sphinxmixcrypto.pki import FenwickTree, random_below
+
+from tests.test_mix import RandReader, SphinxNodeKeyState, generate_node_keypair
+
+
+def node_id(i):
+    return b"\xff" + i.to_bytes(SECURITY_PARAMETER - 1, "big")
+
+
+def new_pki(count, **kwargs):
+    pki = IndexedMixPKI(RandReader(), **kwargs)
+    for i in range(count):
+        pki.set(node_id(i), b"key %d" % i, ("127.0.0.1", 1000 + i))
+    return pki
+
+
+def test_fenwick_tree():
+    rng = random.Random(4)
+    weights = [rng.choice([0.0, 1.0, 2.5, 7.0]) for i in range(37)]
+    tree = FenwickTree(weights)
+    for i in range(20):
+        index = rng.randrange(len(weights))
+        weights[index] = rng.choice([0.0, 3.0, 0.5])
+        tree.update(index, weights[index])
+    tree.append(4.0)
+    weights.append(4.0)
+    tree.pop()
+    weights.pop()
+    assert tree.total() == sum(weights)
+    cumulative = 0.0
+    for index, weight in enumerate(weights):
+        if weight > 0:
+            assert tree.find(cumulative) == index
+            assert tree.find(cumulative + weight * 0.99) == index
+        cumulative += weight
+
+
+def test_indexed_pki_lookups():
+    pki = new_pki(10, verifier=lambda old, new, signature: signature == old + new)
+    assert len(pki) == 10
+    assert pki.get(node_id(3)) == b"key 3"
+    assert pki.get_many([node_id(1), node_id(9)]) == [b"key 1", b"key 9"]
+    assert pki.get_mix_addr("tcp", node_id(2)) == ("127.0.0.1", 1002)
+    pki.set(node_id(10), b"key 10", {"tcp": ("127.0.0.1", 1), "unix": "/tmp/mix"})
+    assert pki.get_mix_addr("unix", node_id(10)) == "/tmp/mix"
+
+    pki.remove(node_id(3))
+    assert len(pki) == 10
+    assert node_id(3) not in pki.identities()
+    assert pki.get(node_id(10)) == b"key 10"
+    py.test.raises(KeyError, pki.get, node_id(3))
+
+    pki.rotate(node_id(1), b"new key", b"key 1new key")
+    assert pki.get(node_id(1)) == b"new key"
+    py.test.raises(KeyMismatchError, pki.rotate, node_id(2), b"new key", b"bad signature")
+    py.test.raises(KeyMismatchError, new_pki(1).rotate, node_id(0), b"new key", b"")
+
+
+def test_indexed_pki_sampling():
+    pki = new_pki(20)
+    counts = Counter()
+    for i in range(2000):
+        route = pki.sample(5)
+        assert len(set(route)) == 5
+        counts.update(route)
+    assert set(counts) == set(pki.identities())
+    assert min(counts.values()) > 300
+    assert sorted(pki.sample(20)) == sorted(pki.identities())
+    assert random_below(RandReader(), 1) == 0
+
+
+def test_indexed_pki_weighted_sampling():
+    pki = new_pki(6)
+    for i in range(6):
+        pki.set_weight(node_id(i), float(i))
+    counts = Counter()
+    for i in range(3000):
+        route = pki.sample_weighted(2)
+        assert len(set(route)) == 2
+        counts.update(route)
+    assert node_id(0) not in counts
+    assert counts[node_id(5)] > counts[node_id(2)] > counts[node_id(1)]
+    assert sorted(pki.sample_weighted(5)) == sorted(node_id(i) for i in range(1, 6))
+    py.test.raises(AssertionError, pki.sample_weighted, 6)
+    assert pki._weights.total() == 15.0
+
+
+def test_indexed_pki_layered_route():
+    pki = IndexedMixPKI(RandReader())
+    for i in range(9):
+        pki.set(node_id(i), b"key", None, weight=1.0 if i != 4 else 0.0, layer=i % 3)
+    for weighted in (False, True):
+        for i in range(100):
+            route = pki.layered_route([0, 1, 2, 1], weighted=weighted)
+            assert [int(x[-1]) % 3 for x in route] == [0, 1, 2, 1]
+            assert node_id(4) not in route
+
+
+def test_indexed_pki_create_packet():
+    rand_reader = RandReader()
+    pki = IndexedMixPKI(rand_reader)
+    key_states = {}
+    for i in range(5):
+        public_key, private_key = generate_node_keypair(rand_reader)
+        pki.set(node_id(i), public_key, i)
+        key_states[node_id(i)] = SphinxNodeKeyState(private_key)
+    params = SphinxParams(5, 1024)
+    route = pki.sample(3)
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", rand_reader)
+    result = sphinx_packet_unwrap(params, PacketReplayCacheDict(), key_states[route[0]], packet)
+    assert result.next_hop[0] == route[1]
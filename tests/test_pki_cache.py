@@ -0,0 +1,149 @@
+import asyncio
+import binascii
+
+import py.test
+
+from sphinxmixcrypto import CachingMixPKI, SphinxParams, SphinxPacket, IMixPKI
+
+from tests.test_mix import DummyPKI, RandReader
+from tests.test_instrumentation import new_route
+from tests.test_scheduler import FakeClock
+
+
+class CountingPKI(DummyPKI):
+    def __init__(self, pki):
+        DummyPKI.__init__(self)
+        self.node_map = dict((node_id, pki.get(node_id)) for node_id in pki.identities())
+        self.addr_map = dict((node_id, ("127.0.0.1", 1000 + i)) for i, node_id in enumerate(self.node_map))
+        self.calls = 0
+
+    def get(self, node_id):
+        self.calls += 1
+        return DummyPKI.get(self, node_id)
+
+    def get_mix_addr(self, transport_name, node_id):
+        self.calls += 1
+        return DummyPKI.get_mix_addr(self, transport_name, node_id)
+
+
+class FakeDirectoryServer(object):
+    """
+    A local directory server sending one line per node:
+    hex node id, hex public key, host and port.
+    """
+
+    def __init__(self, pki):
+        self.pki = pki
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        self.requests += 1
+        for node_id in self.pki.identities():
+            host, port = self.pki.addr_map[node_id]
+            writer.write(b"%s %s %s %d\n" % (binascii.hexlify(node_id), binascii.hexlify(self.pki.node_map[node_id]),
+                                             host.encode("ascii"), port))
+        await writer.drain()
+        writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.address = self.server.sockets[0].getsockname()[:2]
+
+    async def fetch(self):
+        reader, writer = await asyncio.open_connection(*self.address)
+        directory = []
+        async for line in reader:
+            node_id, pub_key, host, port = line.split()
+            directory.append((binascii.unhexlify(node_id), binascii.unhexlify(pub_key), (host.decode("ascii"), int(port))))
+        writer.close()
+        return directory
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def test_caching_pki_ttl_and_negative_cache():
+    pki, route, key_states = new_route(3)
+    backend = CountingPKI(pki)
+    clock = FakeClock()
+    cache = CachingMixPKI(backend, ttl=10.0, negative_ttl=5.0, clock=clock)
+    assert IMixPKI.providedBy(cache)
+    for i in range(3):
+        assert cache.get(route[0]) == pki.get(route[0])
+        assert cache.get_mix_addr("tcp", route[0]) == backend.addr_map[route[0]]
+    assert backend.calls == 2
+    for i in range(3):
+        py.test.raises(KeyError, cache.get, b"\x00" * 16)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["negative_hits"]) == (4, 3, 2)
+    clock.now = 11.0
+    cache.get(route[0])
+    py.test.raises(KeyError, cache.get, b"\x00" * 16)
+    assert backend.calls == 5
+    assert cache.stats()["misses"] == 5
+
+
+def test_caching_pki_background_refresh():
+    pki, route, key_states = new_route(5)
+    backend = CountingPKI(pki)
+    server = FakeDirectoryServer(backend)
+    params = SphinxParams(5, 1024)
+    loop = asyncio.new_event_loop()
+
+    async def main():
+        await server.start()
+        cache = CachingMixPKI(backend, fetcher=server.fetch, ttl=60.0)
+        cache.start(0.02)
+        await asyncio.sleep(0.05)
+        for i in range(10):
+            SphinxPacket.forward_message(params, route, cache, b"dest", b"hello", RandReader())
+        assert sorted(cache.identities()) == sorted(backend.identities())
+        assert cache.get_mix_addr("tcp", route[1]) == backend.addr_map[route[1]]
+        await cache.stop()
+        await server.stop()
+        return cache.stats()
+
+    try:
+        stats = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert backend.calls == 0
+    assert server.requests >= 2
+    assert stats["refreshes"] == server.requests
+    assert stats["misses"] == 0
+    assert stats["hit_rate"] == 1.0
+    assert stats["cached_keys"] == 5
+
+
+def test_caching_pki_refresh_error():
+    pki, route, key_states = new_route(2)
+
+    directories = [ConnectionRefusedError(), [(route[0], b"malformed")]]
+
+    async def fetch():
+        result = directories.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    cache = CachingMixPKI(CountingPKI(pki), fetcher=fetch)
+    loop = asyncio.new_event_loop()
+    try:
+        assert not loop.run_until_complete(cache.refresh())
+        assert not loop.run_until_complete(cache.refresh())
+    finally:
+        loop.close()
+    assert cache.stats()["refresh_errors"] == 2
+    assert cache.stats()["refreshes"] == 0
+    assert cache.get(route[0]) == pki.get(route[0])
+
+
+def test_caching_pki_set_drops_addresses():
+    pki, route, key_states = new_route(2)
+    backend = CountingPKI(pki)
+    cache = CachingMixPKI(backend)
+    assert cache.get_mix_addr("tcp", route[0]) == backend.addr_map[route[0]]
+    del backend.node_map[route[0]]
+    cache.set(route[0], pki.get(route[0]), ("127.0.0.1", 2000))
+    assert cache.get_mix_addr("tcp", route[0]) == ("127.0.0.1", 2000)
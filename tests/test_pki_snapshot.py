@@ -0,0 +1,69 @@
+import os
+
+import py.test
+
+from sphinxmixcrypto import SnapshotMixPKI, write_snapshot, PKISnapshotFormatError, ReadOnlyPKIError, IMixPKI
+from sphinxmixcrypto import SphinxParams, SphinxPacket, PacketReplayCacheDict, sphinx_packet_unwrap
+
+from tests.test_mix import RandReader, SphinxNodeKeyState, generate_node_keypair
+
+
+def new_nodes(count, epoch=1):
+    rand_reader = RandReader()
+    nodes = []
+    private_keys = {}
+    for i in range(count):
+        node_id = b"\xff" + os.urandom(15)
+        public_key, private_key = generate_node_keypair(rand_reader)
+        addr = ("127.0.0.1", 2000 + i) if i % 2 else "/run/mix/%d.sock" % i
+        nodes.append((node_id, public_key, addr, epoch))
+        private_keys[node_id] = private_key
+    return nodes, private_keys
+
+
+def test_snapshot_pki(tmpdir):
+    path = str(tmpdir.join("pki.snapshot"))
+    nodes, private_keys = new_nodes(50)
+    write_snapshot(path, nodes, epoch=7)
+    pki = SnapshotMixPKI(path)
+    assert IMixPKI.providedBy(pki)
+    assert pki.epoch == 7
+    assert len(pki) == 50
+    assert pki.identities() == sorted(node[0] for node in nodes)
+    for node_id, public_key, addr, epoch in nodes:
+        assert pki.get(node_id) == public_key
+        assert pki.get_mix_addr("tcp", node_id) == addr
+        assert pki.get_node_epoch(node_id) == 1
+    py.test.raises(KeyError, pki.get, b"\x00" * 16)
+    py.test.raises(KeyError, pki.get, b"\xff" * 16)
+    py.test.raises(ReadOnlyPKIError, pki.set, b"\x00" * 16, b"", None)
+    py.test.raises(ReadOnlyPKIError, pki.rotate, pki.identities()[0], b"\x00" * 32, b"")
+
+    params = SphinxParams(5, 1024)
+    route = pki.identities()[:3]
+    packet = SphinxPacket.forward_message(params, route, pki, b"dest", b"hello", RandReader())
+    result = sphinx_packet_unwrap(params, PacketReplayCacheDict(), SphinxNodeKeyState(private_keys[route[0]]), packet)
+    assert result.next_hop[0] == route[1]
+
+    # a new consensus replaces the file, the old mapping stays usable
+    new_nodes_list, _ = new_nodes(3, epoch=2)
+    write_snapshot(path, new_nodes_list, epoch=8)
+    assert pki.get(nodes[0][0]) == nodes[0][1]
+    pki.remap()
+    assert pki.epoch == 8
+    assert len(pki) == 3
+    py.test.raises(KeyError, pki.get, nodes[0][0])
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_snapshot_format_errors(tmpdir):
+    path = tmpdir.join("pki.snapshot")
+    write_snapshot(str(path), [], epoch=1)
+    assert SnapshotMixPKI(str(path)).identities() == []
+    path.write(b"garbage" * 10)
+    py.test.raises(PKISnapshotFormatError, SnapshotMixPKI, str(path))
+    nodes, _ = new_nodes(2)
+    write_snapshot(str(path), nodes, epoch=1)
+    with open(str(path), "ab") as f:
+        f.write(b"\x00")
+    py.test.raises(PKISnapshotFormatError, SnapshotMixPKI, str(path))
@@ -0,0 +1,77 @@
+import os
+import random
+
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, ThresholdMix, TimedPoolMix
+from sphinxmixcrypto.pool_mix import PacketArena
+
+
+def new_packet(params):
+    return SphinxPacket.from_raw_bytes(params, os.urandom(sum(params.get_dimensions())))
+
+
+def split(params, batch):
+    size = sum(params.get_dimensions())
+    assert len(batch) % size == 0
+    return [bytes(batch[i:i + size]) for i in range(0, len(batch), size)]
+
+
+def test_threshold_mix():
+    params = SphinxParams(5, 1024)
+    hops = [b"\xff" + bytes(bytearray([i])) * 15 for i in range(3)]
+    mix = ThresholdMix(params, threshold=10, rng=random.Random(1))
+    sent = {}
+    for i in range(9):
+        packet = new_packet(params)
+        sent.setdefault(hops[i % 3], set()).add(packet.get_raw_bytes())
+        assert mix.add_next_hop((hops[i % 3], packet)) is None
+    raw = new_packet(params).get_raw_bytes()
+    sent[hops[0]].add(raw)
+    batches = mix.add(hops[0], memoryview(raw))
+    assert len(mix) == 0
+    assert set(batches) == set(hops)
+    for node_id, batch in batches.items():
+        assert set(split(params, batch)) == sent[node_id]
+
+    # the arena slots are reused
+    for i in range(10):
+        batches = mix.add(hops[1], new_packet(params))
+    assert list(batches) == [hops[1]] and len(split(params, batches[hops[1]])) == 10
+
+
+def test_timed_pool_mix():
+    params = SphinxParams(5, 1024)
+    node_id = b"\xff" * 16
+    mix = TimedPoolMix(params, capacity=20, pool_min=4, fraction=0.5, rng=random.Random(2))
+    packets = set()
+    for i in range(22):
+        packet = new_packet(params)
+        if mix.add(node_id, packet):
+            packets.add(packet.get_raw_bytes())
+    assert mix.dropped == 2
+    assert len(mix) == 20
+
+    out = split(params, mix.flush()[node_id])
+    assert len(out) == 8
+    assert len(mix) == 12
+    out += split(params, mix.flush()[node_id])
+    assert len(mix) == 8
+    assert mix.flush()[node_id]
+    assert len(mix) == 6
+    assert mix.flush()[node_id] and len(mix) == 5
+    assert mix.flush() == {} and len(mix) == 5
+    assert set(out) <= packets
+
+
+def test_packet_arena_keeps_slots_on_errors():
+    params = SphinxParams(5, 1024)
+    arena = PacketArena(params, 2)
+    raw = new_packet(params).get_raw_bytes()
+    py.test.raises(AssertionError, arena.add, b"node", raw[:-1])
+    # the right length but not a buffer, the copy fails
+    py.test.raises(TypeError, arena.add, b"node", list(raw))
+    assert len(arena.free) == 2 and len(arena) == 0
+    assert arena.add(b"node", raw) and arena.add(b"node", new_packet(params))
+    assert not arena.add(b"node", raw)
+    assert len(arena.buffer) == 2 * len(raw)
@@ -0,0 +1,108 @@
+import asyncio
+import math
+import random
+
+from sphinxmixcrypto import TimingWheel, DelayScheduler, HistogramSink
+from sphinxmixcrypto.scheduler import poisson_delay, wait_event
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timing_wheel_releases_on_time():
+    rng = random.Random(1)
+    clock = FakeClock()
+    # a span of 4 ** 3 = 64 ticks, so some entries overflow it
+    wheel = TimingWheel(tick=1.0, slots=4, levels=3, clock=clock)
+    due = {}
+    for i in range(500):
+        delay = rng.choice([0, 0.5, 3, 17, 63, 64, 65, 200, rng.uniform(0, 300)])
+        wheel.insert(delay, i)
+        due[i] = math.ceil(delay)
+    assert len(wheel) == 500
+    released = {}
+    while clock.now < 310:
+        clock.now += rng.choice([0.3, 1, 1, 2, 7])
+        for due_time, item in wheel.expire():
+            assert due_time == due[item]
+            released[item] = clock.now
+    assert len(wheel) == 0
+    assert sorted(released) == sorted(due)
+    for item, release_time in released.items():
+        # released at the first expire at or after its tick
+        assert due[item] <= math.floor(release_time)
+        assert math.floor(release_time) - due[item] < 7
+
+
+def test_timing_wheel_next_due_and_idle_jump():
+    clock = FakeClock()
+    wheel = TimingWheel(tick=0.01, slots=8, levels=2, clock=clock)
+    assert wheel.next_due() is None
+    clock.now = 1000.0
+    assert wheel.expire() == []
+    wheel.insert(0.05, b"a")
+    assert abs(wheel.next_due() - 1000.05) < 1e-9
+    assert wheel.expire(now=1000.04) == []
+    assert [item for t, item in wheel.expire(now=1000.05)] == [b"a"]
+
+
+def test_poisson_delay():
+    rng = random.Random(3)
+    delays = [poisson_delay(0.5, rng) for i in range(20000)]
+    assert min(delays) >= 0
+    assert abs(sum(delays) / len(delays) - 0.5) < 0.02
+
+
+def test_delay_scheduler_asyncio():
+    sink = HistogramSink()
+    released = []
+    loop = asyncio.new_event_loop()
+
+    async def main():
+        scheduler = DelayScheduler(TimingWheel(tick=0.001, slots=16, levels=3), released.append, instrument=sink)
+        scheduler.start()
+        for i, delay in enumerate((0.03, 0.01, 0.02, 0.0)):
+            scheduler.schedule(delay, i)
+        await asyncio.sleep(0.1)
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return stats
+
+    try:
+        stats = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert released == [3, 1, 2, 0]
+    assert stats["depth"] == 0
+    assert stats["released"] == stats["inserted"] == 4
+    assert sink.snapshot()["stages"]["scheduler.lateness"]["count"] == 4
+
+
+def test_wait_event_cancellation():
+    async def main():
+        event = asyncio.Event()
+        await wait_event(event, 0.001)
+        event.set()
+        await wait_event(event, 10.0)
+        # cancelled just as the event it waits for is set
+        event.clear()
+        task = asyncio.ensure_future(wait_event(event, 10.0))
+        await asyncio.sleep(0)
+        event.set()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(main())
+    finally:
+        loop.close()
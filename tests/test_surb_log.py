@@ -0,0 +1,107 @@
+import os
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxHeader, SURBLogStore, SURBLogFormatError
+from sphinxmixcrypto import Nymserver, SphinxNoSURBSAvailableError
+
+
+def make_nymtuple(i):
+    node_id = b"\xff" + (b"%015d" % i)
+    header = SphinxHeader(b"A" * 31 + b"%c" % (i % 256), b"B" * 176, b"G" * 16)
+    return node_id, header, b"K" * 31 + b"%c" % (i % 256)
+
+
+def segment_files(path):
+    return sorted(x for x in os.listdir(path) if x.endswith(".seg"))
+
+
+def test_surb_log_add_pop(tmpdir):
+    params = SphinxParams(5, 1024)
+    store = SURBLogStore(params, str(tmpdir))
+    store.add(b"alice", make_nymtuple(1))
+    store.add(b"alice", make_nymtuple(2))
+    store.add(b"bob", make_nymtuple(3))
+    assert store.count(b"alice") == 2
+    assert store.pop(b"alice") == make_nymtuple(1)
+    assert store.pop(b"alice") == make_nymtuple(2)
+    assert store.pop(b"alice") is None
+    assert store.pop(b"bob") == make_nymtuple(3)
+    assert store.count(b"bob") == 0
+    store.close()
+
+
+def test_surb_log_restart(tmpdir):
+    params = SphinxParams(5, 1024)
+    store = SURBLogStore(params, str(tmpdir), sync_every=3)
+    for i in range(10):
+        store.add(b"alice", make_nymtuple(i))
+    for i in range(4):
+        assert store.pop(b"alice") == make_nymtuple(i)
+    store.close()
+
+    store = SURBLogStore(params, str(tmpdir))
+    assert store.count(b"alice") == 6
+    assert store.pop(b"alice") == make_nymtuple(4)
+    store.add(b"alice", make_nymtuple(10))
+    store.close()
+
+    store = SURBLogStore(params, str(tmpdir))
+    assert [store.pop(b"alice") for i in range(6)] == [make_nymtuple(i) for i in range(5, 11)]
+    assert store.pop(b"alice") is None
+    store.close()
+
+
+def test_surb_log_torn_tail(tmpdir):
+    params = SphinxParams(5, 1024)
+    store = SURBLogStore(params, str(tmpdir))
+    store.add(b"alice", make_nymtuple(1))
+    store.add(b"alice", make_nymtuple(2))
+    store.close()
+    last = os.path.join(str(tmpdir), segment_files(str(tmpdir))[-1])
+    with open(last, "r+b") as f:
+        f.truncate(os.path.getsize(last) - 10)
+
+    store = SURBLogStore(params, str(tmpdir))
+    assert store.count(b"alice") == 1
+    assert store.pop(b"alice") == make_nymtuple(1)
+    store.close()
+
+
+def test_surb_log_compaction(tmpdir):
+    params = SphinxParams(5, 1024)
+    store = SURBLogStore(params, str(tmpdir), segment_size=2048, compact_ratio=0.5)
+    for i in range(40):
+        store.add(b"alice", make_nymtuple(i))
+    for i in range(30):
+        assert store.pop(b"alice") == make_nymtuple(i)
+    before = segment_files(str(tmpdir))
+    assert len(before) > 2
+    store.maybe_compact()
+    assert len(segment_files(str(tmpdir))) < len(before)
+    assert store.garbage_ratio() == 0.0
+    assert store.pop(b"alice") == make_nymtuple(30)
+    store.close()
+
+    store = SURBLogStore(params, str(tmpdir))
+    assert [store.pop(b"alice") for i in range(9)] == [make_nymtuple(i) for i in range(31, 40)]
+    assert store.pop(b"alice") is None
+    store.close()
+
+
+def test_surb_log_params_mismatch(tmpdir):
+    store = SURBLogStore(SphinxParams(5, 1024), str(tmpdir))
+    store.add(b"alice", make_nymtuple(1))
+    store.close()
+    py.test.raises(SURBLogFormatError, SURBLogStore, SphinxParams(10, 1024), str(tmpdir))
+
+
+def test_nymserver_surb_log(tmpdir):
+    params = SphinxParams(5, 1024)
+    nymserver = Nymserver(params, surb_store=SURBLogStore(params, str(tmpdir)))
+    nymserver.add_surb(b"alice", make_nymtuple(1))
+    result = nymserver.process(b"alice", b"hello")
+    node_id, packet = result.message_result.next_hop
+    assert node_id == make_nymtuple(1)[0]
+    assert packet.header == make_nymtuple(1)[1]
+    assert len(packet.body.delta) == params.payload_size
+    py.test.raises(SphinxNoSURBSAvailableError, nymserver.process, b"alice", b"hello")
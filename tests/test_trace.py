@@ -0,0 +1,61 @@
+import py.test
+
+from sphinxmixcrypto import SphinxParams, SphinxPacket, PacketReplayCacheDict, TraceRecorder, TraceReader
+from sphinxmixcrypto import TraceFormatError, sphinx_packet_unwrap
+
+from tests.test_mix import RandReader
+from tests.test_instrumentation import new_route
+
+
+def test_trace_record_replay(tmpdir):
+    params = SphinxParams(5, 1024)
+    pki, route, key_states = new_route(2)
+    rand_reader = RandReader()
+    packets = [SphinxPacket.forward_message(params, route, pki, b"dest", b"hello %d" % i, rand_reader) for i in range(5)]
+    path = str(tmpdir.join("node.trace"))
+
+    received = []
+    with TraceRecorder(params, path, clock=iter([10.0, 10.5, 11.0, 11.5, 12.0]).__next__) as recorder:
+        node_input = recorder.wrap(received.append)
+        for packet in packets[:4]:
+            node_input(packet)
+        recorder.record(packets[4].get_raw_bytes())
+    assert received == packets[:4]
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 10)
+
+    reader = TraceReader(path)
+    assert reader.params == params
+    assert len(reader) == 5
+    records = list(reader.records())
+    assert [timestamp for timestamp, raw in records] == [10.0, 10.5, 11.0, 11.5, 12.0]
+    assert all(isinstance(raw, memoryview) for timestamp, raw in records)
+    assert records[2][1] == packets[2].get_raw_bytes()
+    assert list(reader.packets()) == packets
+    assert [len(x) for x in reader.batches(2)] == [2, 2, 1]
+
+    replay_cache = PacketReplayCacheDict()
+    results = []
+    assert reader.replay(lambda packet: results.append(
+        sphinx_packet_unwrap(params, replay_cache, key_states[route[0]], packet))) == 5
+    assert all(result.next_hop[0] == route[1] for result in results)
+
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    reader.replay(lambda packet: None, speed=2.0, sleep=sleep, clock=lambda: now[0])
+    assert sleeps == [0.25, 0.25, 0.25, 0.25]
+    reader.close()
+    reader.close()
+    assert records[2][1] == packets[2].get_raw_bytes()
+
+
+def test_trace_format_error(tmpdir):
+    path = tmpdir.join("bad.trace")
+    path.write(b"not a trace file")
+    py.test.raises(TraceFormatError, TraceReader, str(path))
+    path.write(b"SPH")
+    py.test.raises(TraceFormatError, TraceReader, str(path))
@@ -1,7 +1,10 @@
 
 
 from sphinxmixcrypto import prefix_free_decode, SECURITY_PARAMETER
-from sphinxmixcrypto import SphinxParams, SphinxPacket
+from sphinxmixcrypto import SphinxParams, SphinxPacket, SphinxHeader, SphinxBody, ClientMessage, UnwrappedMessage
+import sphinxmixcrypto
+
+import py.test
 
 
 def test_sphinx_packet_encode_decode():
@@ -72,3 +75,40 @@ def test_prefix_free_decode():
     assert message_type is None
     assert val is None
     assert rest is None
+
+
+def test_sphinx_params_value():
+    params = SphinxParams(5, 1024)
+    assert params == SphinxParams(5, 1024)
+    assert params != SphinxParams(5, 2048)
+    assert len(set([params, SphinxParams(5, 1024)])) == 1
+    assert repr(params) == "SphinxParams(max_hops=5, payload_size=1024)"
+    py.test.raises(AttributeError, setattr, params, "max_hops", 6)
+    py.test.raises(TypeError, SphinxParams, "5", 1024)
+
+
+def test_record_type_equality():
+    message = ClientMessage(b"a", b"b")
+    assert message == ClientMessage(b"a", b"b")
+    assert message != ClientMessage(b"a", b"c")
+    assert message != (b"a", b"b")
+    assert not message == (b"a", b"b")
+    assert hash(message) == hash(ClientMessage(b"a", b"b"))
+    assert hash(message) != hash((b"a", b"b"))
+    assert len(set([message, ClientMessage(b"a", b"b"), (b"a", b"b")])) == 2
+    header = SphinxHeader(b"A" * 32, b"B" * 176, b"G" * 16)
+    assert header != (b"A" * 32, b"B" * 176, b"G" * 16)
+    assert SphinxPacket(header, SphinxBody(b"D")) != (header, SphinxBody(b"D"))
+    assert SphinxPacket(header, SphinxBody(b"D")) == SphinxPacket(header, SphinxBody(b"D"))
+    assert UnwrappedMessage(None, None, None) != (None, None, None)
+
+
+def test_lazy_package_attributes():
+    # these names in __all__ have no definition
+    missing = set(["ReaplayError", "create_forward_message", "RandReader"])
+    for name in sphinxmixcrypto.__all__:
+        if name not in missing:
+            assert getattr(sphinxmixcrypto, name) is not None
+            assert name in dir(sphinxmixcrypto)
+    assert sphinxmixcrypto.NodeUnwrapper.__module__ == "sphinxmixcrypto.node"
+    py.test.raises(AttributeError, getattr, sphinxmixcrypto, "no_such_name")